@@ -5,13 +5,39 @@ import time
 import os
 from moviepy import VideoFileClip
 import wave
+import json
+from media_cache import MediaCache
+import frame_store
+from frame_store import FrameStore, FrameStoreWriter
+from media_clock import MediaClock
+from protocol import Muxer, read_record, CONTROL, VIDEO, AUDIO
+from adaptive import RenditionSelector
+from udp_transport import UdpSender
 
 # Define las constantes para la configuración del servidor y la gestión de archivos
 VIDEO_FOLDER = 'videos'  # Carpeta donde se guardan los archivos de video
 HOST = '10.21.49.46'      # Dirección IP del servidor
-VIDEO_PORT = 5000        # Puerto para la comunicación de datos de video
-AUDIO_PORT = 5001        # Puerto para la comunicación de datos de audio
+PORT = 5000              # Puerto de la conexión con cada cliente (control, video y audio, ver protocol.py)
 CHUNK_SIZE = 1024        # Tamaño de los fragmentos de datos de audio a enviar
+# Calidades en que se puede enviar el video, de la mejor a la peor: nombre, escala respecto al
+# video original y calidad JPEG. Cada sesión empieza en START_RENDITION y cambia según su enlace.
+RENDITIONS = [
+    ('alta', 1.0, 80),
+    ('media', 0.75, 60),
+    ('baja', 0.5, 45),
+    ('minima', 0.35, 35),
+]
+START_RENDITION = 1
+VIDEO_LEAD = 0.1         # Segundos de antelación con que se envía cada fotograma respecto a su PTS
+AUDIO_LEAD = 0.3         # Segundos de antelación con que se envía cada fragmento de audio
+MAX_VIDEO_LATENESS = 0.1 # Segundos de retraso a partir de los cuales un fotograma se descarta
+UDP_LOSS = 0.0           # Fracción de paquetes UDP que se pierden a propósito (para pruebas en loopback)
+UDP_REORDER = 0.0        # Fracción de paquetes UDP que se desordenan a propósito (para pruebas en loopback)
+CACHE_FOLDER = 'cache'   # Carpeta de la caché de datos derivados de los videos (audio y fotogramas)
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # Tamaño máximo de la caché antes de borrar las entradas menos usadas
+PREWARM_INTERVAL = 30    # Segundos entre revisiones de VIDEO_FOLDER en busca de videos nuevos
+
+media_cache = None       # Caché compartida por todas las sesiones (se crea en main)
 
 def get_video_list():
     """
@@ -22,65 +48,257 @@ def get_video_list():
         os.makedirs(VIDEO_FOLDER)
     return [f for f in os.listdir(VIDEO_FOLDER) if f.endswith('.mp4')]
 
-def send_video(client_socket, video_path, stop_event):
+def extract_audio(video_path, audio_path):
+    """
+    Extrae la pista de audio de un video a un archivo WAV PCM de 16 bits usando moviepy.
+    La llama la caché solo cuando el audio de ese video todavía no está extraído.
+    """
+    print(f"Extrayendo audio de {os.path.basename(video_path)}...")
+    video_clip = VideoFileClip(video_path)
+    try:
+        if video_clip.audio is None:
+            raise ValueError(f"{os.path.basename(video_path)} no tiene pista de audio")
+        video_clip.audio.write_audiofile(audio_path, codec='pcm_s16le', logger=None)
+    finally:
+        video_clip.close()
+
+def frames_suffix(rendition):
+    """Extensión de la entrada de la caché con los fotogramas de un video en la calidad 'rendition'."""
+    _, scale, quality = RENDITIONS[rendition]
+    return f".s{int(scale * 100)}q{quality}.v{frame_store.VERSION}.frames"
+
+def encode_frame(frame, rendition):
+    """Redimensiona un fotograma y lo codifica como una imagen JPEG en la calidad 'rendition'."""
+    _, scale, quality = RENDITIONS[rendition]
+    frame_reducido = cv2.resize(frame, (0, 0), fx=scale, fy=scale) if scale != 1.0 else frame
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    _, buffer = cv2.imencode('.jpg', frame_reducido, encode_param)
+    return buffer.tobytes()
+
+def frame_pts(videoCapture, number, fps):
+    """PTS en segundos del fotograma recién leído (si el video no lo da, se calcula con el FPS)."""
+    msec = videoCapture.get(cv2.CAP_PROP_POS_MSEC)
+    return msec / 1000 if msec > 0 or number == 0 else number / fps
+
+def build_frame_store(video_path, store_path, rendition):
+    """
+    Codifica todos los fotogramas de un video en la calidad 'rendition' en un almacén de
+    fotogramas (ver frame_store.py). La llama la caché solo cuando el almacén todavía no existe.
+    """
+    videoCapture = cv2.VideoCapture(video_path)
+    if not videoCapture.isOpened():
+        raise ValueError(f"No se pudo abrir el archivo de video en {video_path}")
+    fps = videoCapture.get(cv2.CAP_PROP_FPS) or 30  # Valor por defecto si no se encuentra el FPS
+
+    print(f"Codificando fotogramas de {os.path.basename(video_path)} en calidad {RENDITIONS[rendition][0]}...")
+    writer = FrameStoreWriter(store_path, fps)
+    try:
+        number = 0
+        while True:
+            ret, frame = videoCapture.read()
+            if not ret:
+                break
+            writer.add(encode_frame(frame, rendition), frame_pts(videoCapture, number, fps))
+            number += 1
+    finally:
+        writer.close()
+        videoCapture.release()
+
+def frame_store_builder(rendition):
+    return lambda video_path, store_path: build_frame_store(video_path, store_path, rendition)
+
+# Datos que se guardan en la caché para cada video: extensión de la entrada y función que la genera
+CACHED_MEDIA = [('.wav', extract_audio)] + [(frames_suffix(r), frame_store_builder(r)) for r in range(len(RENDITIONS))]
+
+def warm_cache(video_path, suffix, build):
+    """Genera la entrada de la caché de un video si no existe, sin quedarse con ella."""
+    media_cache.release(media_cache.acquire(video_path, suffix, build))
+
+def warm_frame_stores(video_path):
+    """Genera en segundo plano los almacenes de fotogramas que le falten a un video."""
+    def build_missing():
+        for rendition in range(len(RENDITIONS)):
+            try:
+                warm_cache(video_path, frames_suffix(rendition), frame_store_builder(rendition))
+            except Exception as e:
+                print(f"No se pudieron codificar los fotogramas de {os.path.basename(video_path)}: {e}")
+                return
+    threading.Thread(target=build_missing, daemon=True).start()
+
+def prewarm_cache():
     """
-    Transmite los fotogramas de video a un cliente a través de un socket.
-    - Lee los fotogramas del video usando OpenCV.
-    - Redimensiona y codifica cada fotograma como una imagen JPEG para reducir el tamaño de los datos.
-    - Envía primero el tamaño de los datos del fotograma (4 bytes), seguido de los datos del fotograma en sí.
+    Hilo en segundo plano que extrae el audio y codifica los fotogramas de todos los videos de
+    VIDEO_FOLDER que aún no están en la caché: al arrancar y después cada PREWARM_INTERVAL
+    segundos, para los videos nuevos o modificados. Así el primer PLAY de un video no espera.
+    """
+    failed = set()  # Entradas que ya fallaron, para no reintentarlas en cada revisión
+    while True:
+        for name in get_video_list():
+            video_path = os.path.join(VIDEO_FOLDER, name)
+            for suffix, build in CACHED_MEDIA:
+                entry = None
+                try:
+                    entry = media_cache.key(video_path) + suffix
+                    if entry in failed or media_cache.contains(video_path, suffix):
+                        continue
+                    warm_cache(video_path, suffix, build)
+                except FileNotFoundError:
+                    break  # Se borró mientras se revisaba la carpeta
+                except Exception as e:
+                    failed.add(entry)
+                    print(f"No se pudo preparar {suffix} de {name}: {e}")
+        time.sleep(PREWARM_INTERVAL)
+
+def send_rendition(muxer, rendition):
+    """
+    Avisa al cliente, en el canal de control, de la calidad de los fotogramas que siguen:
+    el mensaje 'RENDITION' con los datos de la calidad en JSON.
+    """
+    name, scale, quality = RENDITIONS[rendition]
+    muxer.send_control("RENDITION\n" + json.dumps({'rendition': name, 'scale': scale, 'quality': quality}))
+
+def send_video(muxer, video_path, stop_event, clock, udp, feedback):
+    """
+    Transmite los fotogramas de video a un cliente por el canal de video de su conexión ('muxer'),
+    o por UDP si el cliente lo pidió ('udp', ver udp_transport.py).
+    - Si el video ya tiene sus almacenes de fotogramas codificados en la caché, envía sus bytes tal cual.
+    - Si no, pide generarlos en segundo plano y mientras tanto codifica los fotogramas en vivo.
+    - Cada fotograma va en un registro con su PTS y al terminar se envía el mensaje de control 'END_STREAM'.
+    - Cada fotograma sale VIDEO_LEAD segundos antes de su PTS según el reloj de la sesión ('clock');
+      los que ya van más de MAX_VIDEO_LATENESS segundos tarde se descartan.
+    - La calidad se adapta al enlace del cliente (ver adaptive.py) y cada cambio se avisa con 'send_rendition'.
+      Por UDP se adapta a la pérdida de paquetes que informa el cliente, que llega en 'feedback'.
     - Utiliza un 'stop_event' para detener la transmisión de forma segura.
     """
+    print(f"Transmitiendo video: {os.path.basename(video_path)}" + (" por UDP" if udp else ""))
+    store_paths = [media_cache.acquire_existing(video_path, frames_suffix(r)) for r in range(len(RENDITIONS))]
+    try:
+        if all(store_paths):
+            send_stored_frames(muxer, store_paths, stop_event, clock, udp, feedback)
+        else:
+            warm_frame_stores(video_path)
+            send_encoded_frames(muxer, video_path, stop_event, clock, udp, feedback)
+    finally:
+        for store_path in store_paths:
+            if store_path:
+                media_cache.release(store_path)
+        if udp:
+            udp.close()
+
+    # Señala el final de la transmisión de video
+    if not stop_event.is_set():
+        try:
+            muxer.send_control("END_STREAM")
+        except:
+            pass
+    print("Transmisión de video finalizada.")
+
+def send_stored_frames(muxer, store_paths, stop_event, clock, udp, feedback):
+    """
+    Envía los fotogramas ya codificados de los almacenes (uno por calidad) con 'sendfile', sin
+    decodificar ni codificar nada: el costo por cliente es casi nulo. Todos los almacenes tienen
+    los mismos fotogramas, así que cambiar de calidad es seguir enviando desde otro almacén.
+    """
+    stores = [FrameStore(path) for path in store_paths]
+    intervalo = 1 / stores[0].fps  # Tiempo entre fotogramas a la velocidad original
+    # Tamaño medio de los fotogramas de cada calidad (los fotogramas van antes del índice)
+    selector = RenditionSelector([store.index / max(store.count, 1) for store in stores], START_RENDITION, intervalo)
+    rendition = None
+    dropped = 0
+    try:
+        for number in range(min(store.count for store in stores)):
+            if stop_event.is_set():
+                break
+            pts = stores[0].pts(number)
+            if clock.lateness(pts) > MAX_VIDEO_LATENESS:
+                dropped += 1  # Llegaría tarde: se salta en vez de retrasar a los siguientes
+                continue
+            clock.wait_until(pts, stop_event, VIDEO_LEAD)
+            if stop_event.is_set():
+                break
+            try:
+                if selector.current != rendition:
+                    rendition = selector.current
+                    send_rendition(muxer, rendition)
+                start = time.perf_counter()
+                if udp:
+                    size = udp.send_frame(pts, stores[rendition].frame(number))
+                else:
+                    size = stores[rendition].send(muxer, number)
+                selector.observe(size, time.perf_counter() - start)
+                if 'loss' in feedback:
+                    selector.report_loss(feedback.pop('loss'))
+            except OSError:
+                # Si el envío falla, se asume que el cliente se desconectó y se detiene el stream
+                stop_event.set()
+                break
+    finally:
+        for store in stores:
+            store.close()
+    print(f"Video enviado: {selector.summary()}, {dropped} fotogramas descartados por retraso")
+
+def send_encoded_frames(muxer, video_path, stop_event, clock, udp, feedback):
+    """
+    Lee los fotogramas del video con OpenCV y los codifica uno a uno mientras los envía.
+    Solo se usa hasta que los almacenes de fotogramas del video están listos.
+    """
     videoCapture = cv2.VideoCapture(video_path)
     if not videoCapture.isOpened():
         print(f"Error: No se pudo abrir el archivo de video en {video_path}")
         return
 
-    # Obtiene las propiedades del video para calcular el retraso entre fotogramas
+    # Obtiene las propiedades del video para calcular el PTS de cada fotograma
     fps = videoCapture.get(cv2.CAP_PROP_FPS)
     if fps == 0:
         fps = 30  # Valor por defecto si no se encuentra el FPS
-    intervalo = 1 / fps  # Tiempo de espera entre fotogramas para mantener la velocidad original
+    intervalo = 1 / fps  # Tiempo entre fotogramas a la velocidad original
+    # Sin almacenes no se conoce el tamaño de cada calidad: se aproxima por el área de los fotogramas
+    selector = RenditionSelector([scale ** 2 for _, scale, _ in RENDITIONS], START_RENDITION, intervalo)
+    rendition = None
+    dropped = 0
+    number = -1
 
-    print(f"Transmitiendo video: {os.path.basename(video_path)}")
     while not stop_event.is_set():
+        number += 1
+        if clock.lateness(number * intervalo) > MAX_VIDEO_LATENESS:
+            # Llegaría tarde: se salta sin decodificarlo ni codificarlo
+            if not videoCapture.grab():
+                break
+            dropped += 1
+            continue
         ret, frame = videoCapture.read()
         if not ret:
             break  # Fin del archivo de video
-
-        # Redimensiona el fotograma al 75% de su tamaño original para reducir la carga de la red
-        frame_reducido = cv2.resize(frame, (0, 0), fx=0.75, fy=0.75)
-        
-        # Codifica el fotograma como una imagen JPEG con una calidad del 60%
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 60]
-        _, buffer = cv2.imencode('.jpg', frame_reducido, encode_param)
-        data = buffer.tobytes()
+        pts = frame_pts(videoCapture, number, fps)
+        data = encode_frame(frame, selector.current)
+        clock.wait_until(pts, stop_event, VIDEO_LEAD)
+        if stop_event.is_set():
+            break
         
         try:
-            # Envía el tamaño de los datos del fotograma y luego los datos
-            client_socket.sendall(len(data).to_bytes(4, byteorder='big'))
-            client_socket.sendall(data)
-        except:
+            if selector.current != rendition:
+                rendition = selector.current
+                send_rendition(muxer, rendition)
+            # Envía el fotograma con su PTS
+            start = time.perf_counter()
+            size = udp.send_frame(pts, data) if udp else muxer.send(VIDEO, data, pts)
+            selector.observe(size, time.perf_counter() - start)
+            if 'loss' in feedback:
+                selector.report_loss(feedback.pop('loss'))
+        except OSError:
             # Si el envío falla, se asume que el cliente se desconectó y se detiene el stream
             stop_event.set()
             break
-        
-        # Pausa por el intervalo calculado para mantener el FPS original del video
-        time.sleep(intervalo)
     
     videoCapture.release()
-    # Señala el final de la transmisión de video enviando un fotograma de tamaño cero
-    if not stop_event.is_set():
-        try:
-            client_socket.sendall((0).to_bytes(4, byteorder='big'))
-        except:
-            pass
-    print("Transmisión de video finalizada.")
+    print(f"Video enviado: {selector.summary()}, {dropped} fotogramas descartados por retraso")
 
-def send_audio(client_socket, audio_path, stop_event):
+def send_audio(muxer, audio_path, stop_event, clock):
     """
-    Transmite los datos de audio de un archivo WAV a un cliente.
+    Transmite los datos de audio de un archivo WAV a un cliente por el canal de audio de su conexión ('muxer').
     - Lee los datos de audio en fragmentos.
-    - Envía cada fragmento a través del socket.
+    - Envía cada fragmento en un registro con su PTS, AUDIO_LEAD segundos antes de ese PTS
+      según el reloj de la sesión ('clock'). El audio nunca se descarta.
     - Utiliza un 'stop_event' para detener la transmisión de forma segura.
     """
     try:
@@ -91,13 +309,20 @@ def send_audio(client_socket, audio_path, stop_event):
         return
 
     print(f"Transmitiendo audio: {os.path.basename(audio_path)}")
+    rate = wf.getframerate()
+    position = 0  # Muestras enviadas hasta ahora
     while not stop_event.is_set():
         data = wf.readframes(CHUNK_SIZE)
         if not data:
             break  # Fin del archivo de audio
+        pts = position / rate
+        position += len(data) // (wf.getsampwidth() * wf.getnchannels())
+        clock.wait_until(pts, stop_event, AUDIO_LEAD)
+        if stop_event.is_set():
+            break
         
         try:
-            client_socket.sendall(data)
+            muxer.send(AUDIO, data, pts)
         except:
             # Si el envío falla, se asume que el cliente se desconectó
             stop_event.set()
@@ -105,66 +330,104 @@ def send_audio(client_socket, audio_path, stop_event):
     
     wf.close()
     print("Transmisión de audio finalizada.")
-    try:
-        client_socket.close()
-    except:
-        pass
+
+def stop_stream(stop_event, *threads):
+    """
+    Detiene los hilos de una transmisión y espera a que terminen. Después ya ninguno escribe
+    en la conexión del cliente, que puede llevar la transmisión siguiente sin mezclar registros.
+    """
+    stop_event.set()
+    for thread in threads:
+        if thread:
+            thread.join()
 
 def handle_client(video_conn, addr):
     """
     Maneja una conexión de cliente individual.
     - Gestiona todo el ciclo de interacción con el cliente.
     - Envía un menú de videos disponibles.
-    - Espera los comandos 'PLAY', 'STOP' o 'EXIT'.
-    - Extrae el audio del video seleccionado y lanza hilos separados para la transmisión de video y audio.
+    - Espera los comandos 'PLAY', 'STOP' o 'EXIT'. Con 'PLAY n UDP puerto' el video va por UDP a ese puerto.
+    - Toma el audio del video seleccionado de la caché y lanza hilos separados para la transmisión de video y audio.
+    - Recibe las estadísticas de recepción UDP del cliente ('UDP_STATS') y pasa su pérdida al hilo de video.
     """
-    print(f"Cliente {addr} conectado al puerto de video.")
+    print(f"Cliente {addr} conectado.")
     video_list = get_video_list()
     video_sender_thread, audio_sender_thread = None, None
+    audio_path = None  # Entrada de la caché que usa la transmisión actual
+    feedback = {}      # Pérdida de paquetes informada por el cliente, para el hilo de video
+    udp_stats = None   # Últimas estadísticas de recepción UDP de la transmisión actual
     stop_event = threading.Event()  # Evento para señalar a los hilos que se detengan
+    muxer = Muxer(video_conn)  # Los hilos de la sesión comparten la conexión
 
     try:
         # Prepara y envía el menú de videos al cliente
         menu_str = "MENU\n" + "\n".join(f"{i+1}. {name}" for i, name in enumerate(video_list))
-        video_conn.sendall(menu_str.encode('utf-8'))
+        muxer.send_control(menu_str)
 
         while True:
             # Espera un comando del cliente
-            command_data = video_conn.recv(1024)
-            if not command_data:
+            record = read_record(video_conn)
+            if not record:
                 break  # Cliente desconectado
+            channel, _, command_data = record
+            if channel != CONTROL:
+                continue
             
-            command = command_data.decode('utf-8').strip().upper()
+            text = command_data.decode('utf-8').strip()
+            command = text.upper()
+
+            # Las estadísticas de recepción UDP no interrumpen la transmisión en curso
+            if command.startswith('UDP_STATS'):
+                try:
+                    udp_stats = json.loads(text.split('\n', 1)[1])
+                    feedback['loss'] = udp_stats['loss_rate']
+                except (IndexError, KeyError, ValueError):
+                    pass
+                continue
             print(f"Comando de {addr}: '{command}'")
 
-            # Si ya hay una transmisión activa, la detiene antes de iniciar una nueva
-            if video_sender_thread and video_sender_thread.is_alive():
-                stop_event.set()  # Señala a los hilos para que paren
-                video_sender_thread.join()
-                audio_sender_thread.join()
+            # Detiene la transmisión anterior antes de iniciar una nueva. Aunque el video haya
+            # terminado, el audio (si dura más) puede seguir enviándose y leyendo su archivo
+            if video_sender_thread:
+                stop_stream(stop_event, video_sender_thread, audio_sender_thread)
+                video_sender_thread, audio_sender_thread = None, None
+            if audio_path:
+                media_cache.release(audio_path)  # La transmisión anterior ya no lee su audio
+                audio_path = None
+            if udp_stats:
+                print(f"Recepción UDP de {addr}: {udp_stats}")
+                udp_stats = None
             
             stop_event.clear()  # Limpia el evento de parada para la siguiente transmisión
 
             if command.startswith('PLAY'):
                 try:
-                    video_index = int(command.split()[1]) - 1
+                    parts = command.split()
+                    video_index = int(parts[1]) - 1
                     if 0 <= video_index < len(video_list):
                         video_path = os.path.join(VIDEO_FOLDER, video_list[video_index])
-                        audio_path = f"temp_{addr[1]}.wav"
                         
-                        # Usa moviepy para extraer el audio del archivo de video
-                        print(f"Extrayendo audio de {video_list[video_index]}...")
-                        video_clip = VideoFileClip(video_path)
-                        video_clip.audio.write_audiofile(audio_path, codec='pcm_s16le')
+                        # Toma el audio extraído de la caché (lo extrae solo si nadie lo hizo antes)
+                        try:
+                            audio_path = media_cache.acquire(video_path, '.wav', extract_audio)
+                        except Exception as e:
+                            print(f"No se pudo extraer el audio de {video_list[video_index]}: {e}")
+                            muxer.send_control("ERROR\nNo se pudo preparar el video")
+                            muxer.send_control(menu_str)
+                            continue
                         
-                        video_conn.sendall(b'START_STREAM')  # Informa al cliente que se prepare para el stream
+                        # El cliente puede pedir el video por UDP, al puerto que indica en su dirección
+                        udp = None
+                        if len(parts) >= 4 and parts[2] == 'UDP':
+                            udp = UdpSender((addr[0], int(parts[3])), UDP_LOSS, UDP_REORDER)
                         
-                        # Espera a que el cliente se conecte al puerto de audio
-                        audio_conn, _ = audio_server_socket.accept()
+                        muxer.send_control("START_STREAM")  # Informa al cliente que se prepare para el stream
                         
-                        # Inicia hilos separados para la transmisión de video y audio
-                        video_sender_thread = threading.Thread(target=send_video, args=(video_conn, video_path, stop_event))
-                        audio_sender_thread = threading.Thread(target=send_audio, args=(audio_conn, audio_path, stop_event))
+                        # Inicia hilos separados para la transmisión de video y audio, con un mismo reloj
+                        clock = MediaClock()
+                        feedback = {}
+                        video_sender_thread = threading.Thread(target=send_video, args=(muxer, video_path, stop_event, clock, udp, feedback))
+                        audio_sender_thread = threading.Thread(target=send_audio, args=(muxer, audio_path, stop_event, clock))
                         
                         video_sender_thread.start()
                         audio_sender_thread.start()
@@ -172,57 +435,50 @@ def handle_client(video_conn, addr):
                         raise IndexError
                 except (IndexError, ValueError):
                     # Maneja comandos 'PLAY' inválidos
-                    video_conn.sendall("ERROR\nÍndice inválido".encode('utf-8'))
-                    video_conn.sendall(menu_str.encode('utf-8'))
+                    muxer.send_control("ERROR\nÍndice inválido")
+                    muxer.send_control(menu_str)
             
             elif command == 'STOP':
                 # El comando 'STOP' ya es manejado al principio del bucle, así que solo reenvía el menú
-                video_conn.sendall(menu_str.encode('utf-8'))
+                muxer.send_control(menu_str)
             
             elif command == 'EXIT':
                 break  # Sale del bucle para cerrar la conexión
 
     finally:
         # Limpia los recursos cuando el cliente se desconecta o ocurre un error
-        stop_event.set()
-        if video_sender_thread and video_sender_thread.is_alive():
-            video_sender_thread.join()
-        if audio_sender_thread and audio_sender_thread.is_alive():
-            audio_sender_thread.join()
+        stop_stream(stop_event, video_sender_thread, audio_sender_thread)
+        
+        if audio_path:
+            media_cache.release(audio_path)
         
         video_conn.close()
         print(f"Sesión con {addr} terminada.")
-        
-        # Elimina el archivo de audio temporal
-        audio_path = f"temp_{addr[1]}.wav"
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
 
 def main():
     """
     Función principal para iniciar y ejecutar el servidor.
-    - Crea y enlaza dos sockets: uno para video y otro para audio.
+    - Abre la caché de audio y fotogramas y arranca el hilo que la precalienta.
+    - Crea y enlaza el socket del servidor (una conexión por cliente para control, video y audio).
     - Entra en un bucle infinito para aceptar nuevas conexiones de clientes.
     - Inicia un nuevo hilo para cada cliente para manejar sus solicitudes.
     """
-    global audio_server_socket
+    global media_cache
     
-    # Crea y configura el socket del servidor de video
+    media_cache = MediaCache(CACHE_FOLDER, CACHE_MAX_BYTES)
+    threading.Thread(target=prewarm_cache, daemon=True).start()
+    
+    # Crea y configura el socket del servidor
     video_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    video_server_socket.bind((HOST, VIDEO_PORT))
+    video_server_socket.bind((HOST, PORT))
     video_server_socket.listen(5)
-
-    # Crea y configura el socket del servidor de audio
-    audio_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    audio_server_socket.bind((HOST, AUDIO_PORT))
-    audio_server_socket.listen(5)
     
     print(f"Conectado en {HOST} esperando conexión del usuario...")
     
     # Bucle principal para aceptar nuevas conexiones
     while True:
         video_conn, addr = video_server_socket.accept()
-        # Inicia un nuevo hilo para manejar la conexión de video del cliente
+        # Inicia un nuevo hilo para manejar la conexión del cliente
         threading.Thread(target=handle_client, args=(video_conn, addr)).start()
 
 if __name__ == '__main__':
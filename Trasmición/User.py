@@ -3,46 +3,82 @@ import cv2
 import numpy as np
 import pyaudio
 import threading
+import queue
+import json
+import time
+from media_clock import PlaybackClock
+from protocol import pack, read_record, CONTROL, VIDEO, AUDIO
+from udp_transport import Reassembler
 
 # Constantes de conexión y configuración
 HOST = '10.21.49.46'      # Dirección IP del servidor
-VIDEO_PORT = 5000        # Puerto para el flujo de video
-AUDIO_PORT = 5001        # Puerto para el flujo de audio
+PORT = 5000              # Puerto de la conexión con el servidor (control, video y audio, ver protocol.py)
+USE_UDP = False          # Recibir el video por UDP: se pierden fotogramas en vez de congelar la imagen
+UDP_STATS_INTERVAL = 1.0 # Segundos entre informes de la recepción UDP al servidor
 CHUNK = 1024             # Tamaño del fragmento de audio
+AUDIO_RATE = 44100       # Frecuencia de muestreo del audio que envía el servidor
+AUDIO_FRAME_BYTES = 4    # Bytes por muestra: 16 bits y 2 canales
+MAX_LATENESS = 0.1       # Segundos de retraso respecto al audio a partir de los cuales un fotograma se descarta
 WINDOW_NAME = 'Video'    # Nombre de la ventana de visualización de video
+DISPLAY_SCALE = 0.75     # Tamaño de la ventana respecto al video original, sea cual sea la calidad recibida
 
-def recvall(sock, n):
+def send_command(sock, command):
+    """Envía un comando al servidor por el canal de control."""
+    sock.sendall(pack(CONTROL, command.encode('utf-8')))
+
+def read_connection(sock, events):
+    """
+    Hilo que lee los registros de la conexión con el servidor y los deja en 'events'.
+    Pone None cuando la conexión se cierra.
+    """
+    try:
+        while True:
+            record = read_record(sock)
+            if not record:
+                break
+            events.put(record)
+    except OSError:
+        pass
+    events.put(None)
+
+def receive_udp(udp_socket, reassembler, events, stop_event):
     """
-    Función auxiliar para asegurar la recepción de 'n' bytes completos desde un socket.
-    Evita que los datos se reciban de forma parcial.
+    Hilo que recibe los paquetes de video por UDP, recompone los fotogramas y deja en 'events'
+    los que salen del búfer de jitter, como si hubieran llegado por la conexión.
     """
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None  # Retorna None si la conexión se cierra
-        data += packet
-    return data
-
-def receive_audio(stop_event):
+    udp_socket.settimeout(0.01)
+    while not stop_event.is_set():
+        try:
+            reassembler.feed(udp_socket.recv(65535), time.perf_counter())
+        except socket.timeout:
+            pass
+        except OSError:
+            break
+        for pts, data in reassembler.pop(time.perf_counter()):
+            events.put((VIDEO, pts, data))
+
+def play_audio(audio_queue, stop_event, clock):
     """
-    Maneja la recepción y reproducción del flujo de audio en un hilo separado.
-    - Se conecta al puerto de audio del servidor.
+    Maneja la reproducción del flujo de audio en un hilo separado.
+    - Recibe de 'audio_queue' los fragmentos (PTS y datos) que llegan por la conexión; None indica el final.
     - Utiliza PyAudio para reproducir los fragmentos de audio recibidos.
-    - El 'stop_event' detiene la reproducción cuando el video termina o el usuario lo solicita.
+    - Tras cada fragmento ancla el reloj de reproducción ('clock') al PTS que está sonando.
+    - El 'stop_event' detiene la reproducción cuando el usuario lo solicita.
     """
-    audio_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        audio_socket.connect((HOST, AUDIO_PORT))
         p = pyaudio.PyAudio()
         # Abre un stream de audio con la misma configuración que el servidor
-        stream = p.open(format=pyaudio.paInt16, channels=2, rate=44100, output=True, frames_per_buffer=CHUNK)
-        
+        stream = p.open(format=pyaudio.paInt16, channels=2, rate=AUDIO_RATE, output=True, frames_per_buffer=CHUNK)
+
         while not stop_event.is_set():
-            data = audio_socket.recv(CHUNK)
-            if not data:
+            item = audio_queue.get()
+            if item is None:
                 break  # Fin de la transmisión de audio
+            pts, data = item
             stream.write(data)
+            # Lo escrito termina de sonar tras la latencia de salida: eso es lo que suena ahora
+            end = pts + len(data) / (AUDIO_RATE * AUDIO_FRAME_BYTES)
+            clock.sync(end - stream.get_output_latency())
     except Exception as e:
         print(f"Error en el hilo de audio: {e}")
     finally:
@@ -52,69 +88,128 @@ def receive_audio(stop_event):
             stream.close()
         if 'p' in locals():
             p.terminate()
-        audio_socket.close()
 
-def watch_video(video_socket):
+def watch_video(sock, events, udp_socket=None):
     """
-    Gestiona la recepción y visualización del flujo de video.
-    - Inicia un hilo para la reproducción de audio.
-    - Muestra los fotogramas de video recibidos en una ventana de OpenCV.
+    Gestiona la recepción y visualización de una transmisión.
+    - Lee los registros que llegan a 'events': el audio pasa al hilo que lo reproduce, que marca
+      el reloj de reproducción, y el video se muestra en una ventana de OpenCV.
+    - Si se pidió el video por UDP ('udp_socket'), un hilo lo recibe y recompone los fotogramas,
+      y cada UDP_STATS_INTERVAL segundos se informa al servidor de las pérdidas y el desorden.
+    - Muestra cada fotograma cuando el reloj llega a su PTS y descarta los que llegan tarde.
+    - Atiende los avisos de cambio de calidad del servidor y reescala los fotogramas para que la ventana no cambie de tamaño.
     - Detecta las pulsaciones de teclas ('m' para menú, 'q' para salir).
     - El bucle termina cuando el video se completa, se presiona una tecla o la conexión se pierde.
     """
     stop_event = threading.Event()
-    audio_thread = threading.Thread(target=receive_audio, args=(stop_event,))
+    clock = PlaybackClock()
+    audio_queue = queue.Queue()
+    audio_thread = threading.Thread(target=play_audio, args=(audio_queue, stop_event, clock))
     audio_thread.start()
-    
+
+    udp_stop = threading.Event()
+    reassembler = Reassembler()
+    if udp_socket:
+        udp_thread = threading.Thread(target=receive_udp, args=(udp_socket, reassembler, events, udp_stop))
+        udp_thread.start()
+    next_report = time.perf_counter() + UDP_STATS_INTERVAL
+
     return_status = 'menu'
-    
+    finished = False     # El servidor terminó de enviar el video
+    scale = None         # Escala de los fotogramas que se están recibiendo respecto al video original
+    display_size = None  # Tamaño fijo (ancho, alto) con que se muestran los fotogramas
+    dropped = 0
+
     cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
-    
+
     print("Iniciando video.")
     print("Presiona 'm' para ir al menú o 'q' para desconectarte.")
     try:
         while True:
-            # Recibe el tamaño del fotograma (4 bytes)
-            size_data = recvall(video_socket, 4)
-            if not size_data:
-                return_status = 'exit'
-                break
-            
-            size = int.from_bytes(size_data, byteorder='big')
-            
-            # Si el tamaño es 0, significa que el servidor ha terminado de enviar el video
-            if size == 0:
-                print("El video ha terminado.")
-                video_socket.sendall(b'STOP') 
-                return_status = 'menu'
-                break
+            if udp_socket and time.perf_counter() >= next_report:
+                # Informa al servidor de la recepción UDP para que adapte la calidad
+                stats = reassembler.stats()
+                stats['loss_rate'] = round(reassembler.interval_loss(), 3)
+                send_command(sock, "UDP_STATS\n" + json.dumps(stats))
+                next_report = time.perf_counter() + UDP_STATS_INTERVAL
 
-            # Recibe los datos completos del fotograma
-            image_data = recvall(video_socket, size)
-            if not image_data:
+            try:
+                record = events.get(timeout=UDP_STATS_INTERVAL)
+            except queue.Empty:
+                continue
+            if not record:
                 return_status = 'exit'
                 break
-                
+            channel, pts, payload = record
+
+            if channel == AUDIO:
+                audio_queue.put((pts, payload))
+                continue
+
+            if channel == CONTROL:
+                message = payload.decode('utf-8')
+                # El servidor ha terminado de enviar el video
+                if message.startswith("END_STREAM"):
+                    print("El video ha terminado.")
+                    send_command(sock, 'STOP')
+                    finished = True
+                    return_status = 'menu'
+                    break
+                # El servidor cambió la calidad: los fotogramas que siguen tienen otra escala
+                if message.startswith("RENDITION"):
+                    rendition = json.loads(message.split('\n', 1)[1])
+                    scale = rendition['scale']
+                    print(f"Calidad del video: {rendition['rendition']}")
+                continue
+
+            if channel != VIDEO:
+                continue
+
+            # Sin audio todavía, el primer fotograma pone el reloj en marcha
+            clock.sync(pts, force=False)
+            delay = pts - clock.now()
+            if delay < -MAX_LATENESS:
+                dropped += 1  # Ya debería haberse mostrado: se salta sin decodificarlo
+                continue
+
             # Decodifica la imagen JPEG en un fotograma de OpenCV
-            frame = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
 
             if frame is not None:
-                # Muestra el fotograma en la ventana
+                if display_size is None:
+                    # Tamaño de la ventana a partir del primer fotograma y de su escala
+                    factor = DISPLAY_SCALE / scale if scale else 1.0
+                    display_size = (round(frame.shape[1] * factor), round(frame.shape[0] * factor))
+                if (frame.shape[1], frame.shape[0]) != display_size:
+                    frame = cv2.resize(frame, display_size)
+                # Espera a que le toque al fotograma (atendiendo las teclas mientras tanto)
+                wait_ms = int((pts - clock.now()) * 1000)
+                key = cv2.waitKey(wait_ms) & 0xFF if wait_ms > 0 else 0xFF
+                # Muestra el fotograma en la ventana y captura las pulsaciones de teclas
                 cv2.imshow(WINDOW_NAME, frame)
-                # Espera 1ms y captura las pulsaciones de teclas
-                key = cv2.waitKey(1) & 0xFF
+                if key == 0xFF:
+                    key = cv2.waitKey(1) & 0xFF
                 if key == ord('q'):
-                    video_socket.sendall(b'EXIT')
+                    send_command(sock, 'EXIT')
                     return_status = 'exit'
                     break
                 elif key == ord('m'):
-                    video_socket.sendall(b'STOP')
+                    send_command(sock, 'STOP')
                     return_status = 'menu'
                     break
     finally:
-        # Asegura que el hilo de audio se detenga y se cierre la ventana de OpenCV
-        stop_event.set()
+        # Deja terminar el audio que ya llegó si el video acabó solo; si no, lo corta.
+        # Después se cierra la ventana de OpenCV
+        if not finished:
+            stop_event.set()
+        audio_queue.put(None)
         audio_thread.join()
+        if udp_socket:
+            udp_stop.set()
+            udp_thread.join()
+            print(f"Recepción UDP: {reassembler.stats()}")
+        if dropped:
+            print(f"Fotogramas descartados por llegar tarde: {dropped}")
         if cv2.getWindowProperty(WINDOW_NAME, 0) >= 0:
             cv2.destroyWindow(WINDOW_NAME)
 
@@ -123,50 +218,70 @@ def watch_video(video_socket):
 def main():
     """
     Función principal para gestionar la conexión y la interacción con el usuario.
-    - Se conecta al socket de video del servidor.
+    - Se conecta al servidor (una sola conexión para control, video y audio) y lee sus registros en un hilo.
     - Maneja el menú de videos y los comandos del usuario.
     - Llama a `watch_video` cuando se inicia una transmisión.
     """
-    video_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        video_socket.connect((HOST, VIDEO_PORT))
+        sock.connect((HOST, PORT))
         print("Conectado al servidor")
     except Exception as e:
         print(f"Error al conectar: {e}")
         return
 
+    events = queue.Queue()
+    threading.Thread(target=read_connection, args=(sock, events), daemon=True).start()
+    udp_socket = None  # Socket UDP de la transmisión pedida, si el video va por UDP
+
     while True:
         try:
             # Recibe la respuesta del servidor (menú, error, o inicio de stream)
-            response = video_socket.recv(4096).decode('utf-8')
-            if not response:
+            record = events.get()
+            if not record:
                 print("El servidor cerró la conexión.")
                 break
+            channel, _, payload = record
+            if channel != CONTROL:
+                continue  # Restos de una transmisión que se acaba de detener
+            response = payload.decode('utf-8')
 
             if response.startswith("MENU"):
                 print("\n--- Menú de Videos ---")
                 print(response[5:])
                 choice = input("Elige un video o escribe 'q' para desconectarte: ")
                 if choice.lower() == 'q':
-                    video_socket.sendall(b'EXIT')
+                    send_command(sock, 'EXIT')
                     break
-                video_socket.sendall(f'PLAY {choice}'.encode('utf-8'))
-            
+                if USE_UDP:
+                    # Un socket nuevo por transmisión: no le llegan paquetes de la anterior
+                    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    udp_socket.bind(('', 0))
+                    send_command(sock, f'PLAY {choice} UDP {udp_socket.getsockname()[1]}')
+                else:
+                    send_command(sock, f'PLAY {choice}')
+
             elif response.startswith("START_STREAM"):
                 # Si el servidor indica que el stream va a empezar, llama a la función para ver el video
-                result = watch_video(video_socket)
+                result = watch_video(sock, events, udp_socket)
+                if udp_socket:
+                    udp_socket.close()
+                    udp_socket = None
                 if result == 'exit':
                     break
-            
+
             elif response.startswith("ERROR"):
                 print(f"Error del servidor: {response}")
+                if udp_socket:
+                    udp_socket.close()  # La transmisión pedida no empezó
+                    udp_socket = None
         except ConnectionResetError:
             print("Se ha perdido la conexión con el servidor.")
             break
 
-    video_socket.close()
-    cv2.destroyAllWindows() 
+    sock.close()
+    cv2.destroyAllWindows()
     print("Desconectado.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,73 @@
+# Elección de la calidad (resolución y calidad JPEG) con la que se envía el video a cada cliente.
+# Por cada fotograma se mide cuánto tiempo se queda bloqueado el envío: mientras el enlace da
+# abasto, 'sendall' vuelve enseguida (los datos caben en el búfer del sistema); cuando no, se
+# bloquea y la reproducción se atasca. Con la media móvil de la fracción del intervalo entre
+# fotogramas que se pasa bloqueado se baja de calidad en cuanto el enlace se satura y se sube
+# cuando, según el tamaño relativo de los fotogramas de la calidad superior, esta también cabría.
+# Por UDP el envío nunca se bloquea: ahí la señal de saturación es la pérdida de paquetes que
+# informa el cliente ('report_loss').
+# Los cambios se hacen entre un fotograma y el siguiente.
+
+ALPHA = 0.2            # Peso de la última medida en la media móvil
+DOWNGRADE_BUSY = 0.6   # Fracción bloqueada a partir de la cual se baja de calidad
+UPGRADE_BUSY = 0.3     # Fracción bloqueada prevista con la calidad superior por debajo de la cual se sube
+HOLD_SECONDS = 1.0     # Tiempo sin decidir nada tras un cambio, para medir la nueva calidad
+UPGRADE_SECONDS = 4.0  # Tiempo estable que hace falta para subir de calidad
+LOSS_DOWNGRADE = 0.05  # Fracción de paquetes perdidos a partir de la cual se baja de calidad
+LOSS_UPGRADE = 0.01    # Fracción de paquetes perdidos por encima de la cual no se sube de calidad
+
+class RenditionSelector:
+    """
+    Calidad actual de una sesión. 'costs' es el tamaño relativo de los fotogramas de cada
+    calidad, de la mejor a la peor; 'start' la posición de la calidad inicial.
+    """
+
+    def __init__(self, costs, start, interval):
+        self.costs = costs
+        self.current = start
+        self.interval = interval
+        self.busy = 0.0          # Media móvil de la fracción del intervalo bloqueada en el envío
+        self.since_switch = 0    # Fotogramas enviados desde el último cambio
+        self.frames = 0
+        self.bytes_sent = 0
+        self.blocked = 0.0       # Segundos bloqueado en el envío en total
+        self.switches = 0
+        self.loss = 0.0          # Última pérdida de paquetes informada por el cliente (solo UDP)
+
+    def observe(self, size, elapsed):
+        """Registra el envío de un fotograma de 'size' bytes que tardó 'elapsed' segundos y devuelve la calidad del siguiente."""
+        self.frames += 1
+        self.bytes_sent += size
+        self.blocked += elapsed
+        self.since_switch += 1
+        self.busy = ALPHA * (elapsed / self.interval) + (1 - ALPHA) * self.busy
+        if self.since_switch * self.interval < HOLD_SECONDS:
+            return self.current
+        if self.busy > DOWNGRADE_BUSY and self.current + 1 < len(self.costs):
+            self._switch(self.current + 1)
+        elif self.current > 0 and self.since_switch * self.interval >= UPGRADE_SECONDS and self.loss < LOSS_UPGRADE:
+            expected = self.busy * self.costs[self.current - 1] / self.costs[self.current]
+            if expected < UPGRADE_BUSY:
+                self._switch(self.current - 1)
+        return self.current
+
+    def report_loss(self, loss):
+        """Registra la fracción de paquetes perdidos que informó el cliente y baja de calidad si es alta."""
+        self.loss = loss
+        if loss > LOSS_DOWNGRADE and self.since_switch * self.interval >= HOLD_SECONDS and self.current + 1 < len(self.costs):
+            self._switch(self.current + 1)
+
+    def _switch(self, rendition):
+        # La medida se reescala a lo que costaría la nueva calidad hasta tener medidas propias
+        self.busy *= self.costs[rendition] / self.costs[self.current]
+        self.current = rendition
+        self.since_switch = 0
+        self.switches += 1
+
+    def summary(self):
+        duration = self.frames * self.interval
+        if not duration:
+            return "sin fotogramas enviados"
+        return (f"{self.bytes_sent / duration / 1024:.0f} KB/s, "
+                f"{100 * self.blocked / duration:.0f}% del tiempo bloqueado en el envío, "
+                f"{self.switches} cambios de calidad")
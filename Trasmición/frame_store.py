@@ -0,0 +1,85 @@
+import array
+import mmap
+import struct
+import sys
+from protocol import HEADER, VIDEO
+
+# Almacén de fotogramas ya codificados de un video, para no decodificar, redimensionar y codificar
+# en JPEG una vez por cada cliente. Se genera una sola vez por video y calidad (ver media_cache.py)
+# y cada sesión envía los bytes tal cual, con 'sendfile' (sin copiarlos a Python).
+#
+# Formato del archivo:
+#   - Los fotogramas uno tras otro, cada uno tal como viaja por el socket: un registro del canal
+#     de video (ver protocol.py) con su PTS y el JPEG.
+#   - El índice: la posición de cada fotograma en el archivo, 8 bytes por fotograma (big-endian).
+#   - El pie (FOOTER): marca, FPS del video, número de fotogramas y posición del índice.
+
+VERSION = 3  # Forma parte del nombre de la entrada en la caché: al cambiar el formato se regeneran
+MAGIC = b'FRM%d' % VERSION
+FOOTER = struct.Struct('>4sdIQ')
+OFFSET = struct.Struct('>Q')
+
+class FrameStoreWriter:
+    def __init__(self, path, fps):
+        self.file = open(path, 'wb')
+        self.fps = fps
+        self.offsets = array.array('Q')
+        self.position = 0
+
+    def add(self, jpeg, pts):
+        """Añade un fotograma con su PTS en segundos."""
+        self.offsets.append(self.position)
+        self.file.write(HEADER.pack(VIDEO, len(jpeg), round(pts * 1000)))
+        self.file.write(jpeg)
+        self.position += HEADER.size + len(jpeg)
+
+    def close(self):
+        """Escribe el índice y el pie, y cierra el archivo."""
+        if sys.byteorder == 'little':
+            self.offsets.byteswap()
+        self.file.write(self.offsets.tobytes())
+        self.file.write(FOOTER.pack(MAGIC, self.fps, len(self.offsets), self.position))
+        self.file.close()
+
+class FrameStore:
+    """Lectura de un almacén de fotogramas, proyectado en memoria."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.fps, self.count, self.index = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        except (ValueError, struct.error):
+            self.file.close()
+            raise ValueError(f"{path} no es un almacén de fotogramas válido")
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} no es un almacén de fotogramas válido")
+
+    def span(self, number):
+        """Posición y tamaño (con la cabecera) del fotograma 'number' en el archivo."""
+        start = OFFSET.unpack_from(self.map, self.index + OFFSET.size * number)[0]
+        if number + 1 < self.count:
+            end = OFFSET.unpack_from(self.map, self.index + OFFSET.size * (number + 1))[0]
+        else:
+            end = self.index
+        return start, end - start
+
+    def pts(self, number):
+        """PTS del fotograma 'number' en segundos."""
+        start, _ = self.span(number)
+        return HEADER.unpack_from(self.map, start)[2] / 1000
+
+    def frame(self, number):
+        """Bytes JPEG del fotograma 'number'."""
+        start, size = self.span(number)
+        return self.map[start + HEADER.size:start + size]
+
+    def send(self, muxer, number):
+        """Envía el registro del fotograma 'number' tal como está en el archivo y devuelve los bytes enviados."""
+        start, size = self.span(number)
+        return muxer.sendfile(self.file, start, size)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,121 @@
+import collections
+import hashlib
+import os
+import threading
+
+# Caché en disco de los datos que se derivan de cada video (por ejemplo, su audio en WAV).
+# Cada entrada se identifica por la ruta del video, su fecha de modificación y su tamaño: si el
+# video cambia, su clave también, y la entrada vieja acaba saliendo de la caché por LRU.
+# Cada entrada se genera una sola vez aunque la pidan varias sesiones a la vez (las demás esperan
+# a que termine) y todas la comparten en modo de solo lectura. Se genera en un archivo temporal
+# que luego se renombra, así que nunca se sirve una entrada a medio escribir.
+# Cuando el total pasa de 'max_bytes' se borran las entradas usadas hace más tiempo, salvo las
+# que alguna sesión tiene abiertas.
+
+class MediaCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # Nombre -> tamaño, de la usada hace más tiempo a la más reciente
+        self.total = 0
+        self.in_use = collections.Counter()       # Nombre -> sesiones que la están leyendo
+        self.building = {}                        # Nombre -> bloqueo de quien la está generando
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Recupera las entradas que quedaron de una ejecución anterior, por orden de uso."""
+        found = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if '.tmp' in name:
+                os.remove(path)  # Generación interrumpida
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+
+    def key(self, source_path):
+        stat = os.stat(source_path)
+        origin = f"{os.path.abspath(source_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return hashlib.sha1(origin.encode('utf-8')).hexdigest()[:20]
+
+    def contains(self, source_path, suffix):
+        with self.lock:
+            return self.key(source_path) + suffix in self.entries
+
+    def acquire(self, source_path, suffix, build):
+        """
+        Devuelve la ruta de la entrada de 'source_path' con la extensión 'suffix', generándola con
+        'build(source_path, ruta_temporal)' si no existe. Quien la pide debe llamar a 'release'
+        cuando deje de leerla.
+        """
+        name = self.key(source_path) + suffix
+        path = os.path.join(self.folder, name)
+        with self.lock:
+            if self._take(name):
+                return path
+            builder = self.building.setdefault(name, threading.Lock())
+        with builder:
+            with self.lock:
+                if self._take(name):
+                    return path  # La generó otra sesión mientras esperábamos
+            root, extension = os.path.splitext(path)
+            temporary = f"{root}.tmp{extension}"  # La extensión se conserva para las herramientas que la miran
+            try:
+                build(source_path, temporary)
+                os.replace(temporary, path)
+                size = os.path.getsize(path)
+            except BaseException:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                with self.lock:
+                    self.building.pop(name, None)
+                raise
+            # La entrada se registra antes de soltar el bloqueo de generación: quien llegue después
+            # la encuentra hecha en vez de volver a generarla
+            with self.lock:
+                self.entries[name] = size
+                self.total += size
+                self.in_use[name] += 1
+                self.building.pop(name, None)
+                self._evict()
+        return path
+
+    def acquire_existing(self, source_path, suffix):
+        """Como 'acquire', pero sin generar la entrada: devuelve None si todavía no existe."""
+        name = self.key(source_path) + suffix
+        with self.lock:
+            if self._take(name):
+                return os.path.join(self.folder, name)
+        return None
+
+    def release(self, path):
+        name = os.path.basename(path)
+        with self.lock:
+            self.in_use[name] -= 1
+            if self.in_use[name] <= 0:
+                del self.in_use[name]
+            self._evict()
+
+    def _take(self, name):
+        if name not in self.entries:
+            return False
+        self.entries.move_to_end(name)
+        self.in_use[name] += 1
+        return True
+
+    def _evict(self):
+        for name in list(self.entries):
+            if self.total <= self.max_bytes:
+                break
+            if self.in_use[name]:
+                continue
+            self.total -= self.entries.pop(name)
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
@@ -0,0 +1,54 @@
+import threading
+import time
+
+# Relojes para sincronizar audio y video. Cada fotograma y cada fragmento de audio lleva su
+# instante de presentación (PTS, desde el inicio del video) en su registro (ver protocol.py).
+# - En el servidor, 'MediaClock' marca cuándo debe salir cada dato: se envía un poco antes de su
+#   PTS (para que el cliente lo tenga a tiempo) y los fotogramas que ya llegan tarde se descartan
+#   en vez de retrasar a los siguientes.
+# - En el cliente, 'PlaybackClock' dice qué PTS se está reproduciendo. Lo fija el audio (la
+#   tarjeta de sonido reproduce a su ritmo) y el video se muestra según ese reloj.
+
+class MediaClock:
+    """Reloj de presentación de una sesión en el servidor: el instante 0 es el inicio de la transmisión."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def position(self):
+        return time.perf_counter() - self.start
+
+    def lateness(self, pts):
+        """Segundos de retraso respecto al PTS (negativo si todavía falta para él)."""
+        return self.position() - pts
+
+    def wait_until(self, pts, stop_event, lead=0.0):
+        """Espera hasta 'lead' segundos antes del PTS o hasta que se pida detener la transmisión."""
+        delay = pts - lead - self.position()
+        if delay > 0:
+            stop_event.wait(delay)
+
+class PlaybackClock:
+    """
+    Reloj de reproducción del cliente. Se ancla a un PTS en un instante local y avanza con el
+    tiempo real; el audio lo reancla con cada fragmento que entrega a la tarjeta de sonido.
+    Sin audio, lo ancla el primer fotograma.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.anchor = None  # (PTS, instante local en que se reproducía)
+
+    def sync(self, pts, force=True):
+        """Ancla el reloj a 'pts' ahora; con 'force' en False solo si aún no estaba anclado."""
+        with self.lock:
+            if force or self.anchor is None:
+                self.anchor = (pts, time.perf_counter())
+
+    def now(self):
+        """PTS que se está reproduciendo, o None si el reloj todavía no está anclado."""
+        with self.lock:
+            if self.anchor is None:
+                return None
+            pts, at = self.anchor
+        return pts + time.perf_counter() - at
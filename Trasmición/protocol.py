@@ -0,0 +1,68 @@
+import struct
+import threading
+
+# Protocolo entre Server.py y User.py: una sola conexión TCP por cliente que lleva, como
+# registros, los mensajes de control y los datos de video y de audio de la sesión.
+# Cada registro es una cabecera (HEADER: canal en 1 byte, tamaño de los datos y PTS en
+# milisegundos en 4 bytes cada uno, big-endian) seguida de los datos:
+#   - CONTROL: texto UTF-8 cuya primera línea es el mensaje ('MENU', 'ERROR', 'START_STREAM',
+#     'RENDITION', 'END_STREAM' del servidor; 'PLAY n', 'STOP', 'EXIT' del cliente).
+#   - VIDEO: un fotograma JPEG, con su PTS.
+#   - AUDIO: un fragmento de audio PCM, con su PTS.
+# Como el audio ya no usa otra conexión, no hay que emparejar conexiones entre sí y el
+# inicio de una transmisión no cuesta otro saludo TCP.
+
+HEADER = struct.Struct('>BII')
+CONTROL, VIDEO, AUDIO = 0, 1, 2
+
+def pack(channel, payload, pts=0.0):
+    """Registro listo para enviar con los datos 'payload' del canal 'channel'."""
+    return HEADER.pack(channel, len(payload), round(pts * 1000)) + payload
+
+def recvall(sock, n):
+    """
+    Función auxiliar para asegurar la recepción de 'n' bytes completos desde un socket.
+    Evita que los datos se reciban de forma parcial.
+    """
+    data = b''
+    while len(data) < n:
+        packet = sock.recv(n - len(data))
+        if not packet:
+            return None  # Retorna None si la conexión se cierra
+        data += packet
+    return data
+
+def read_record(sock):
+    """Lee un registro completo: devuelve (canal, PTS en segundos, datos) o None si la conexión se cerró."""
+    header = recvall(sock, HEADER.size)
+    if not header:
+        return None
+    channel, size, pts = HEADER.unpack(header)
+    payload = recvall(sock, size) if size else b''
+    if payload is None:
+        return None
+    return channel, pts / 1000, payload
+
+class Muxer:
+    """
+    Envío de registros por la conexión de un cliente. Los hilos de video y de audio y el de la
+    sesión escriben en el mismo socket, así que cada registro se envía entero bajo un bloqueo.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, channel, payload, pts=0.0):
+        data = pack(channel, payload, pts)
+        with self.lock:
+            self.sock.sendall(data)
+        return len(data)
+
+    def send_control(self, message):
+        return self.send(CONTROL, message.encode('utf-8'))
+
+    def sendfile(self, file, offset, count):
+        """Envía registros ya empaquetados que están en un archivo (como 'socket.sendfile')."""
+        with self.lock:
+            return self.sock.sendfile(file, offset, count)
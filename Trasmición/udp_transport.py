@@ -0,0 +1,139 @@
+import heapq
+import math
+import random
+import socket
+import struct
+
+# Transporte opcional del video por UDP. Por TCP un paquete perdido detiene todos los fotogramas
+# siguientes hasta que se retransmite; por UDP se pierde ese fotograma y la reproducción sigue.
+# El control y el audio siguen por la conexión TCP (ver protocol.py).
+#
+# Cada fotograma se parte en fragmentos que caben en un datagrama (MAX_DATAGRAM bytes). Cada
+# paquete lleva una cabecera (PACKET): número de secuencia del paquete, número de fotograma,
+# PTS en milisegundos, posición del fragmento y número de fragmentos del fotograma.
+# El cliente junta los fragmentos ('Reassembler'), retiene cada fotograma completo JITTER_BUFFER
+# segundos para que los que llegan desordenados ocupen su lugar y descarta los incompletos.
+# Para probarlo en loopback, 'UdpSender' puede perder o desordenar paquetes a propósito.
+
+PACKET = struct.Struct('>IIIHH')
+MAX_DATAGRAM = 1400            # Por debajo de la MTU habitual de Ethernet (1500) con las cabeceras IP y UDP
+MAX_PAYLOAD = MAX_DATAGRAM - PACKET.size
+JITTER_BUFFER = 0.05           # Segundos que se retiene cada fotograma completo antes de entregarlo
+MAX_FRAME_WAIT = 0.5           # Segundos que se espera a los fragmentos que faltan de un fotograma
+
+class UdpSender:
+    """
+    Envío de los fotogramas de una transmisión a la dirección UDP 'addr' del cliente.
+    'loss' y 'reorder' son las probabilidades de perder o desordenar cada paquete a propósito.
+    """
+
+    def __init__(self, addr, loss=0.0, reorder=0.0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addr = addr
+        self.loss = loss
+        self.reorder = reorder
+        self.random = random.Random()
+        self.seq = 0
+        self.frame_id = 0
+        self.held = None  # Paquete retenido para enviarlo después del siguiente
+
+    def send_frame(self, pts, data):
+        """Envía un fotograma partido en fragmentos y devuelve los bytes enviados."""
+        count = max(1, math.ceil(len(data) / MAX_PAYLOAD))
+        pts_ms = round(pts * 1000)
+        sent = 0
+        for index in range(count):
+            packet = PACKET.pack(self.seq, self.frame_id, pts_ms, index, count) + data[index * MAX_PAYLOAD:(index + 1) * MAX_PAYLOAD]
+            self.seq += 1
+            sent += len(packet)
+            self._send(packet)
+        self.frame_id += 1
+        return sent
+
+    def _send(self, packet):
+        if self.random.random() < self.loss:
+            return  # Pérdida simulada
+        if self.held is None and self.random.random() < self.reorder:
+            self.held = packet  # Desorden simulado: sale después del siguiente
+            return
+        self.sock.sendto(packet, self.addr)
+        if self.held:
+            self.sock.sendto(self.held, self.addr)
+            self.held = None
+
+    def close(self):
+        if self.held:
+            self.sock.sendto(self.held, self.addr)
+        self.sock.close()
+
+class Reassembler:
+    """Recomposición de los fotogramas en el cliente, con su búfer de jitter y sus estadísticas."""
+
+    def __init__(self, jitter=JITTER_BUFFER):
+        self.jitter = jitter
+        self.partial = {}      # Fotograma -> [PTS, fragmentos, {posición: datos}, llegada del primero]
+        self.ready = []        # Montículo de (fotograma, PTS, datos, instante en que se completó)
+        self.next_frame = 0    # Los fotogramas anteriores ya se entregaron o se descartaron
+        self.highest_seq = -1
+        self.received = 0      # Paquetes recibidos
+        self.reordered = 0     # Paquetes que llegaron después de otro posterior
+        self.late = 0          # Paquetes de fotogramas ya entregados o descartados
+        self.frames = 0        # Fotogramas entregados
+        self.frames_dropped = 0
+        self.interval = (0, -1)  # (recibidos, secuencia más alta) al empezar el intervalo actual
+
+    def feed(self, packet, now):
+        seq, frame_id, pts_ms, index, count = PACKET.unpack_from(packet)
+        self.received += 1
+        if seq < self.highest_seq:
+            self.reordered += 1
+        else:
+            self.highest_seq = seq
+        if frame_id < self.next_frame:
+            self.late += 1
+            return
+        entry = self.partial.setdefault(frame_id, [pts_ms / 1000, count, {}, now])
+        entry[2][index] = packet[PACKET.size:]
+        if len(entry[2]) == entry[1]:
+            del self.partial[frame_id]
+            heapq.heappush(self.ready, (frame_id, entry[0], b''.join(entry[2][i] for i in range(entry[1])), now))
+
+    def pop(self, now):
+        """Devuelve, en orden, los fotogramas (PTS, datos) que ya cumplieron su tiempo en el búfer."""
+        frames = []
+        while self.ready and now - self.ready[0][3] >= self.jitter:
+            frame_id, pts, data, _ = heapq.heappop(self.ready)
+            if frame_id < self.next_frame:
+                continue
+            self._skip_to(frame_id)
+            self.next_frame = frame_id + 1
+            self.frames += 1
+            frames.append((pts, data))
+        # Un fotograma al que le faltan fragmentos desde hace demasiado ya no se completará
+        for frame_id in sorted(self.partial):
+            if frame_id in self.partial and now - self.partial[frame_id][3] > MAX_FRAME_WAIT:
+                self._skip_to(frame_id + 1)
+                self.next_frame = frame_id + 1
+        return frames
+
+    def _skip_to(self, frame_id):
+        """Da por perdidos los fotogramas anteriores a 'frame_id' que no se entregaron."""
+        self.frames_dropped += frame_id - self.next_frame
+        for old in [f for f in self.partial if f < frame_id]:
+            del self.partial[old]
+
+    def lost(self):
+        return max(0, self.highest_seq + 1 - self.received)
+
+    def interval_loss(self):
+        """Fracción de paquetes perdidos desde la llamada anterior."""
+        received, highest = self.interval
+        expected = self.highest_seq - highest
+        self.interval = (self.received, self.highest_seq)
+        if expected <= 0:
+            return 0.0
+        return max(0.0, 1 - (self.received - received) / expected)
+
+    def stats(self):
+        return {'received': self.received, 'lost': self.lost(), 'reordered': self.reordered, 'late': self.late,
+                'frames': self.frames, 'frames_dropped': self.frames_dropped}
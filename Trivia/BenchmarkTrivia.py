@@ -0,0 +1,412 @@
+import asyncio
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import protocolo
+
+# Herramienta de carga y latencia para el servidor de trivia.
+# Simula miles de jugadores (bots) sobre asyncio en un solo proceso: se registran, crean o se
+# unen a salas en modo 1 y modo 2 y responden con un tiempo de reflexión configurable.
+# Al final guarda un JSON con el rendimiento, los percentiles de latencia por comando, el retraso
+# de las difusiones y el consumo del proceso servidor, para poder comparar ejecuciones.
+#
+# Ejemplos:
+#   python BenchmarkTrivia.py --jugadores 2000 --lanzar-servidor --motor asyncio --salida asyncio.json
+#   python BenchmarkTrivia.py --jugadores 500 --sala-masiva --lanzar-servidor --salida masiva.json
+#   python BenchmarkTrivia.py --comparar hilos.json asyncio.json
+
+HOST = '127.0.0.1'
+PORT = 65432
+
+def percentiles(muestras):
+    """Resumen de una lista de latencias en segundos: n, media y p50/p95/p99/máximo en milisegundos."""
+    if not muestras:
+        return {'n': 0}
+    ordenadas = sorted(muestras)
+    def p(q):
+        return round(ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] * 1000, 3)
+    return {
+        'n': len(ordenadas),
+        'media_ms': round(sum(ordenadas) / len(ordenadas) * 1000, 3),
+        'p50_ms': p(0.50), 'p95_ms': p(0.95), 'p99_ms': p(0.99),
+        'max_ms': round(ordenadas[-1] * 1000, 3),
+    }
+
+def crear_tiempo_reflexion(especificacion):
+    """
+    Convierte 'fija:S', 'uniforme:A:B', 'exponencial:MEDIA' o 'lognormal:MU:SIGMA'
+    en una función que devuelve segundos de reflexión.
+    """
+    nombre, *params = especificacion.split(':')
+    params = [float(x) for x in params]
+    if nombre == 'fija':
+        return lambda: params[0]
+    if nombre == 'uniforme':
+        return lambda: random.uniform(params[0], params[1])
+    if nombre == 'exponencial':
+        return lambda: random.expovariate(1 / params[0])
+    if nombre == 'lognormal':
+        return lambda: random.lognormvariate(params[0], params[1])
+    raise ValueError(f"Distribución desconocida: {especificacion}")
+
+class Metricas:
+    def __init__(self):
+        self.latencias = {}        # comando -> lista de segundos
+        self.retraso_difusion = [] # segundos entre el envío de la pregunta y su llegada
+        self.errores = {}
+        self.comandos = 0
+        self.respuestas = 0
+        self.partidas = 0
+        self.eventos_espectadores = 0
+
+    def latencia(self, comando, segundos):
+        self.latencias.setdefault(comando, []).append(segundos)
+        self.comandos += 1
+
+    def error(self, tipo):
+        self.errores[tipo] = self.errores.get(tipo, 0) + 1
+
+class Bot:
+    """
+    Jugador simulado. Los mensajes 'ok'/'error' son respuestas a sus comandos;
+    el resto (preguntas, marcadores, fin de juego) son eventos de la partida.
+    """
+    def __init__(self, nombre, args, metricas, pensar):
+        self.nombre = nombre
+        self.args = args
+        self.metricas = metricas
+        self.pensar = pensar
+        self.respuestas = asyncio.Queue()
+        self.eventos = asyncio.Queue()
+        self.envio_respuesta = None
+
+    async def conectar(self):
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.puerto)
+        self.lector = asyncio.get_running_loop().create_task(self._leer())
+
+    async def _leer(self):
+        decodificador = protocolo.Decodificador()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                for mensaje in decodificador.alimentar(data):
+                    if mensaje.get('status') == 'ping':
+                        # Los latidos se contestan en el acto, como el cliente real
+                        self.writer.write(protocolo.codificar({"comando": "pong", "t": mensaje['t']}))
+                    elif mensaje.get('status') in ('ok', 'error'):
+                        self.respuestas.put_nowait(mensaje)
+                    else:
+                        self.eventos.put_nowait(mensaje)
+        except (ConnectionError, protocolo.ErrorProtocolo):
+            pass
+        self.eventos.put_nowait(None)
+        self.respuestas.put_nowait(None)
+
+    async def pedir(self, peticion):
+        inicio = time.perf_counter()
+        self.writer.write(protocolo.codificar(peticion))
+        respuesta = await asyncio.wait_for(self.respuestas.get(), self.args.timeout)
+        if respuesta is None:
+            raise ConnectionError("conexión cerrada")
+        self.metricas.latencia(peticion['comando'], time.perf_counter() - inicio)
+        if respuesta['status'] != 'ok':
+            self.metricas.error(peticion['comando'])
+        return respuesta
+
+    async def responder(self, sala_id, pregunta):
+        await asyncio.sleep(self.pensar())
+        acierta = random.random() < self.args.acierto
+        respuesta = pregunta['respuesta'] if acierta else '0'
+        self.envio_respuesta = time.perf_counter()
+        self.writer.write(protocolo.codificar({"comando": "enviar_respuesta", "sala_id": sala_id,
+                                               "respuesta": respuesta, "timestamp": time.time()}))
+        self.metricas.respuestas += 1
+
+    async def jugar(self, sala_id):
+        tareas = []
+        while True:
+            mensaje = await asyncio.wait_for(self.eventos.get(), self.args.timeout)
+            if mensaje is None:
+                raise ConnectionError("conexión cerrada durante la partida")
+            status = mensaje.get('status')
+            if status == 'pregunta':
+                if 'timestamp' in mensaje:
+                    self.metricas.retraso_difusion.append(max(0.0, time.time() - mensaje['timestamp']))
+                tareas.append(asyncio.get_running_loop().create_task(self.responder(sala_id, mensaje['pregunta'])))
+            elif status == 'respuesta_correcta' and mensaje.get('jugador') == self.nombre and self.envio_respuesta:
+                # Latencia de una respuesta: desde que se envía hasta que llega la difusión del acierto
+                self.metricas.latencia('enviar_respuesta', time.perf_counter() - self.envio_respuesta)
+            elif status == 'fin_juego':
+                self.metricas.partidas += 1
+                for tarea in tareas:
+                    tarea.cancel()
+                return
+
+    async def observar(self, lento):
+        """
+        Mira la partida hasta su fin contando los eventos recibidos. Un espectador lento deja de
+        leer su socket, así que su cola en el servidor crece y pasa a la puesta al día con pérdidas.
+        """
+        if lento:
+            self.lector.cancel()
+            return
+        while True:
+            mensaje = await asyncio.wait_for(self.eventos.get(), self.args.timeout)
+            if mensaje is None:
+                raise ConnectionError("conexión cerrada durante la partida")
+            self.metricas.eventos_espectadores += 1
+            if mensaje.get('status') in ('fin_juego', 'sala_cerrada'):
+                return
+
+    def cerrar(self):
+        self.lector.cancel()
+        self.writer.close()
+
+async def pareja(indice, args, metricas, pensar):
+    """
+    Ejecuta un anfitrión y, en modo 2, su invitado. El anfitrión crea la sala y el invitado
+    se une con el identificador que este recibe. Con '--emparejamiento' cada bot usa
+    'buscar_partida' y el servidor decide con quién juega.
+    """
+    modo = 2 if random.random() < args.fraccion_modo2 else 1
+    bots = [Bot(f"bot_{indice}_{i}", args, metricas, pensar) for i in range(modo)]
+    try:
+        for bot in bots:
+            await bot.conectar()
+            await bot.pedir({"comando": "registrar_usuario", "nombre_usuario": bot.nombre, "codificaciones": [args.codificacion], "latido": True})
+        for _ in range(args.partidas):
+            if args.emparejamiento:
+                peticion = {"comando": "buscar_partida", "modo": str(modo), "num_preguntas": str(args.preguntas)}
+                respuestas = [await bot.pedir(peticion) for bot in bots]
+                if any(r['status'] != 'ok' for r in respuestas):
+                    return
+                await asyncio.gather(*(bot.jugar(r['sala_id']) for bot, r in zip(bots, respuestas)))
+                await bots[0].pedir({"comando": "ver_rankings"})
+                continue
+            respuesta = await bots[0].pedir({"comando": "crear_sala", "modo": str(modo), "num_preguntas": str(args.preguntas)})
+            if respuesta['status'] != 'ok':
+                return
+            if modo == 2:
+                respuesta = await bots[1].pedir({"comando": "unirse_sala", "sala_id": respuesta['sala_id']})
+                if respuesta['status'] != 'ok':
+                    return
+            await asyncio.gather(*(bot.jugar(respuesta['sala_id']) for bot in bots))
+            await bots[0].pedir({"comando": "ver_rankings"})
+    except asyncio.TimeoutError:
+        metricas.error('timeout')
+    except (ConnectionError, OSError) as e:
+        metricas.error(type(e).__name__)
+    finally:
+        for bot in bots:
+            if hasattr(bot, 'writer'):
+                bot.cerrar()
+
+async def sala_masiva(args, metricas, pensar):
+    """
+    Con '--sala-masiva' todos los bots juegan en una sola sala masiva: el primero la crea,
+    los demás se unen y, cuando están todos dentro, el anfitrión la inicia. Con '--espectadores'
+    otros tantos bots la miran; una fracción de ellos ('--espectadores-lentos') no lee nada.
+    """
+    bots = [Bot(f"bot_masivo_{i}", args, metricas, pensar) for i in range(args.jugadores)]
+    espectadores = [Bot(f"espectador_{i}", args, metricas, pensar) for i in range(args.espectadores)]
+    lentos = int(args.espectadores * args.espectadores_lentos)
+    try:
+        for bot in bots + espectadores:
+            await bot.conectar()
+        await asyncio.gather(*(bot.pedir({"comando": "registrar_usuario", "nombre_usuario": bot.nombre,
+                                          "codificaciones": [args.codificacion], "latido": True}) for bot in bots + espectadores))
+        anfitrion = bots[0]
+        for _ in range(args.partidas):
+            respuesta = await anfitrion.pedir({"comando": "crear_sala", "masiva": True, "capacidad": str(len(bots)),
+                                               "cuenta_atras": args.timeout, "num_preguntas": str(args.preguntas)})
+            if respuesta['status'] != 'ok':
+                return
+            sala_id = respuesta['sala_id']
+            await asyncio.gather(*(bot.pedir({"comando": "unirse_sala", "sala_id": sala_id}) for bot in bots[1:]))
+            await asyncio.gather(*(bot.pedir({"comando": "observar_sala", "sala_id": sala_id}) for bot in espectadores))
+            await anfitrion.pedir({"comando": "iniciar_partida", "sala_id": sala_id})
+            await asyncio.gather(*(bot.jugar(sala_id) for bot in bots),
+                                 *(bot.observar(i < lentos) for i, bot in enumerate(espectadores)))
+    except asyncio.TimeoutError:
+        metricas.error('timeout')
+    except (ConnectionError, OSError) as e:
+        metricas.error(type(e).__name__)
+    finally:
+        for bot in bots:
+            if hasattr(bot, 'writer'):
+                bot.cerrar()
+        for bot in espectadores:
+            if hasattr(bot, 'writer'):
+                bot.cerrar()
+
+def leer_proceso(pid):
+    """RSS (KiB) y número de hilos de un proceso, leídos de /proc (solo Linux)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            campos = dict(linea.split(':', 1) for linea in f if ':' in linea)
+        return int(campos['VmRSS'].split()[0]), int(campos['Threads'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+async def muestrear_servidor(pid, muestras, intervalo=0.5):
+    while True:
+        dato = leer_proceso(pid)
+        if dato:
+            muestras.append(dato)
+        await asyncio.sleep(intervalo)
+
+def subir_limite_descriptores():
+    # Cada bot usa un socket; se sube el límite blando de archivos abiertos al máximo permitido
+    try:
+        import resource
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+    except (ImportError, ValueError, OSError):
+        pass
+
+async def pedir_stats(args):
+    """Métricas internas del servidor al terminar la carga (comando 'stats'); None si no las da."""
+    try:
+        reader, writer = await asyncio.open_connection(args.host, args.puerto)
+        writer.write(protocolo.codificar({"comando": "stats"}))
+        decodificador = protocolo.Decodificador()
+        mensajes = []
+        while not mensajes:
+            data = await asyncio.wait_for(reader.read(1024 * 1024), args.timeout)
+            if not data:
+                return None
+            mensajes = decodificador.alimentar(data)
+        writer.close()
+        return mensajes[0].get('stats')
+    except (OSError, asyncio.TimeoutError, protocolo.ErrorProtocolo):
+        return None
+
+async def ejecutar(args):
+    metricas = Metricas()
+    pensar = crear_tiempo_reflexion(args.pensar)
+    muestras = []
+    muestreo = asyncio.get_running_loop().create_task(muestrear_servidor(args.pid, muestras)) if args.pid else None
+
+    inicio = time.perf_counter()
+    tareas = []
+    if args.sala_masiva:
+        await sala_masiva(args, metricas, pensar)
+    # Los bots se conectan de forma escalonada para no desbordar la cola de escucha del servidor
+    for i in range(0 if args.sala_masiva else args.jugadores):
+        tareas.append(asyncio.get_running_loop().create_task(pareja(i, args, metricas, pensar)))
+        await asyncio.sleep(1 / args.ritmo)
+    await asyncio.gather(*tareas)
+    duracion = time.perf_counter() - inicio
+    if muestreo:
+        muestreo.cancel()
+    stats_servidor = await pedir_stats(args)
+
+    return {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'configuracion': {k: v for k, v in vars(args).items() if k not in ('comparar', 'salida')},
+        'duracion_s': round(duracion, 3),
+        'partidas': metricas.partidas,
+        'comandos': metricas.comandos,
+        'respuestas_enviadas': metricas.respuestas,
+        'eventos_espectadores': metricas.eventos_espectadores,
+        'comandos_por_s': round(metricas.comandos / duracion, 2),
+        'respuestas_por_s': round(metricas.respuestas / duracion, 2),
+        'latencia': {comando: percentiles(v) for comando, v in metricas.latencias.items()},
+        'retraso_difusion': percentiles(metricas.retraso_difusion),
+        'servidor': {
+            'rss_max_kib': max((m[0] for m in muestras), default=None),
+            'hilos_max': max((m[1] for m in muestras), default=None),
+        },
+        'errores': metricas.errores,
+        'stats_servidor': stats_servidor,
+    }
+
+def comparar(ruta_base, ruta_nueva):
+    """Muestra la variación de las métricas principales entre dos resultados guardados."""
+    with open(ruta_base) as f:
+        base = json.load(f)
+    with open(ruta_nueva) as f:
+        nueva = json.load(f)
+
+    def fila(nombre, a, b):
+        if a is None or b is None:
+            return
+        cambio = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+        print(f"{nombre:<40} {a:>12} {b:>12} {cambio:>9}")
+
+    print(f"{'métrica':<40} {'base':>12} {'nueva':>12} {'cambio':>9}")
+    for clave in ('comandos_por_s', 'respuestas_por_s', 'duracion_s'):
+        fila(clave, base.get(clave), nueva.get(clave))
+    for comando in sorted(set(base['latencia']) | set(nueva['latencia'])):
+        for p in ('p50_ms', 'p95_ms', 'p99_ms'):
+            fila(f"{comando} {p}", base['latencia'].get(comando, {}).get(p), nueva['latencia'].get(comando, {}).get(p))
+    for p in ('p50_ms', 'p95_ms', 'p99_ms'):
+        fila(f"retraso_difusion {p}", base['retraso_difusion'].get(p), nueva['retraso_difusion'].get(p))
+    fila('servidor rss_max_kib', base['servidor'].get('rss_max_kib'), nueva['servidor'].get('rss_max_kib'))
+    fila('servidor hilos_max', base['servidor'].get('hilos_max'), nueva['servidor'].get('hilos_max'))
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor de Trivia")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--puerto', type=int, default=PORT)
+    parser.add_argument('--jugadores', type=int, default=1000, help="número de anfitriones (en modo 2 cada uno trae un invitado)")
+    parser.add_argument('--fraccion-modo2', type=float, default=0.5, help="proporción de salas en modo 2")
+    parser.add_argument('--preguntas', type=int, default=5, choices=[5, 10, 20])
+    parser.add_argument('--partidas', type=int, default=1, help="partidas seguidas por anfitrión")
+    parser.add_argument('--pensar', default='exponencial:1.0', help="fija:S, uniforme:A:B, exponencial:MEDIA o lognormal:MU:SIGMA")
+    parser.add_argument('--emparejamiento', action='store_true', help="los bots usan 'buscar_partida' en lugar de crear y unirse a salas")
+    parser.add_argument('--sala-masiva', action='store_true', help="todos los bots juegan juntos en una sola sala masiva")
+    parser.add_argument('--espectadores', type=int, default=0, help="con '--sala-masiva', bots que solo miran la partida")
+    parser.add_argument('--espectadores-lentos', type=float, default=0.0, help="fracción de espectadores que no leen su socket")
+    parser.add_argument('--codificacion', choices=[protocolo.JSON, protocolo.BINARIA], default=protocolo.JSON, help="codificación que piden los bots al registrarse")
+    parser.add_argument('--acierto', type=float, default=0.7, help="probabilidad de responder bien")
+    parser.add_argument('--ritmo', type=float, default=500, help="anfitriones que se conectan por segundo")
+    parser.add_argument('--timeout', type=float, default=120, help="segundos máximos de espera por mensaje")
+    parser.add_argument('--pid', type=int, help="PID del servidor para medir su RSS y sus hilos")
+    parser.add_argument('--lanzar-servidor', action='store_true', help="arranca ServerTrivia.py como subproceso")
+    parser.add_argument('--motor', choices=['hilos', 'asyncio'], default='hilos', help="motor del servidor lanzado")
+    parser.add_argument('--trabajadores', type=int, default=0, help="procesos trabajadores del servidor lanzado (0: un solo proceso)")
+    parser.add_argument('--salida', default='benchmark.json', help="archivo JSON donde guardar los resultados")
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NUEVA'), help="compara dos resultados guardados y termina")
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    subir_limite_descriptores()
+    servidor = None
+    if args.lanzar_servidor:
+        # El servidor corre en el directorio actual (ahí deja su ranking), con el banco de preguntas del repositorio
+        carpeta = os.path.dirname(os.path.abspath(__file__))
+        comando = [sys.executable, os.path.join(carpeta, 'ServerTrivia.py'), '--host', args.host, '--puerto', str(args.puerto),
+                   '--preguntas', os.path.join(carpeta, 'preguntas.jsonl')]
+        if args.motor == 'asyncio':
+            comando.append('--asyncio')
+        if args.trabajadores:
+            # Con varios trabajadores el PID medido es el del coordinador
+            comando += ['--trabajadores', str(args.trabajadores)]
+        servidor = subprocess.Popen(comando, stdout=subprocess.DEVNULL)
+        args.pid = servidor.pid
+        time.sleep(1)  # Margen para que el servidor empiece a escuchar
+
+    try:
+        resultados = asyncio.run(ejecutar(args))
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait()
+
+    with open(args.salida, 'w') as f:
+        json.dump(resultados, f, indent=4)
+    print(json.dumps(resultados, indent=4))
+    print(f"Resultados guardados en {args.salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import collections
+import glob
+import json
+import os
+import banco_preguntas
+import eventos
+import metricas
+
+# Resume el registro de eventos de las partidas (ver eventos.py): distribución de los tiempos de
+# respuesta, dificultad real de cada pregunta, comportamiento de los jugadores y datos de las
+# partidas. Lee los archivos línea a línea y solo guarda agregados, así que su memoria no crece
+# con el tamaño del registro.
+
+RUTA_EVENTOS = 'eventos.jsonl'
+RUTA_PREGUNTAS = 'preguntas.jsonl'
+MIN_RESPUESTAS = 5  # Respuestas mínimas para que una pregunta o un jugador entre en las listas
+
+def archivos_registro(ruta):
+    """
+    Archivos del registro 'ruta' y de los registros de cada trabajador ('<raíz>.<n><extensión>'),
+    cada uno con sus archivos rotados en orden.
+    """
+    raiz, extension = os.path.splitext(ruta)
+    bases = [ruta]
+    for nombre in sorted(glob.glob(glob.escape(raiz) + '.*' + glob.escape(extension))):
+        if nombre[len(raiz) + 1:len(nombre) - len(extension)].isdigit():
+            bases.append(nombre)
+    return [archivo for base in bases for archivo in eventos.archivos(base)]
+
+def leer_eventos(archivos):
+    """Genera los eventos de los archivos, en orden, sin cargarlos enteros en memoria."""
+    for nombre in archivos:
+        with open(nombre, encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    yield json.loads(linea)
+                except json.JSONDecodeError:
+                    continue  # Línea a medio escribir si el servidor se cayó
+
+class Estadisticas:
+    def __init__(self):
+        self.tipos = collections.Counter()
+        self.tiempos = metricas.Histograma()           # Todas las respuestas
+        self.tiempos_acierto = metricas.Histograma()   # Solo las correctas
+        self.por_segundo = collections.Counter()       # Respuestas por segundo transcurrido
+        # Por pregunta: [veces enviada, respuestas, aciertos, suma de tiempos de los aciertos]
+        self.preguntas = collections.defaultdict(lambda: [0, 0, 0, 0.0])
+        self.clasificacion = {}                        # Pregunta -> (categoría, dificultad)
+        # Por jugador: [respuestas, aciertos, suma de tiempos, puntos, partidas, abandonos, victorias]
+        self.jugadores = collections.defaultdict(lambda: [0, 0, 0.0, 0, 0, 0, 0])
+        self.inicios = {}                              # Sala -> instante en que empezó su partida
+        self.partidas = 0
+        self.medidas = 0         # Partidas de las que se vio el inicio y el fin
+        self.duracion_total = 0.0
+        self.duracion_max = 0.0
+        self.rondas = 0
+        self.rondas_agotadas = 0
+        self.rondas_sin_acierto = 0
+
+    def agregar(self, ev):
+        tipo = ev.get('tipo')
+        self.tipos[tipo] += 1
+        if tipo == 'respuesta':
+            tiempo = ev['tiempo']
+            pregunta = self.preguntas[ev['pregunta']]
+            jugador = self.jugadores[ev['jugador']]
+            self.tiempos.observar(tiempo)
+            self.por_segundo[int(tiempo)] += 1
+            pregunta[1] += 1
+            jugador[0] += 1
+            jugador[2] += tiempo
+            jugador[3] += ev['puntos']
+            if ev['correcta']:
+                self.tiempos_acierto.observar(tiempo)
+                pregunta[2] += 1
+                pregunta[3] += tiempo
+                jugador[1] += 1
+        elif tipo == 'pregunta':
+            self.preguntas[ev['pregunta']][0] += 1
+            self.clasificacion[ev['pregunta']] = (ev.get('categoria'), ev.get('dificultad'))
+        elif tipo == 'ronda_cerrada':
+            self.rondas += 1
+            self.rondas_agotadas += ev['tiempo_agotado']
+            self.rondas_sin_acierto += not ev['acertada']
+        elif tipo == 'partida_iniciada':
+            self.inicios[ev['sala']] = ev['t']
+        elif tipo == 'abandono':
+            self.jugadores[ev['jugador']][5] += 1
+        elif tipo == 'fin_partida':
+            self.partidas += 1
+            inicio = self.inicios.pop(ev['sala'], None)
+            if inicio is not None:
+                duracion = ev['t'] - inicio
+                self.medidas += 1
+                self.duracion_total += duracion
+                self.duracion_max = max(self.duracion_max, duracion)
+            for nombre in ev['puntajes']:
+                self.jugadores[nombre][4] += 1
+            if ev['ganador'] in ev['puntajes']:
+                self.jugadores[ev['ganador']][6] += 1
+
+    def resumen(self, top, banco=None):
+        def enunciado(numero):
+            return banco.pregunta(numero)['pregunta'] if banco else None
+
+        preguntas = []
+        for numero, (enviada, respuestas, aciertos, suma) in self.preguntas.items():
+            if respuestas < MIN_RESPUESTAS: continue
+            categoria, dificultad = self.clasificacion.get(numero, (None, None))
+            preguntas.append({'pregunta': numero, 'categoria': categoria, 'dificultad': dificultad,
+                              'veces': enviada, 'respuestas': respuestas, 'acierto': round(aciertos / respuestas, 3),
+                              'tiempo_acierto_s': round(suma / aciertos, 2) if aciertos else None})
+        preguntas.sort(key=lambda p: p['acierto'])
+
+        # Acierto por dificultad declarada en el banco, para ver si coincide con la real
+        por_dificultad = collections.defaultdict(lambda: [0, 0])
+        for numero, (_, respuestas, aciertos, _) in self.preguntas.items():
+            acumulado = por_dificultad[str(self.clasificacion.get(numero, (None, None))[1])]
+            acumulado[0] += respuestas
+            acumulado[1] += aciertos
+
+        jugadores = []
+        for nombre, (respuestas, aciertos, suma, puntos, partidas, abandonos, victorias) in self.jugadores.items():
+            if respuestas < MIN_RESPUESTAS: continue
+            jugadores.append({'jugador': nombre, 'respuestas': respuestas, 'acierto': round(aciertos / respuestas, 3),
+                              'tiempo_medio_s': round(suma / respuestas, 2), 'puntos': puntos,
+                              'partidas': partidas, 'victorias': victorias, 'abandonos': abandonos})
+        jugadores.sort(key=lambda j: (-j['acierto'], j['tiempo_medio_s']))
+
+        for p in preguntas[:top] + preguntas[-top:]:
+            p['enunciado'] = enunciado(p['pregunta'])
+        return {
+            'eventos': dict(self.tipos),
+            'tiempos_respuesta': self.tiempos.resumen(),
+            'tiempos_acierto': self.tiempos_acierto.resumen(),
+            'respuestas_por_segundo': {f"{s}-{s + 1}": n for s, n in sorted(self.por_segundo.items())},
+            'partidas': {
+                'terminadas': self.partidas,
+                'duracion_media_s': round(self.duracion_total / self.medidas, 1) if self.medidas else None,
+                'duracion_max_s': round(self.duracion_max, 1),
+                'rondas': self.rondas,
+                'rondas_tiempo_agotado': self.rondas_agotadas,
+                'rondas_sin_acierto': self.rondas_sin_acierto,
+            },
+            'acierto_por_dificultad': {d: round(a / r, 3) for d, (r, a) in por_dificultad.items() if r},
+            'preguntas_mas_dificiles': preguntas[:top],
+            'preguntas_mas_faciles': preguntas[::-1][:top],
+            'mejores_jugadores': jugadores[:top],
+            'jugadores_que_mas_abandonan': sorted((j for j in jugadores if j['abandonos']), key=lambda j: -j['abandonos'])[:top],
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Estadísticas del registro de eventos del servidor de Trivia")
+    parser.add_argument('--eventos', default=RUTA_EVENTOS, help="registro de eventos (incluye sus archivos rotados y los de cada trabajador)")
+    parser.add_argument('--preguntas', default=RUTA_PREGUNTAS, help="banco de preguntas, para mostrar los enunciados")
+    parser.add_argument('--top', type=int, default=10, help="elementos de cada lista")
+    parser.add_argument('--salida', help="archivo JSON donde guardar el resumen")
+    args = parser.parse_args()
+
+    archivos = archivos_registro(args.eventos)
+    if not archivos:
+        print(f"No hay registro de eventos en {args.eventos}.")
+        return
+    estadisticas = Estadisticas()
+    for ev in leer_eventos(archivos):
+        estadisticas.agregar(ev)
+    banco = banco_preguntas.BancoPreguntas(args.preguntas) if os.path.exists(args.preguntas) else None
+    resumen = estadisticas.resumen(args.top, banco)
+    resumen['archivos'] = archivos
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump(resumen, f, indent=4, ensure_ascii=False)
+    print(json.dumps(resumen, indent=4, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -1,269 +1,1288 @@
 import socket
+import json
 import threading
 import time
-import json
-import random
 import os
+import asyncio
+import argparse
+import multiprocessing
+import zlib
+import signal
+import secrets
+import protocolo
+import planificador as planificacion
+import persistencia
+import clasificacion
+import salida
+import banco_preguntas
+import metricas
+import coordinador
+import lobby as emparejamiento
+import modelo
+import transmision
+import instantaneas
+import eventos
 
 HOST = '127.0.0.1'
 PORT = 65432
+BACKLOG = 1024  # Conexiones pendientes de aceptar que admite el socket de escucha
+
+# Banco de preguntas del juego, en disco (ver banco_preguntas.py).
+# Cada pregunta tiene categoría, dificultad, enunciado, opciones y la respuesta correcta.
+RUTA_PREGUNTAS = 'preguntas.jsonl'
+banco = None
 
-# Base de datos de preguntas del juego.
-# Cada pregunta es un diccionario con la pregunta, opciones y la respuesta correcta.
-preguntas = {
-    'general': [
-        {"pregunta": "¿Cuál es el río más largo del mundo?", "opciones": ["Nilo", "Amazonas", "Yangtsé", "Misisipi"], "respuesta": "2"},
-        {"pregunta": "¿Quién escribió 'Cien años de soledad'?", "opciones": ["Julio Cortázar", "Gabriel García Márquez", "Jorge Luis Borges", "Mario Vargas Llosa"], "respuesta": "2"},
-        {"pregunta": "¿En qué país se encuentra la Gran Muralla China?", "opciones": ["Japón", "Corea del Sur", "China", "Vietnam"], "respuesta": "3"},
-        {"pregunta": "¿Qué animal es el mamífero más grande del mundo?", "opciones": ["Elefante", "Ballena azul", "Jirafa", "Tigre"], "respuesta": "2"},
-        {"pregunta": "¿Cuántos lados tiene un heptágono?", "opciones": ["5", "6", "7", "8"], "respuesta": "3"},
-        {"pregunta": "¿Cuál es la capital de Canadá?", "opciones": ["Toronto", "Vancouver", "Montreal", "Ottawa"], "respuesta": "4"},
-        {"pregunta": "¿En qué año llegó el hombre a la luna?", "opciones": ["1969", "1970", "1968", "1971"], "respuesta": "1"},
-        {"pregunta": "¿Cuál es el océano más grande del mundo?", "opciones": ["Atlántico", "Índico", "Pacífico", "Ártico"], "respuesta": "3"},
-        {"pregunta": "¿Quién pintó 'La noche estrellada'?", "opciones": ["Leonardo da Vinci", "Pablo Picasso", "Vincent van Gogh", "Salvador Dalí"], "respuesta": "3"},
-        {"pregunta": "¿Cuál es el metal más abundante en la corteza terrestre?", "opciones": ["Hierro", "Aluminio", "Oro", "Cobre"], "respuesta": "2"},
-        {"pregunta": "¿Qué país tiene la mayor población del mundo?", "opciones": ["India", "Estados Unidos", "China", "Brasil"], "respuesta": "1"},
-        {"pregunta": "¿Cuál es el único mamífero que puede volar?", "opciones": ["Murciélago", "Ardilla voladora", "Pterodáctilo", "Pingüino"], "respuesta": "1"},
-        {"pregunta": "¿Qué instrumento musical tiene cuerdas pero se toca con un arco?", "opciones": ["Guitarra", "Arpa", "Violín", "Piano"], "respuesta": "3"},
-        {"pregunta": "¿Cuál es el desierto más grande del mundo?", "opciones": ["Sahara", "Gobi", "Atacama", "Antártico"], "respuesta": "4"},
-        {"pregunta": "¿Cuántos huesos tiene el cuerpo humano adulto?", "opciones": ["206", "208", "210", "200"], "respuesta": "1"},
-        {"pregunta": "¿Cuál es la capital de Australia?", "opciones": ["Sídney", "Melbourne", "Camberra", "Brisbane"], "respuesta": "3"},
-        {"pregunta": "¿Quién escribió la Odisea?", "opciones": ["Sócrates", "Homero", "Platón", "Aristóteles"], "respuesta": "2"},
-        {"pregunta": "¿Cuál es el componente principal del aire que respiramos?", "opciones": ["Oxígeno", "Dióxido de carbono", "Nitrógeno", "Argón"], "respuesta": "3"},
-        {"pregunta": "¿Qué país ganó la primera Copa Mundial de Fútbol?", "opciones": ["Brasil", "Italia", "Alemania", "Uruguay"], "respuesta": "4"},
-        {"pregunta": "¿Cuál es el planeta más cercano al Sol?", "opciones": ["Venus", "Marte", "Mercurio", "Tierra"], "respuesta": "3"},
-        {"pregunta": "¿En qué año se disolvió la Unión Soviética?", "opciones": ["1989", "1991", "1993", "1987"], "respuesta": "2"},
-        {"pregunta": "¿Qué sustancia química tiene la fórmula H2O?", "opciones": ["Cloruro de sodio", "Metano", "Agua", "Amoníaco"], "respuesta": "3"},
-        {"pregunta": "¿Quién es conocido como el padre de la computación?", "opciones": ["Bill Gates", "Alan Turing", "Steve Jobs", "Tim Berners-Lee"], "respuesta": "2"},
-        {"pregunta": "¿Cuál es el país más grande del mundo por área terrestre?", "opciones": ["Canadá", "Estados Unidos", "China", "Rusia"], "respuesta": "4"},
-        {"pregunta": "¿Cuál es la moneda de Japón?", "opciones": ["Yuan", "Dólar", "Yen", "Euro"], "respuesta": "3"},
-        {"pregunta": "¿Cuántos continentes hay basadonos en terminos geograficos?", "opciones": ["5", "6", "7", "8"], "respuesta": "1"},
-        {"pregunta": "¿Quién fue el primer presidente de los Estados Unidos?", "opciones": ["Thomas Jefferson", "Abraham Lincoln", "George Washington", "John Adams"], "respuesta": "3"},
-        {"pregunta": "¿Cuál es el animal terrestre más rápido?", "opciones": ["León", "Gacela", "Guepardo", "Caballo"], "respuesta": "3"},
-        {"pregunta": "¿Qué tipo de animal es una orca?", "opciones": ["Pez", "Foca", "Delfín", "Ballena"], "respuesta": "3"},
-        {"pregunta": "¿Cuál es el punto más alto de la Tierra?", "opciones": ["Monte Everest", "Monte Kilimanjaro", "Monte McKinley", "Monte Aconcagua"], "respuesta": "1"}
-    ]
-}
+def cargar_preguntas():
+    """Abre el banco de preguntas, construyendo su índice si falta o está desactualizado."""
+    global banco
+    banco = banco_preguntas.BancoPreguntas(RUTA_PREGUNTAS)
+    print(f"Banco de preguntas cargado: {banco.total} preguntas.")
 
 # Diccionarios globales para gestionar el estado del juego.
-# 'salas' guarda la información de cada partida en curso.
-# 'ranking_global' almacena los puntajes de los jugadores a largo plazo.
+# 'salas' guarda el registro ('modelo.Sala') de cada partida en curso; cada sala tiene su propio
+# bloqueo ('lock') para su estado interno, de modo que una sala lenta no frena a las demás.
+# 'sala_de_jugador' es el índice jugador→sala que evita recorrer todas las salas;
+# 'sala_de_espectador' es el equivalente para quienes solo miran una partida.
+# 'plazas_reservadas' guarda, tras un reinicio, el token y la sala de cada jugador que aún puede volver.
+# 'ranking_global' almacena los puntajes de los jugadores a largo plazo en una clasificación
+# que se mantiene ordenada al sumar puntos, para responder páginas y posiciones sin ordenar todo.
 salas = {}
-lock_salas = threading.Lock()  # Bloqueo para proteger el acceso concurrente a las salas
-ranking_global = {}
-lock_ranking = threading.Lock()  # Bloqueo para proteger el acceso concurrente al ranking global
+sala_de_jugador = {}
+sala_de_espectador = {}
+plazas_reservadas = {}
+lock_salas = metricas.BloqueoMedido('lock_salas')  # Protege solo los índices 'salas', 'sala_de_jugador', 'sala_de_espectador' y 'plazas_reservadas'; se toma por instantes
+ranking_global = clasificacion.Clasificacion()
+lock_ranking = metricas.BloqueoMedido('lock_ranking')  # Bloqueo para proteger el acceso concurrente al ranking global
+# Salas creadas por 'buscar_partida' que esperan jugadores, en colas por modo y número de preguntas
+lobby = emparejamiento.Lobby()
 
-def guardar_rankings():
+TIEMPO_RESPUESTA = 30       # Segundos que tienen los jugadores para responder cada pregunta
+PAUSA_ENTRE_PREGUNTAS = 3   # Segundos de pausa antes de pasar a la siguiente pregunta
+TAMANO_PAGINA = 20          # Jugadores por página de 'ver_rankings' si el cliente no indica otro valor
+MAX_POR_PAGINA = 100
+
+# Salas masivas (eventos en vivo con cientos de jugadores).
+# No esperan a un número exacto de jugadores: empiezan cuando su anfitrión lo pide o al acabar
+# la cuenta atrás. Puntúan todos los aciertos y, en lugar de difundir el marcador completo en
+# cada acierto, se difunde solo el top cada INTERVALO_MARCADOR segundos como mucho.
+CAPACIDAD_SALA_MASIVA = 1000
+CUENTA_ATRAS_MASIVA = 60    # Segundos hasta el inicio automático si el anfitrión no la empieza antes
+INTERVALO_MARCADOR = 1.0
+TOP_MARCADOR = 10
+
+# Espectadores: los eventos de la sala les llegan desde un búfer compartido ('transmision.py').
+# Con más de LIMITE_COLA_ESPECTADOR bytes pendientes un espectador se salta eventos y, al
+# ponerse al día, recibe solo el último marcador; se reintenta cada REINTENTO_ESPECTADORES segundos.
+# El reparto atiende LOTE_ESPECTADORES espectadores seguidos antes de ceder el turno.
+LIMITE_COLA_ESPECTADOR = 32 * 1024
+LOTE_ESPECTADORES = 200
+REINTENTO_ESPECTADORES = 0.5
+
+# Cola de salida de cada conexión: bytes pendientes a partir de los cuales se aplica la
+# política para consumidores lentos ('descartar', 'coalescer' o 'desconectar'; ver salida.py).
+LIMITE_COLA_SALIDA = 256 * 1024
+POLITICA_LENTOS = salida.COALESCER
+
+# Detección de clientes caídos.
+# Los clientes que lo piden al registrarse reciben un 'ping' cada INTERVALO_LATIDO segundos y
+# contestan 'pong' (así también se mide su RTT); si no se recibe nada de ellos en
+# TIEMPO_INACTIVIDAD segundos se corta la conexión y se limpia la sesión como en cualquier
+# desconexión. Para todos, incluidos los clientes antiguos, se activa además el keepalive de
+# TCP, que detecta en pocos segundos una red que se cayó sin cerrar la conexión.
+INTERVALO_LATIDO = 5
+TIEMPO_INACTIVIDAD = 15
+KEEPALIVE_TCP = (5, 2, 3)  # Segundos de inactividad antes de sondear, segundos entre sondeos, sondeos fallidos
+
+# Reinicios en caliente (ver instantaneas.py).
+# Cada INTERVALO_INSTANTANEA segundos se guardan las salas que cambiaron; al apagar se guarda una
+# última instantánea y se avisa a los clientes. Al volver a arrancar, quien se reconecte con su
+# token en menos de GRACIA_REINICIO segundos recupera su plaza y su puntaje; lo de quien no
+# vuelva se suma al ranking. Una instantánea con más de EDAD_MAXIMA_INSTANTANEA segundos ya no
+# se reanuda: solo se suman al ranking sus puntajes. Con varios trabajadores cada uno usa su
+# propio archivo ('<ruta>.<trabajador>'). Una ruta vacía desactiva las instantáneas.
+RUTA_INSTANTANEA = 'salas_instantanea.bin'
+INTERVALO_INSTANTANEA = 2
+GRACIA_REINICIO = 30
+EDAD_MAXIMA_INSTANTANEA = 300
+ESPERA_APAGADO = 2  # Segundos que se espera al apagar para que salgan los avisos pendientes
+instantaneas_salas = None
+apagando = False  # Desde la última instantánea las salas ya no avanzan ni suman puntajes al ranking
+
+# Registro de eventos de las partidas para análisis (ver eventos.py). Con varios trabajadores
+# cada uno escribe en su propio archivo ('eventos.<trabajador>.jsonl'). Una ruta vacía lo desactiva.
+RUTA_EVENTOS = 'eventos.jsonl'
+registro_eventos = None
+
+# Planificador central con los plazos de todas las salas; lo crea el motor al arrancar.
+planificador = None
+
+# Conexiones abiertas (de cualquiera de los dos motores), para las métricas de colas de salida.
+conexiones = set()
+
+# El comando 'stats' solo se atiende desde la propia máquina salvo que se indique lo contrario.
+STATS_SOLO_LOCAL = True
+# Modo multiproceso (ver coordinador.py): índice de este trabajador, número de trabajadores
+# y canal con el coordinador. En modo de un solo proceso 'TRABAJADOR' es None.
+TRABAJADOR = None
+NUM_TRABAJADORES = 0
+canal_coordinador = None
+
+class Traspaso(Exception):
+    """Se lanza al atender una petición que debe continuar en otro trabajador (el dueño de la sala)."""
+    def __init__(self, destino):
+        super().__init__(destino)
+        self.destino = destino
+
+COMANDOS = ("registrar_usuario", "crear_sala", "unirse_sala", "buscar_partida", "ver_rankings", "enviar_respuesta", "stats", "pong", "iniciar_partida", "observar_sala", "dejar_de_observar", "reanudar_partida")
+
+# Persistencia del ranking: cada partida añade sus diferencias a un registro en segundo plano
+# y el archivo completo solo se reescribe al compactar.
+registro_ranking = persistencia.RegistroRanking()
+
+def instantanea_ranking():
     """
-    Guarda el ranking global en un archivo JSON para persistir los datos.
-    El bloqueo 'lock_ranking' asegura que la escritura sea segura.
+    Copia del ranking junto con la secuencia de la última partida que incluye.
+    Ambas se leen con 'lock_ranking' tomado para que sean coherentes entre sí.
     """
     with lock_ranking:
-        with open('ranking_global.json', 'w') as f:
-            json.dump(ranking_global, f, indent=4)
-    print("Rankings guardados.")
+        return dict(ranking_global.puntajes), registro_ranking.secuencia
 
 def cargar_rankings():
     """
-    Carga el ranking global desde el archivo JSON al iniciar el servidor.
-    Maneja el caso en que el archivo no exista o esté corrupto.
+    Carga el ranking global al iniciar el servidor (instantánea más registro de partidas)
+    y arranca el hilo que persiste los cambios.
     """
     global ranking_global
-    if os.path.exists('ranking_global.json'):
+    ranking_global = clasificacion.Clasificacion(registro_ranking.cargar())
+    print("Rankings cargados.")
+    registro_ranking.iniciar(instantanea_ranking)
+
+# Primera página del ranking ya serializada, por tamaño de página: (versión, bytes).
+# Solo se vuelve a generar cuando cambia algún puntaje.
+cache_primera_pagina = {}
+
+def pagina_rankings_json(pagina, por_pagina):
+    """
+    Devuelve la página pedida del ranking como JSON ya codificado. Se llama con 'lock_ranking' tomado.
+    """
+    if pagina == 1:
+        guardada = cache_primera_pagina.get(por_pagina)
+        if guardada and guardada[0] == ranking_global.version:
+            return guardada[1]
+    fragmento = json.dumps(ranking_global.rango((pagina - 1) * por_pagina, por_pagina)).encode('utf-8')
+    if pagina == 1:
+        cache_primera_pagina[por_pagina] = (ranking_global.version, fragmento)
+    return fragmento
+
+def acumular_ranking(puntajes, persistir=True):
+    """
+    Suma los puntajes de una partida al ranking global. Las réplicas de los trabajadores
+    no persisten: de eso se encarga el coordinador.
+    """
+    with lock_ranking:
+        for jugador, puntaje in puntajes.items():
+            ranking_global.sumar(jugador, puntaje)
+        if persistir:
+            registro_ranking.registrar(puntajes)
+
+def guardar_rankings():
+    """
+    Escribe lo pendiente y deja la instantánea compactada. Se usa al apagar el servidor.
+    """
+    with metricas.Medir('guardar_rankings'):
+        registro_ranking.cerrar()
+
+def evento(tipo, **campos):
+    """Anota un evento de partida en el registro, si está activo. No hace E/S."""
+    if registro_eventos:
+        registro_eventos.registrar(tipo, **campos)
+
+def obtener_sala(sala_id):
+    """Busca una sala en el índice global; el bloqueo global solo se toma durante la consulta."""
+    with lock_salas:
+        return salas.get(sala_id)
+
+def eliminar_sala(sala_id, sala, avisar_espectadores=True):
+    """
+    Retira la sala del índice global y a sus jugadores del índice jugador→sala.
+    Se llama con el bloqueo de la sala tomado; la sala queda marcada como inactiva
+    para que cualquier evento pendiente sobre ella se descarte.
+    Salvo que la partida termine con su 'fin_juego' ('avisar_espectadores' en False), los
+    espectadores reciben 'sala_cerrada' como último evento, para que dejen de esperar.
+    """
+    sala.activa = False
+    lobby.retirar(sala_id)
+    if sala.ronda.plazo:
+        sala.ronda.plazo.cancel()
+    # Se escribe cuanto antes una instantánea sin la sala, para no reanudar una partida ya sumada al ranking
+    if instantaneas_salas:
+        instantaneas_salas.descartar(sala_id)
+    # Los espectadores siguen en la transmisión hasta recibir el último evento ya publicado
+    espectadores = list(sala.transmision.espectadores) if sala.transmision else ()
+    if espectadores and avisar_espectadores:
+        # La transmisión tiene su propio bloqueo, así que se puede publicar sin soltar el de la sala
+        transmitir(sala, protocolo.codificar({"status": "sala_cerrada", "mensaje": f"La sala {sala_id} se cerró."}))
+    with lock_salas:
+        salas.pop(sala_id, None)
+        for nombre in sala.jugadores:
+            if sala_de_jugador.get(nombre) == sala_id:
+                del sala_de_jugador[nombre]
+        for nombre in espectadores:
+            if sala_de_espectador.get(nombre) == sala_id:
+                del sala_de_espectador[nombre]
+        for nombre in sala.reservas or ():
+            if plazas_reservadas.get(nombre, (None, None))[1] == sala_id:
+                del plazas_reservadas[nombre]
+
+def trabajador_de_sala(sala_id):
+    """
+    Trabajador dueño de la sala, según el sufijo de su identificador ('sala_<n>.<trabajador>').
+    Devuelve None en modo de un solo proceso o si el identificador no es de ningún trabajador.
+    """
+    if TRABAJADOR is None: return None
+    _, _, sufijo = str(sala_id).rpartition('.')
+    if sufijo.isdigit() and int(sufijo) < NUM_TRABAJADORES:
+        return int(sufijo)
+    return None
+
+def trabajador_de_clave(clave):
+    """
+    Trabajador que guarda la cola de espera de una clave de emparejamiento, para que todos los
+    que buscan la misma partida coincidan en el mismo proceso. None en modo de un solo proceso.
+    """
+    if TRABAJADOR is None: return None
+    return zlib.crc32(repr(clave).encode('utf-8')) % NUM_TRABAJADORES
+
+def crear_sala_nueva(nombre_usuario, conn, modo, num_preguntas, categoria, dificultad, masiva=False):
+    """
+    Crea una sala con el jugador dentro, la registra en los índices y devuelve su identificador.
+    En una sala masiva 'modo' es la capacidad y quien la crea es su anfitrión.
+    """
+    sala_id = emparejamiento.nuevo_id_sala()
+    if TRABAJADOR is not None:
+        sala_id += f".{TRABAJADOR}"
+    sala = modelo.Sala(modo, num_preguntas, categoria, dificultad, metricas.BloqueoMedido('lock_sala'),
+                       masiva, nombre_usuario if masiva else None)
+    sala.agregar(nombre_usuario, conn)
+    with lock_salas:
+        salas[sala_id] = sala
+        sala_de_jugador[nombre_usuario] = sala_id
+    print(f"Sala {sala_id} creada por {nombre_usuario}.")
+    evento('sala_creada', sala=sala_id, creador=nombre_usuario, modo=modo, num_preguntas=num_preguntas,
+           categoria=categoria, dificultad=dificultad, masiva=masiva)
+    return sala_id
+
+def unir_a_sala(sala_id, nombre_usuario, conn):
+    """
+    Añade al jugador a la sala si sigue activa y tiene sitio. Devuelve (unido, sala_llena);
+    al llenarse, la sala deja la cola de espera del lobby. Una sala masiva nunca se da por
+    llena para empezar: la inicia su anfitrión o la cuenta atrás. Las plazas reservadas tras
+    un reinicio cuentan como ocupadas.
+    """
+    sala = obtener_sala(sala_id)
+    unido = sala_llena = False
+    tabla = None
+    if sala:
+        with sala.lock:
+            if sala.activa and sala.ocupadas() < sala.modo:
+                sala.agregar(nombre_usuario, conn)
+                with lock_salas:
+                    sala_de_jugador[nombre_usuario] = sala_id
+                unido = True
+                sala_llena = len(sala.jugadores) == sala.modo and not sala.masiva
+                if sala.estado is modelo.EstadoSala.JUGANDO and not sala.masiva:
+                    tabla = tabla_jugadores(sala)
+    if sala_llena:
+        lobby.retirar(sala_id)
+    if tabla:
+        difundir(tabla[0], tabla[1])
+    return unido, sala_llena
+
+def tabla_jugadores(sala):
+    """
+    Conexiones de la sala y su tabla de jugadores (solo para clientes binarios), para difundirla
+    cuando cambian los jugadores de una partida en curso. Se llama con el bloqueo de la sala tomado.
+    """
+    entradas = [(jugador.indice, nombre, jugador.puntaje) for nombre, jugador in sala.jugadores.items()]
+    return sala.conexiones(), protocolo.Marcos(binaria=lambda: protocolo.codificar_jugadores(entradas))
+
+def hay_preguntas(num_preguntas, categoria, dificultad):
+    try:
+        return banco.disponibles(categoria, dificultad) >= num_preguntas
+    except ValueError:
+        return False
+
+def dejar_de_observar(nombre_usuario):
+    """Quita al usuario de los espectadores de la sala que esté mirando, si mira alguna."""
+    with lock_salas:
+        sala = salas.get(sala_de_espectador.pop(nombre_usuario, None))
+    if sala and sala.transmision:
+        sala.transmision.quitar(nombre_usuario)
+
+def salir_de_sala(nombre_usuario):
+    """
+    Saca al jugador de la sala en la que esté (o en la que mire), buscándola en el índice (O(1)).
+    Si la sala queda vacía se elimina (salvo que aún tenga plazas reservadas tras un reinicio);
+    si los que quedan ya respondieron, se cierra la ronda.
+    """
+    dejar_de_observar(nombre_usuario)
+    with lock_salas:
+        sala_id = sala_de_jugador.pop(nombre_usuario, None)
+        sala = salas.get(sala_id)
+    if not sala: return
+
+    ronda_terminada = None
+    tabla = None
+    with sala.lock:
+        if not sala.activa or not sala.quitar(nombre_usuario):
+            return
+        if sala.estado is modelo.EstadoSala.JUGANDO:
+            evento('abandono', sala=sala_id, jugador=nombre_usuario, ronda=sala.siguiente)
+        if not sala.jugadores and sala.reservas is None:
+            print(f"Sala {sala_id} vacía, eliminando.")
+            eliminar_sala(sala_id, sala)
+        elif sala.jugadores:
+            if sala.estado is modelo.EstadoSala.JUGANDO and not sala.masiva:
+                tabla = tabla_jugadores(sala)
+            if sala.ronda_completa():
+                # Los jugadores que quedan ya respondieron: no hay que esperar al que se fue
+                ronda_terminada = sala.ronda.numero
+    if tabla:
+        difundir(tabla[0], tabla[1])
+    if ronda_terminada is not None:
+        cerrar_ronda(sala_id, ronda_terminada, False)
+
+def procesar_peticion(peticion, conn, addr, user_data):
+    """
+    Atiende una petición ya decodificada de un cliente y devuelve los datos del usuario.
+    Es común a los dos motores del servidor (hilos y asyncio): 'conn' solo necesita
+    los métodos 'enviar' y 'enviar_bytes'.
+    Mide la latencia de cada comando en el histograma 'comando_<nombre>'.
+    """
+    comando = peticion.get('comando')
+    with metricas.Medir(f"comando_{comando if comando in COMANDOS else 'desconocido'}"):
+        return atender_comando(peticion, conn, addr, user_data)
+
+def atender_comando(peticion, conn, addr, user_data):
+    """
+    Ejecuta el comando de la petición. Ningún envío se hace con un bloqueo tomado.
+    """
+    comando = peticion['comando']
+    nombre_usuario = user_data['nombre'] if user_data else "No registrado"
+
+    if comando == "registrar_usuario":
+        user_data = {'nombre': peticion['nombre_usuario'], 'conn': conn, 'addr': addr}
+        print(f"Usuario {user_data['nombre']} registrado desde {addr}")
+        # Los clientes nuevos pueden pedir la codificación binaria; los antiguos siguen con JSON.
+        # La respuesta va aún en JSON y la codificación elegida rige desde el siguiente mensaje.
+        respuesta = {"status": "ok", "mensaje": f"¡Bienvenido, {user_data['nombre']}!", "categorias": banco.categorias()}
+        if protocolo.BINARIA in peticion.get('codificaciones', ()):
+            respuesta['codificacion'] = protocolo.BINARIA
+        # Solo los clientes que anuncian que contestan 'ping' entran en la detección por latidos
+        if peticion.get('latido'):
+            respuesta['latido'] = INTERVALO_LATIDO
+        # Con el token, el cliente puede volver a su partida si el servidor se reinicia
+        conn.token = respuesta['token'] = secrets.token_hex(8)
+        conn.enviar(respuesta)
+        conn.codificacion = respuesta.get('codificacion', protocolo.JSON)
+        conn.nombre = user_data['nombre']
+        conn.latido = bool(peticion.get('latido'))
+
+    elif comando == "crear_sala" and user_data:
+        masiva = bool(peticion.get('masiva'))
+        if masiva:
+            modo = min(CAPACIDAD_SALA_MASIVA, max(2, int(peticion.get('capacidad', CAPACIDAD_SALA_MASIVA))))
+        else:
+            modo = int(peticion['modo'])
+        num_preguntas = int(peticion['num_preguntas'])
+        # Filtros opcionales del banco de preguntas
+        categoria = peticion.get('categoria') or None
+        dificultad = peticion.get('dificultad') or None
+        if not hay_preguntas(num_preguntas, categoria, dificultad):
+            conn.enviar({"status": "error", "mensaje": "No hay suficientes preguntas para esa categoría o dificultad."})
+            return user_data
+        # Un jugador solo está en una sala a la vez
+        salir_de_sala(nombre_usuario)
+        sala_id = crear_sala_nueva(nombre_usuario, conn, modo, num_preguntas, categoria, dificultad, masiva)
+        if masiva:
+            # Empieza sola al acabar la cuenta atrás, salvo que el anfitrión la inicie antes
+            cuenta_atras = float(peticion.get('cuenta_atras', CUENTA_ATRAS_MASIVA))
+            planificador.programar(cuenta_atras, iniciar_juego, sala_id)
+            conn.enviar({"status": "ok", "mensaje": f"Sala masiva {sala_id} creada. Empieza en {cuenta_atras:g} s o cuando la inicies.",
+                         "sala_id": sala_id, "masiva": True, "anfitrion": True, "cuenta_atras": cuenta_atras})
+        else:
+            conn.enviar({"status": "ok", "mensaje": f"Sala {sala_id} creada. Esperando jugadores...", "sala_id": sala_id})
+
+        # Si el modo es 1 (un jugador), inicia el juego inmediatamente
+        if modo == 1:
+            iniciar_juego(sala_id)
+
+    elif comando == "iniciar_partida" and user_data:
+        # El anfitrión de una sala masiva la empieza sin esperar a la cuenta atrás
+        sala = obtener_sala(peticion.get('sala_id'))
+        if not sala or not sala.masiva or sala.anfitrion != nombre_usuario or sala.estado is not modelo.EstadoSala.ESPERANDO:
+            conn.enviar({"status": "error", "mensaje": "Solo el anfitrión puede iniciar su sala masiva antes de que empiece."})
+            return user_data
+        conn.enviar({"status": "ok", "mensaje": "Partida iniciada.", "sala_id": peticion['sala_id']})
+        iniciar_juego(peticion['sala_id'])
+
+    elif comando == "unirse_sala" and user_data:
+        sala_id = peticion['sala_id']
+        # La sala está en otro proceso: la conexión entera se traspasa a su trabajador
+        destino = trabajador_de_sala(sala_id)
+        if destino is not None and destino != TRABAJADOR:
+            raise Traspaso(destino)
+        if sala_de_jugador.get(nombre_usuario) != sala_id:
+            salir_de_sala(nombre_usuario)
+        unido, sala_llena = unir_a_sala(sala_id, nombre_usuario, conn)
+        if unido:
+            print(f"Jugador {nombre_usuario} se unió a la sala {sala_id}")
+            conn.enviar({"status": "ok", "mensaje": f"Te uniste a la sala {sala_id}", "sala_id": sala_id})
+        else:
+            conn.enviar({"status": "error", "mensaje": "Sala no encontrada o está llena."})
+        # Si la sala alcanza el número de jugadores necesario, inicia el juego
+        if sala_llena:
+            iniciar_juego(sala_id)
+
+    elif comando == "buscar_partida" and user_data:
+        # Emparejamiento automático: entra en la sala que más tiempo lleva esperando con la
+        # misma configuración, o crea una y la deja en espera
+        modo = int(peticion['modo'])
+        num_preguntas = int(peticion['num_preguntas'])
+        categoria = peticion.get('categoria') or None
+        dificultad = peticion.get('dificultad') or None
+        clave = (modo, num_preguntas, categoria, dificultad)
+        destino = trabajador_de_clave(clave)
+        if destino is not None and destino != TRABAJADOR:
+            raise Traspaso(destino)
+        if not hay_preguntas(num_preguntas, categoria, dificultad):
+            conn.enviar({"status": "error", "mensaje": "No hay suficientes preguntas para esa categoría o dificultad."})
+            return user_data
+        salir_de_sala(nombre_usuario)
+
+        sala_id = None
+        sala_llena = False
+        if modo > 1:
+            while True:
+                candidata = lobby.primera(clave)
+                if candidata is None:
+                    break
+                unido, sala_llena = unir_a_sala(candidata, nombre_usuario, conn)
+                if unido:
+                    sala_id = candidata
+                    break
+                # Se llenó o se eliminó mientras tanto: deja de ofrecerse
+                lobby.retirar(candidata)
+        if sala_id:
+            print(f"Jugador {nombre_usuario} emparejado en la sala {sala_id}")
+            conn.enviar({"status": "ok", "mensaje": f"Te uniste a la sala {sala_id}", "sala_id": sala_id})
+        else:
+            sala_id = crear_sala_nueva(nombre_usuario, conn, modo, num_preguntas, categoria, dificultad)
+            if modo > 1:
+                lobby.publicar(clave, sala_id)
+            conn.enviar({"status": "ok", "mensaje": f"Sala {sala_id} creada. Esperando jugadores...", "sala_id": sala_id})
+        if modo == 1 or sala_llena:
+            iniciar_juego(sala_id)
+
+    elif comando == "observar_sala" and user_data:
+        # Se mira la partida sin jugar: los eventos llegan de la transmisión de la sala
+        sala_id = peticion['sala_id']
+        destino = trabajador_de_sala(sala_id)
+        if destino is not None and destino != TRABAJADOR:
+            raise Traspaso(destino)
+        salir_de_sala(nombre_usuario)
+        sala = obtener_sala(sala_id)
+        if sala:
+            with sala.lock:
+                if sala.activa:
+                    if sala.transmision is None:
+                        sala.transmision = transmision.Transmision()
+                    jugadores = list(sala.jugadores)
+                    estado = sala.estado.value
+                else:
+                    sala = None
+        if not sala:
+            conn.enviar({"status": "error", "mensaje": "Sala no encontrada."})
+            return user_data
+        with lock_salas:
+            sala_de_espectador[nombre_usuario] = sala_id
+        conn.enviar({"status": "ok", "mensaje": f"Observando la sala {sala_id}", "sala_id": sala_id,
+                     "jugadores": jugadores, "estado": estado, "espectadores": len(sala.transmision) + 1})
+        if sala.transmision.agregar(nombre_usuario, conn):
+            planificador.programar(0, repartir_transmision, sala.transmision)
+
+    elif comando == "dejar_de_observar" and user_data:
+        dejar_de_observar(nombre_usuario)
+        conn.enviar({"status": "ok", "mensaje": "Dejaste de observar la sala."})
+
+    elif comando == "reanudar_partida" and user_data:
+        # Tras un reinicio del servidor: el jugador vuelve a la plaza que tenía reservada, con
+        # el token que recibió al registrarse antes del reinicio
+        sala_id = peticion.get('sala_id')
+        destino = trabajador_de_sala(sala_id)
+        if destino is not None and destino != TRABAJADOR:
+            raise Traspaso(destino)
+        if sala_de_jugador.get(nombre_usuario) != sala_id:
+            salir_de_sala(nombre_usuario)
+        estado, todos_volvieron = reanudar_jugador(sala_id, nombre_usuario, peticion.get('token'), conn)
+        if not estado:
+            conn.enviar({"status": "error", "mensaje": "No hay ninguna partida que reanudar."})
+            return user_data
+        print(f"Jugador {nombre_usuario} volvió a la sala {sala_id}")
+        conn.enviar(dict(estado, status="ok", mensaje=f"Volviste a la sala {sala_id}", sala_id=sala_id, reanudada=True))
+        if todos_volvieron:
+            reanudar_sala(sala_id)
+
+    elif comando == "ver_rankings":
+        # Paginado: por defecto la primera página; incluye la posición de quien pregunta
+        pagina = max(1, int(peticion.get('pagina', 1)))
+        por_pagina = min(MAX_POR_PAGINA, max(1, int(peticion.get('por_pagina', TAMANO_PAGINA))))
+        with lock_ranking:
+            fragmento = pagina_rankings_json(pagina, por_pagina)
+            total = len(ranking_global)
+            posicion = ranking_global.posicion(nombre_usuario) if user_data else None
+            puntaje = ranking_global.puntaje(nombre_usuario) if user_data else None
+        cabecera = {"status": "ok", "pagina": pagina, "por_pagina": por_pagina, "total": total, "posicion": posicion, "puntaje": puntaje}
+        conn.enviar_bytes(protocolo.codificar_con_fragmento(cabecera, "rankings", fragmento))
+
+    elif comando == "stats":
+        if STATS_SOLO_LOCAL and addr[0] not in ('127.0.0.1', '::1'):
+            conn.enviar({"status": "error", "mensaje": "Las métricas solo se consultan desde el servidor."})
+            return user_data
+        # Perfilador por muestreo opcional, que se enciende y apaga sin reiniciar
+        if peticion.get('perfilador') == 'iniciar':
+            metricas.perfilador.iniciar()
+        elif peticion.get('perfilador') == 'detener':
+            metricas.perfilador.detener()
+        conn.enviar({"status": "ok", "stats": estadisticas()})
+
+    elif comando == "pong":
+        # Respuesta a un 'ping': devuelve el instante del servidor, así que el RTT no depende
+        # del reloj del cliente. Se suaviza con una media móvil para el informe de 'stats'.
+        if isinstance(peticion.get('t'), (int, float)):
+            rtt = max(0.0, time.monotonic() - peticion['t'])
+            metricas.observar('rtt', rtt)
+            conn.rtt = rtt if conn.rtt is None else 0.8 * conn.rtt + 0.2 * rtt
+
+    elif comando == "enviar_respuesta" and user_data:
+        sala_id = peticion['sala_id']
+        sala = obtener_sala(sala_id)
+        if not sala:
+            return user_data
+
+        msg = privado = None
+        programar_marcador = False
+        ronda_terminada = None
+        with sala.lock:
+            jugador = sala.jugadores.get(nombre_usuario)
+            if not sala.activa or sala.estado is not modelo.EstadoSala.JUGANDO or not jugador:
+                return user_data
+
+            # Ignora respuestas fuera de una ronda abierta o repetidas para la misma pregunta
+            ronda = sala.ronda
+            if ronda.cerrada or ronda.respondidos & jugador.bit:
+                return user_data
+
+            ronda.respondidos |= jugador.bit
+            ronda.contar(peticion['respuesta'])
+            recibida = time.time()
+            correcta = ronda.respuesta == peticion['respuesta'].lower()
+            puntos = 0
+
+            if correcta:
+                if sala.masiva:
+                    # En una sala masiva puntúan todos los aciertos, según su rapidez. Solo quien
+                    # acierta recibe la confirmación en el acto; el top sale a todos más tarde
+                    puntos = max(1, 100 - int((peticion['timestamp'] - ronda.timestamp_envio) * 10))
+                    jugador.puntaje += puntos
+                    sala.modificada = True
+                    ronda.acertada = True
+                    privado = {"status": "respuesta_correcta", "jugador": nombre_usuario, "puntos": puntos, "total": jugador.puntaje}
+                    if not sala.marcador_pendiente:
+                        sala.marcador_pendiente = True
+                        programar_marcador = True
+                # Solo el primer jugador que responda correctamente gana puntos
+                elif not ronda.acertada:
+                    ronda.acertada = True
+                    # El puntaje depende de la rapidez de la respuesta
+                    puntos = max(1, 100 - int((peticion['timestamp'] - ronda.timestamp_envio) * 10))
+                    jugador.puntaje += puntos
+                    sala.modificada = True
+                    msg = {"status": "respuesta_correcta", "jugador": nombre_usuario, "puntos": puntos, "marcador": sala.puntajes()}
+                    delta = (jugador.indice, puntos, jugador.puntaje)
+                    jugadores_actuales = sala.conexiones()
+
+            if sala.ronda_completa():
+                ronda_terminada = ronda.numero
+            numero_ronda = ronda.numero
+            numero_pregunta = sala.preguntas[numero_ronda]
+            tiempo = recibida - ronda.timestamp_envio
+
+        # El tiempo de respuesta se mide con el reloj del servidor, desde el envío de la pregunta
+        evento('respuesta', sala=sala_id, ronda=numero_ronda, pregunta=numero_pregunta, jugador=nombre_usuario,
+               respuesta=peticion['respuesta'][:32], correcta=correcta, tiempo=round(tiempo, 3), puntos=puntos)
+
+        # Notifica a todos los jugadores de la sala, ya sin el bloqueo
+        # (los clientes binarios solo reciben la diferencia; cada una lleva el total del jugador,
+        # así que en la cola de salida solo sustituye a la anterior del mismo jugador)
+        if msg:
+            marcos = protocolo.Marcos(json=lambda: protocolo.codificar(msg), binaria=lambda: protocolo.codificar_acierto(*delta),
+                                      claves={protocolo.BINARIA: f"marcador:{delta[0]}"})
+            difundir(jugadores_actuales, marcos, clave='marcador')
+            transmitir(sala, marcos.para(protocolo.JSON), marcador=True)
+        if privado:
+            conn.enviar(privado)
+        if programar_marcador:
+            planificador.programar(INTERVALO_MARCADOR, difundir_marcador, sala_id)
+
+        # Ya respondieron todos: la ronda se cierra en el acto, sin esperar a su plazo
+        if ronda_terminada is not None:
+            cerrar_ronda(sala_id, ronda_terminada, False)
+
+    return user_data
+
+def estadisticas():
+    """Métricas acumuladas más el estado actual de conexiones, salas y colas de salida."""
+    actuales = list(conexiones)
+    colas = [(c.cola.bytes, c.cola.descartados) for c in actuales]
+    medidos = sorted((c for c in actuales if c.rtt is not None), key=lambda c: c.rtt, reverse=True)
+    return metricas.instantanea(
+        conexiones_activas=len(colas),
+        conexiones_con_latido=sum(1 for c in actuales if c.latido),
+        rtt_mas_altos_ms=[[c.nombre, round(c.rtt * 1000, 1)] for c in medidos[:10]],
+        salas_activas=len(salas),
+        salas_en_espera=sum(lobby.en_espera().values()),
+        jugadores_en_salas=len(sala_de_jugador),
+        espectadores=len(sala_de_espectador),
+        plazas_reservadas=len(plazas_reservadas),
+        hilos=threading.active_count(),
+        trabajador=TRABAJADOR,
+        colas_salida={
+            'bytes_total': sum(b for b, _ in colas),
+            'bytes_max': max((b for b, _ in colas), default=0),
+            'descartados': sum(d for _, d in colas),
+        })
+
+def atender_lote(peticiones, conn, addr, user_data):
+    """
+    Atiende en orden las peticiones recibidas y devuelve los datos del usuario. Si una debe
+    continuar en otro trabajador, devuelve también el traspaso: (destino, peticiones que faltan,
+    empezando por esa).
+    """
+    for i, peticion in enumerate(peticiones):
+        try:
+            user_data = procesar_peticion(peticion, conn, addr, user_data)
+        except Traspaso as t:
+            return user_data, (t.destino, peticiones[i:])
+    return user_data, None
+
+def retomar_sesion(traspaso, conn, addr, decodificador):
+    """
+    Estado inicial de una conexión: vacío si es nueva, o el que trae un traspaso de otro
+    trabajador (usuario ya registrado, peticiones por atender y bytes aún sin decodificar).
+    """
+    if not traspaso:
+        metricas.sumar('conexiones_totales')
+        return None, []
+    metricas.sumar('traspasos_recibidos')
+    decodificador.buffer = traspaso['buffer'].encode('latin-1')
+    print(f"Sesión de {traspaso['nombre']} ({addr}) recibida de otro trabajador")
+    conn.codificacion = traspaso.get('codificacion', protocolo.JSON)
+    conn.latido = traspaso.get('latido', False)
+    conn.nombre = traspaso['nombre']
+    conn.token = traspaso.get('token')
+    return {'nombre': traspaso['nombre'], 'conn': conn, 'addr': addr}, traspaso['peticiones']
+
+def traspasar(fd, user_data, pendiente, buffer):
+    """
+    Entrega la conexión de un cliente al trabajador dueño de la sala, a través del coordinador.
+    'fd' es un duplicado del socket del cliente; esta copia se cierra al enviarlo.
+    Si el traspaso no cabe en un paquete del canal (peticiones o bytes pendientes demasiado
+    grandes), el cliente recibe un error y la conexión se cierra.
+    """
+    destino, peticiones = pendiente
+    metricas.sumar('traspasos_enviados')
+    try:
+        canal_coordinador.enviar({'tipo': 'traspaso', 'destino': destino, 'nombre': user_data['nombre'],
+                                  'codificacion': user_data['conn'].codificacion, 'latido': user_data['conn'].latido,
+                                  'token': user_data['conn'].token,
+                                  'peticiones': peticiones, 'buffer': buffer.decode('latin-1')}, fd)
+    except ValueError as e:
+        print(f"No se pudo traspasar a {user_data['nombre']} al trabajador {destino}: {e}")
+        metricas.sumar('traspasos_demasiado_grandes')
         try:
-            with open('ranking_global.json', 'r') as f:
-                ranking_global = json.load(f)
-            print("Rankings cargados.")
-        except json.JSONDecodeError:
-            print("Error al cargar rankings, el archivo puede estar corrupto.")
-            ranking_global = {}
+            with socket.socket(fileno=os.dup(fd)) as sock:
+                sock.sendall(protocolo.codificar({"status": "error", "mensaje": "Petición demasiado grande; vuelve a conectarte."}))
+        except OSError:
+            pass
+    except OSError as e:
+        print(f"No se pudo traspasar a {user_data['nombre']} al trabajador {destino}: {e}")
+    finally:
+        os.close(fd)
 
-def manejar_cliente(conn, addr):
+def atender_coordinador(mensaje, fd, retomar):
+    """
+    Mensaje del coordinador recibido por un trabajador: diferencias del ranking o una conexión
+    traspasada, que 'retomar' pone en marcha con el motor de este trabajador.
+    """
+    if mensaje['tipo'] == 'ranking':
+        acumular_ranking(mensaje['puntajes'], persistir=False)
+    elif mensaje['tipo'] == 'traspaso':
+        retomar(socket.socket(fileno=fd), mensaje)
+
+def limpiar_sesion(user_data):
+    """
+    Lógica de limpieza: elimina al jugador de su sala si se desconecta.
+    """
+    nombre_usuario = user_data['nombre']
+    print(f"Limpiando sesión para {nombre_usuario}.")
+    salir_de_sala(nombre_usuario)
+
+class ConexionHilo:
+    """
+    Conexión de un cliente en el motor de hilos.
+    Los mensajes salientes van a una cola acotada y un hilo escritor la vacía: todo lo que
+    se acumuló mientras el socket estaba ocupado sale en un único 'sendall'. Quien encola
+    nunca se bloquea, aunque el cliente tenga la red saturada.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.cola = salida.ColaSalida(LIMITE_COLA_SALIDA, POLITICA_LENTOS)
+        self.cond = threading.Condition()
+        self.cerrada = False
+        self.codificacion = protocolo.JSON  # Se negocia al registrarse
+        self.nombre = None
+        self.latido = False
+        self.ultima_actividad = time.monotonic()
+        self.rtt = None
+        self.token = None
+        self.hilo = threading.Thread(target=self._escribir, daemon=True)
+        self.hilo.start()
+
+    def enviar(self, mensaje, clave=None):
+        self.enviar_bytes(protocolo.codificar(mensaje), clave)
+
+    def enviar_bytes(self, datos, clave=None):
+        with self.cond:
+            if self.cerrada: return
+            if not self.cola.agregar(datos, clave):
+                self._cortar("demasiado lento")
+                return
+            self.cond.notify()
+
+    def cerrar(self):
+        """Termina de enviar lo pendiente y cierra el socket."""
+        with self.cond:
+            self.cerrada = True
+            self.cond.notify()
+
+    def soltar(self):
+        """
+        Termina de enviar lo pendiente y devuelve un duplicado del descriptor del socket,
+        para pasar la conexión a otro proceso sin cerrarla.
+        """
+        fd = os.dup(self.sock.fileno())
+        self.cerrar()
+        self.hilo.join()
+        return fd
+
+    def cortar(self, motivo):
+        """Corta la conexión sin enviar lo pendiente (cliente lento o sin señales de vida)."""
+        with self.cond:
+            self._cortar(motivo)
+
+    def _cortar(self, motivo):
+        # Se descarta lo pendiente y se corta la conexión; el hilo lector, aunque esté
+        # bloqueado en 'recv', ve el cierre y hace la limpieza normal de la sesión.
+        print(f"Cliente {motivo}, desconectando.")
+        self.cerrada = True
+        self.cola.tomar_todo()
+        self.cond.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+
+    def _escribir(self):
+        while True:
+            with self.cond:
+                while not self.cola and not self.cerrada:
+                    self.cond.wait()
+                if not self.cola:
+                    break
+                bloque = self.cola.tomar_todo()
+            try:
+                self.sock.sendall(bloque)
+                metricas.sumar('bytes_salida', len(bloque))
+            except OSError:
+                with self.cond:
+                    self.cerrada = True
+                    self.cola.tomar_todo()
+                break
+        self.sock.close()
+
+def manejar_cliente(conn, addr, traspaso=None):
     """
     Función que se ejecuta en un hilo para cada cliente.
     Gestiona la comunicación y las peticiones del cliente (registro, salas, respuestas).
+    Un mismo 'recv' puede traer varias peticiones seguidas; se atienden todas en orden.
+    'traspaso' es el estado de una conexión que llega desde otro trabajador.
     """
     print(f"Conectado a {addr}")
-    user_data = None
+    activar_keepalive(conn)
+    conexion = ConexionHilo(conn)
+    conexiones.add(conexion)
+    decodificador = protocolo.Decodificador()
+    user_data, peticiones = retomar_sesion(traspaso, conexion, addr, decodificador)
+    pendiente = None
     try:
         while True:
-            data = conn.recv(1024).decode('utf-8')
+            user_data, pendiente = atender_lote(peticiones, conexion, addr, user_data)
+            if pendiente:
+                break
+            data = conn.recv(4096)
             if not data:
                 break
-            
-            peticion = json.loads(data)
-            comando = peticion['comando']
-            nombre_usuario = user_data['nombre'] if user_data else "No registrado"
-
-            if comando == "registrar_usuario":
-                user_data = {'nombre': peticion['nombre_usuario'], 'conn': conn, 'addr': addr}
-                print(f"Usuario {user_data['nombre']} registrado desde {addr}")
-                conn.sendall(json.dumps({"status": "ok", "mensaje": f"¡Bienvenido, {user_data['nombre']}!"}).encode('utf-8'))
-            
-            elif comando == "crear_sala" and user_data:
-                modo = int(peticion['modo'])
-                num_preguntas = int(peticion['num_preguntas'])
-                sala_id = f"sala_{int(time.time())}"
-                with lock_salas:
-                    salas[sala_id] = {
-                        'jugadores': {nombre_usuario: conn},
-                        'modo': modo, 'estado': 'esperando',
-                        'num_preguntas': num_preguntas,
-                        'puntajes': {nombre_usuario: 0}
-                    }
-                print(f"Sala {sala_id} creada por {nombre_usuario}.")
-                conn.sendall(json.dumps({"status": "ok", "mensaje": f"Sala {sala_id} creada. Esperando jugadores...", "sala_id": sala_id}).encode('utf-8'))
-                
-                # Si el modo es 1 (un jugador), inicia el juego inmediatamente
-                if modo == 1:
-                    threading.Thread(target=jugar_sala, args=(sala_id,), daemon=True).start()
-
-            elif comando == "unirse_sala" and user_data:
-                sala_id = peticion['sala_id']
-                with lock_salas:
-                    if sala_id in salas and len(salas[sala_id]['jugadores']) < salas[sala_id]['modo']:
-                        salas[sala_id]['jugadores'][nombre_usuario] = conn
-                        salas[sala_id]['puntajes'][nombre_usuario] = 0
-                        print(f"Jugador {nombre_usuario} se unió a la sala {sala_id}")
-                        conn.sendall(json.dumps({"status": "ok", "mensaje": f"Te uniste a la sala {sala_id}", "sala_id": sala_id}).encode('utf-8'))
-                        # Si la sala alcanza el número de jugadores necesario, inicia el juego
-                        if len(salas[sala_id]['jugadores']) == salas[sala_id]['modo']:
-                            threading.Thread(target=jugar_sala, args=(sala_id,), daemon=True).start()
-                    else:
-                        conn.sendall(json.dumps({"status": "error", "mensaje": "Sala no encontrada o está llena."}).encode('utf-8'))
-
-            elif comando == "ver_rankings":
-                with lock_ranking:
-                    ranking_ordenado = sorted(ranking_global.items(), key=lambda item: item[1], reverse=True)
-                    conn.sendall(json.dumps({"status": "ok", "rankings": ranking_ordenado}).encode('utf-8'))
-            
-            elif comando == "enviar_respuesta" and user_data:
-                sala_id = peticion['sala_id']
-                with lock_salas:
-                    sala = salas.get(sala_id)
-                    if not sala or sala.get('estado') != 'jugando':
-                        continue
-                    
-                    # Evita que un jugador responda más de una vez por pregunta
-                    if nombre_usuario in sala.get('pregunta_actual', {}).get('respuestas_recibidas', set()):
-                        continue
-                    
-                    sala['pregunta_actual']['respuestas_recibidas'].add(nombre_usuario)
-                    
-                    pregunta_info = sala['pregunta_actual']
-                    if pregunta_info['pregunta']['respuesta'].lower() == peticion['respuesta'].lower():
-                        # Solo el primer jugador que responda correctamente gana puntos
-                        if not pregunta_info.get('primera_respuesta_correcta', False):
-                            sala['pregunta_actual']['primera_respuesta_correcta'] = True
-                            # El puntaje depende de la rapidez de la respuesta
-                            puntos = max(1, 100 - int((peticion['timestamp'] - pregunta_info['timestamp_envio']) * 10))
-                            sala['puntajes'][nombre_usuario] += puntos
-                            
-                            # Notifica a todos los jugadores de la sala
-                            msg = {"status": "respuesta_correcta", "jugador": nombre_usuario, "puntos": puntos, "marcador": sala['puntajes']}
-                            for c in sala['jugadores'].values():
-                                c.sendall(json.dumps(msg).encode('utf-8'))
-    
-    except (json.JSONDecodeError, ConnectionResetError, BrokenPipeError) as e:
+            conexion.ultima_actividad = time.monotonic()
+            metricas.sumar('bytes_entrada', len(data))
+            peticiones = decodificador.alimentar(data)
+
+    except (protocolo.ErrorProtocolo, ConnectionResetError, BrokenPipeError) as e:
         print(f"Error o desconexión del cliente {addr}: {e}")
     finally:
-        # Lógica de limpieza: elimina al jugador de las salas si se desconecta
         if user_data:
-            nombre_usuario = user_data['nombre']
-            print(f"Limpiando sesión para {nombre_usuario}.")
-            with lock_salas:
-                for sala_id, sala in list(salas.items()):
-                    if nombre_usuario in sala.get('jugadores', {}):
-                        del sala['jugadores'][nombre_usuario]
-                        if nombre_usuario in sala.get('puntajes', {}):
-                            del sala['puntajes'][nombre_usuario]
-                        if not sala['jugadores']:
-                            print(f"Sala {sala_id} vacía, eliminando.")
-                            del salas[sala_id]
-
-def jugar_sala(sala_id):
-    """
-    Función que gestiona el juego en una sala específica.
-    Se ejecuta en un hilo separado por cada partida.
+            limpiar_sesion(user_data)
+        conexiones.discard(conexion)
+        if pendiente:
+            traspasar(conexion.soltar(), user_data, pendiente, decodificador.buffer)
+        else:
+            conexion.cerrar()
+
+def iniciar_juego(sala_id):
     """
-    with lock_salas:
-        if sala_id not in salas: return
-        sala = salas[sala_id]
-        sala['estado'] = 'jugando'
-        num_preguntas = sala['num_preguntas']
-        print(f"Iniciando juego en sala {sala_id}")
+    Pone la sala en juego y programa su primera pregunta.
+    La partida avanza por eventos (plazos del planificador y respuestas de los jugadores):
+    no hay un hilo ni una corrutina dedicada a cada sala.
+    """
+    sala = obtener_sala(sala_id)
+    if not sala: return
+    with sala.lock:
+        # Una sala masiva puede recibir el inicio del anfitrión y el de la cuenta atrás
+        if not sala.activa or apagando or sala.estado is modelo.EstadoSala.JUGANDO: return
+        sala.estado = modelo.EstadoSala.JUGANDO
+        # Selecciona preguntas aleatorias del banco (solo sus números de registro)
+        sala.preguntas = banco.muestra(sala.num_preguntas, sala.categoria, sala.dificultad)
+        sala.siguiente = 0
+        sala.modificada = True
+        # Las salas masivas no envían marcos que se refieran a índices de jugador
+        tabla = None if sala.masiva else tabla_jugadores(sala)
+        jugadores = len(sala.jugadores)
+    print(f"Iniciando juego en sala {sala_id}")
+    evento('partida_iniciada', sala=sala_id, jugadores=jugadores)
+    # Los clientes binarios reciben primero la tabla de jugadores a la que se refieren los demás marcos
+    if tabla:
+        difundir(*tabla)
+    planificador.programar(0, enviar_pregunta, sala_id)
+
+def enviar_pregunta(sala_id):
+    """
+    Abre la siguiente ronda de la sala: envía la pregunta y programa su plazo máximo.
+    """
+    sala = obtener_sala(sala_id)
+    if not sala: return
+    with sala.lock:
+        if not sala.activa or apagando: return
+        if not sala.jugadores:
+            print(f"Juego en {sala_id} cancelado por falta de jugadores.")
+            eliminar_sala(sala_id, sala)
+            return
+
+        ronda = sala.siguiente
+        numero = sala.preguntas[ronda]
+        # Si no responden todos antes, el planificador cierra la ronda al vencer el plazo
+        pregunta = banco.pregunta(numero)
+        sala.abrir_ronda(pregunta['respuesta'], len(pregunta['opciones']), time.time(),
+                         planificador.programar(TIEMPO_RESPUESTA, cerrar_ronda, sala_id, ronda, True))
+        jugadores_actuales = sala.conexiones()
+        num_preguntas = len(sala.preguntas)
+    evento('pregunta', sala=sala_id, ronda=ronda, pregunta=numero, categoria=pregunta.get('categoria'),
+           dificultad=pregunta.get('dificultad'), jugadores=len(jugadores_actuales))
+
+    # La pregunta en sí va como bytes ya codificados, compartidos por todas las salas que la usen
+    enviada = time.time()
+    msg_pregunta = protocolo.Marcos(
+        json=lambda: protocolo.codificar_con_fragmento({"status": "pregunta", "ronda_actual": ronda + 1, "rondas_totales": num_preguntas, "timestamp": enviada}, "pregunta", banco.payload(numero)),
+        binaria=lambda: protocolo.codificar_pregunta(ronda + 1, num_preguntas, enviada, banco.payload(numero)))
+    difundir(jugadores_actuales, msg_pregunta)
+    transmitir(sala, msg_pregunta.para(protocolo.JSON))
+
+def cerrar_ronda(sala_id, ronda, tiempo_agotado):
+    """
+    Cierra una ronda porque venció su plazo o porque ya respondieron todos,
+    y programa la siguiente pregunta (o el fin de la partida) tras la pausa.
+    Si la ronda ya se había cerrado por la otra vía, no hace nada.
+    """
+    sala = obtener_sala(sala_id)
+    if not sala: return
+    with sala.lock:
+        actual = sala.ronda
+        if not sala.activa or actual.numero != ronda or actual.cerrada:
+            return
+        actual.cerrada = True
+        actual.plazo.cancel()
+        jugadores_actuales = sala.conexiones()
+        sala.siguiente += 1
+        sala.modificada = True
+        quedan_preguntas = sala.siguiente < len(sala.preguntas)
+        resultado = {"status": "resultado_ronda", "ronda": ronda + 1, "respuesta": actual.respuesta,
+                     "conteo": actual.conteo} if sala.masiva else None
+        respuestas, acertada = bin(actual.respondidos).count('1'), actual.acertada
+    evento('ronda_cerrada', sala=sala_id, ronda=ronda, tiempo_agotado=tiempo_agotado, respuestas=respuestas, acertada=acertada)
+
+    # Si el tiempo se acabó, notifica a los jugadores
+    if tiempo_agotado:
+        print(f"Tiempo agotado en sala {sala_id}, ronda {ronda+1}.")
+        marcos = protocolo.Marcos(json=lambda: protocolo.codificar({"status": "tiempo_agotado"}),
+                                  binaria=lambda: protocolo.MARCO_TIEMPO_AGOTADO)
+        difundir(jugadores_actuales, marcos)
+        transmitir(sala, marcos.para(protocolo.JSON))
+
+    # En una sala masiva todos ven cuántos eligieron cada opción
+    if resultado:
+        datos = protocolo.codificar(resultado)
+        difundir(jugadores_actuales, datos)
+        transmitir(sala, datos)
+
+    # Pausa antes de la siguiente pregunta
+    planificador.programar(PAUSA_ENTRE_PREGUNTAS, enviar_pregunta if quedan_preguntas else terminar_partida, sala_id)
+
+def activar_keepalive(sock):
+    """Keepalive de TCP en el socket de un cliente, con los plazos de KEEPALIVE_TCP donde el sistema los admite."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for opcion, valor in zip(('TCP_KEEPIDLE', 'TCP_KEEPINTVL', 'TCP_KEEPCNT'), KEEPALIVE_TCP):
+            if hasattr(socket, opcion):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opcion), valor)
+    except OSError:
+        pass
 
-    # Selecciona preguntas aleatorias para la ronda
-    preguntas_ronda = random.sample(preguntas['general'], k=num_preguntas)
+def revisar_latidos():
+    """
+    Tarea periódica del planificador: corta las conexiones con latido que llevan más de
+    TIEMPO_INACTIVIDAD segundos sin enviar nada y manda un 'ping' a las demás.
+    Al cortarse, el lector de la conexión ve el cierre y la sesión se limpia como siempre
+    (sale de su sala y, si los que quedan ya respondieron, la ronda se cierra en el acto).
+    """
+    ahora = time.monotonic()
+    vivas = []
+    for conn in list(conexiones):
+        if not conn.latido: continue
+        if ahora - conn.ultima_actividad > TIEMPO_INACTIVIDAD:
+            metricas.sumar('conexiones_inactivas_cortadas')
+            conn.cortar("sin señales de vida")
+        else:
+            vivas.append(conn)
+    if vivas:
+        # Un solo 'ping' codificado para todos; si el anterior sigue en la cola, lo sustituye
+        difundir(vivas, protocolo.codificar({"status": "ping", "t": ahora}), clave='ping')
+    planificador.programar(INTERVALO_LATIDO, revisar_latidos)
+
+def difundir(conexiones, datos, clave=None):
+    """
+    Encola los mismos bytes, ya codificados una sola vez, en varias conexiones.
+    'datos' puede ser un 'protocolo.Marcos': cada conexión recibe la variante de su codificación.
+    'clave' marca mensajes sustituibles (como el marcador) que la cola de un cliente lento
+    puede descartar o reemplazar por uno más reciente.
+    """
+    if not isinstance(datos, protocolo.Marcos):
+        for conn in conexiones:
+            conn.enviar_bytes(datos, clave)
+        return
+    for conn in conexiones:
+        marco = datos.para(conn.codificacion)
+        if marco is not None:
+            conn.enviar_bytes(marco, datos.claves.get(conn.codificacion, clave))
+
+def transmitir(sala, datos, marcador=False):
+    """
+    Publica un evento ya codificado para los espectadores de la sala, si tiene, y programa su
+    reparto. Se llama después de difundir a los jugadores y sin el bloqueo de la sala.
+    """
+    if sala.transmision is not None and sala.transmision.publicar(datos, marcador):
+        planificador.programar(0, repartir_transmision, sala.transmision)
 
-    for i, pregunta in enumerate(preguntas_ronda):
+def repartir_transmision(t):
+    """
+    Tarea del planificador que envía a un lote de espectadores los eventos que les faltan y se
+    vuelve a programar mientras quede trabajo; entre lote y lote corren las tareas de los jugadores.
+    """
+    with metricas.Medir('repartir_transmision'):
+        envios, siguiente = t.repartir(LIMITE_COLA_ESPECTADOR, LOTE_ESPECTADORES)
+        for conn, datos, clave in envios:
+            conn.enviar_bytes(datos, clave)
+    metricas.sumar('eventos_espectadores', len(envios))
+    if siguiente == transmision.SEGUIR:
+        planificador.programar(0, repartir_transmision, t)
+    elif siguiente == transmision.REINTENTAR:
+        planificador.programar(REINTENTO_ESPECTADORES, repartir_transmision, t)
+
+def difundir_marcador(sala_id):
+    """
+    Envía el top de una sala masiva a todos sus jugadores. Se programa con el primer acierto
+    tras la difusión anterior, así que sale como mucho una vez cada INTERVALO_MARCADOR segundos
+    y su tamaño no depende del número de jugadores.
+    """
+    sala = obtener_sala(sala_id)
+    if not sala: return
+    with sala.lock:
+        if not sala.activa: return
+        sala.marcador_pendiente = False
+        msg = {"status": "marcador", "top": sala.top(TOP_MARCADOR), "jugadores": len(sala.jugadores)}
+        jugadores_actuales = sala.conexiones()
+    datos = protocolo.codificar(msg)
+    difundir(jugadores_actuales, datos, clave='marcador')
+    transmitir(sala, datos, marcador=True)
+
+def terminar_partida(sala_id):
+    """
+    Envía el marcador final, acumula los puntajes en el ranking global y elimina la sala.
+    El ranking solo se actualiza en memoria; su escritura a disco la hace el registro en segundo plano.
+    """
+    sala = obtener_sala(sala_id)
+    if not sala: return
+    with sala.lock:
+        # Al apagar, la sala ya está en la última instantánea: se terminará tras el reinicio
+        if not sala.activa or apagando: return
+        puntajes = sala.puntajes()
+        indices = sala.indices
+        masiva = sala.masiva
+        top = sala.top(TOP_MARCADOR) if masiva else None
+        jugadores_actuales = sala.conexiones()
+        # Elimina la sala al finalizar el juego; los espectadores reciben el 'fin_juego'
+        eliminar_sala(sala_id, sala, avisar_espectadores=False)
+
+    ganador = max(puntajes, key=puntajes.get) if puntajes else "Nadie"
+
+    # Envía el resultado final a todos los jugadores
+    msg_final = {"status": "fin_juego", "marcador_final": puntajes, "ganador": ganador, "ganador_puntos": puntajes.get(ganador, 0)}
+    if masiva:
+        # Solo el top: el marcador completo de cientos de jugadores a cada uno sería cuadrático
+        msg_final.update(marcador_final=dict(top), jugadores=len(puntajes))
+        marcos = protocolo.Marcos(json=lambda: protocolo.codificar(msg_final))
+        difundir(jugadores_actuales, marcos.para(protocolo.JSON))
+    else:
+        marcos = protocolo.Marcos(
+            json=lambda: protocolo.codificar(msg_final),
+            binaria=lambda: protocolo.codificar_fin(indices.get(ganador, protocolo.SIN_JUGADOR), [(indices[j], p) for j, p in puntajes.items()]))
+        difundir(jugadores_actuales, marcos)
+    # El marcador final es lo último que recibe cualquier espectador, aunque vaya atrasado
+    transmitir(sala, marcos.para(protocolo.JSON), marcador=True)
+
+    print(f"Juego terminado en sala {sala_id}. Ganador: {ganador}")
+    evento('fin_partida', sala=sala_id, ganador=ganador, puntajes=puntajes)
+    sumar_al_ranking(puntajes)
+
+def sumar_al_ranking(puntajes):
+    """
+    Actualiza el ranking global con los puntajes de una partida; con varios trabajadores
+    lo hace el coordinador, que luego reparte la diferencia a todas las réplicas.
+    """
+    if canal_coordinador:
+        canal_coordinador.enviar({'tipo': 'partida', 'puntajes': puntajes})
+    else:
+        acumular_ranking(puntajes)
+
+def registro_sala(sala_id, sala):
+    """
+    Registro de la sala para la instantánea, con el token de cada jugador (presente o reservado),
+    su clave del lobby si espera jugadores y la huella del banco al que se refieren sus preguntas.
+    Se llama con el bloqueo de la sala tomado.
+    """
+    registro = sala.registro()
+    registro['id'] = sala_id
+    registro['banco'] = banco.huella
+    tokens = {nombre: jugador.conn.token for nombre, jugador in sala.jugadores.items()}
+    if sala.reservas:
         with lock_salas:
-            if sala_id not in salas or not salas[sala_id]['jugadores']:
-                print(f"Juego en {sala_id} cancelado por falta de jugadores.")
-                if sala_id in salas: del salas[sala_id]
-                return
-            
-            sala = salas[sala_id]
-            sala['pregunta_actual'] = {
-                'pregunta': pregunta, 'timestamp_envio': time.time(),
-                'primera_respuesta_correcta': False, 'respuestas_recibidas': set()
-            }
-            jugadores_actuales = list(sala['jugadores'].values())
-
-        msg_pregunta = json.dumps({"status": "pregunta", "pregunta": pregunta, "ronda_actual": i + 1, "rondas_totales": num_preguntas}).encode('utf-8')
-        for conn in jugadores_actuales:
-            try:
-                conn.sendall(msg_pregunta)
-            except socket.error: pass
-
-        # Espera un máximo de 30 segundos para las respuestas
-        start_time = time.time()
-        tiempo_terminado = True
-        while time.time() - start_time < 30:
-            with lock_salas:
-                if sala_id not in salas: return
-                sala = salas[sala_id]
-                if len(sala['pregunta_actual']['respuestas_recibidas']) >= len(sala['jugadores']):
-                    tiempo_terminado = False
-                    break
-            time.sleep(0.5)
-
-        # Si el tiempo se acabó, notifica a los jugadores
-        if tiempo_terminado:
-            print(f"Tiempo agotado en sala {sala_id}, ronda {i+1}.")
-            msg_timeout = json.dumps({"status": "tiempo_agotado"}).encode('utf-8')
-            for conn in jugadores_actuales:
-                try:
-                    conn.sendall(msg_timeout)
-                except socket.error: pass
-        
-        # Pausa antes de la siguiente pregunta
-        time.sleep(3)
-
-    # Fin del juego
+            for nombre in sala.reservas:
+                tokens[nombre] = plazas_reservadas.get(nombre, (None, None))[0]
+    registro['tokens'] = tokens
+    registro['clave'] = lobby.clave(sala_id)
+    return registro
+
+def tomar_instantanea(final=False):
+    """
+    Tarea periódica del planificador: vuelve a serializar solo las salas que cambiaron desde la
+    anterior y pide al hilo escritor que guarde el conjunto. Con 'final' (al apagar) escribe en
+    el acto, no se vuelve a programar y ya no se escribe nada más.
+    """
+    if apagando and not final: return
+    with metricas.Medir('instantanea_salas'):
+        with lock_salas:
+            actuales = list(salas.items())
+        for sala_id, sala in actuales:
+            if not sala.modificada: continue
+            with sala.lock:
+                # Dentro del bloqueo: una sala eliminada mientras tanto no vuelve a la instantánea
+                if sala.activa:
+                    sala.modificada = False
+                    instantaneas_salas.actualizar(sala_id, registro_sala(sala_id, sala))
+    if final:
+        instantaneas_salas.cerrar()
+    else:
+        instantaneas_salas.pedir_escritura()
+        planificador.programar(INTERVALO_INSTANTANEA, tomar_instantanea)
+
+def iniciar_eventos():
+    """Al arrancar un motor: abre el registro de eventos de este proceso y arranca su hilo escritor."""
+    global registro_eventos
+    if not RUTA_EVENTOS: return
+    raiz, extension = os.path.splitext(RUTA_EVENTOS)
+    registro_eventos = eventos.RegistroEventos(RUTA_EVENTOS if TRABAJADOR is None else f"{raiz}.{TRABAJADOR}{extension}")
+    registro_eventos.iniciar()
+
+def cerrar_eventos():
+    """Al apagar: escribe los eventos que quedan en el búfer."""
+    if registro_eventos:
+        registro_eventos.cerrar()
+
+def iniciar_instantaneas():
+    """
+    Al arrancar un motor, ya con el planificador: restaura las salas de la instantánea anterior
+    y programa las siguientes.
+    """
+    global instantaneas_salas
+    if not RUTA_INSTANTANEA: return
+    ruta = RUTA_INSTANTANEA if TRABAJADOR is None else f"{RUTA_INSTANTANEA}.{TRABAJADOR}"
+    instantaneas_salas = instantaneas.Instantaneas(ruta)
+    restaurar_salas(instantaneas_salas.cargar())
+    instantaneas_salas.iniciar()
+    planificador.programar(INTERVALO_INSTANTANEA, tomar_instantanea)
+
+def restaurar_salas(cargada):
+    """
+    Recrea las salas de una instantánea con las plazas de sus jugadores reservadas durante
+    GRACIA_REINICIO segundos. Las que esperaban jugadores vuelven al lobby en el acto (las plazas
+    reservadas cuentan como ocupadas). Si la instantánea es demasiado antigua no se reanuda
+    ninguna partida: solo se suman al ranking los puntajes que tenía. Tampoco se reanudan las
+    partidas cuyas preguntas son de otra versión del banco (se editó entre el apagado y el
+    arranque): sus números de registro ya señalarían otras preguntas.
+    """
+    if not cargada: return
+    instante, registros = cargada
+    if time.time() - instante > EDAD_MAXIMA_INSTANTANEA:
+        print(f"Instantánea de salas demasiado antigua; se suman al ranking los puntajes de {len(registros)} salas.")
+        descartadas, registros = registros, []
+    else:
+        vigentes = [not r['preguntas'] or r.get('banco') == banco.huella for r in registros]
+        descartadas = [r for r, vigente in zip(registros, vigentes) if not vigente]
+        registros = [r for r, vigente in zip(registros, vigentes) if vigente]
+        if descartadas:
+            print(f"El banco de preguntas cambió; se suman al ranking los puntajes de {len(descartadas)} salas en juego.")
+    for registro in descartadas:
+        if registro['puntajes']:
+            sumar_al_ranking(registro['puntajes'])
+    if not registros: return
+    for registro in registros:
+        sala_id = registro['id']
+        sala = modelo.Sala.desde_registro(registro, metricas.BloqueoMedido('lock_sala'))
+        with lock_salas:
+            salas[sala_id] = sala
+            for nombre, token in registro['tokens'].items():
+                if token:
+                    plazas_reservadas[nombre] = (token, sala_id)
+        emparejamiento.continuar_despues_de(sala_id)
+        if registro['clave']:
+            lobby.publicar(tuple(registro['clave']), sala_id)
+        if sala.masiva and sala.estado is modelo.EstadoSala.ESPERANDO:
+            planificador.programar(CUENTA_ATRAS_MASIVA, iniciar_juego, sala_id)
+        planificador.programar(GRACIA_REINICIO, reanudar_sala, sala_id)
+    print(f"{len(registros)} salas restauradas; los jugadores tienen {GRACIA_REINICIO} s para volver.")
+
+def reanudar_jugador(sala_id, nombre_usuario, token, conn):
+    """
+    Devuelve al jugador a su plaza reservada, con su puntaje, si el token coincide.
+    Devuelve (estado de la partida para el jugador o None, si ya volvieron todos los reservados).
+    """
     with lock_salas:
-        if sala_id not in salas: return
-        sala = salas[sala_id]
-        puntajes = sala['puntajes']
-        ganador = max(puntajes, key=puntajes.get) if puntajes else "Nadie"
-        
-        # Envía el resultado final a todos los jugadores
-        msg_final = {"status": "fin_juego", "marcador_final": puntajes, "ganador": ganador, "ganador_puntos": puntajes.get(ganador, 0)}
-        for conn in sala['jugadores'].values():
-            try:
-                conn.sendall(json.dumps(msg_final).encode('utf-8'))
-            except socket.error: pass
-        
-        print(f"Juego terminado en sala {sala_id}. Ganador: {ganador}")
-        
-        # Actualiza el ranking global con los puntajes de la partida
-        with lock_ranking:
-            for jugador, puntaje in puntajes.items():
-                ranking_global[jugador] = ranking_global.get(jugador, 0) + puntaje
-        guardar_rankings()
+        if not token or plazas_reservadas.get(nombre_usuario) != (token, sala_id):
+            return None, False
+        sala = salas.get(sala_id)
+    if not sala: return None, False
+    with sala.lock:
+        if not sala.activa or not sala.reservas or nombre_usuario not in sala.reservas:
+            return None, False
+        jugador = sala.agregar(nombre_usuario, conn)
+        jugador.puntaje = jugador.inicial = sala.reservas.pop(nombre_usuario)
+        with lock_salas:
+            plazas_reservadas.pop(nombre_usuario, None)
+            sala_de_jugador[nombre_usuario] = sala_id
+        estado = {"estado": sala.estado.value, "puntaje": jugador.puntaje, "masiva": sala.masiva,
+                  "ronda_actual": sala.siguiente + 1, "rondas_totales": sala.num_preguntas}
+        return estado, not sala.reservas
 
-        # Elimina la sala al finalizar el juego
-        del salas[sala_id]
+def reanudar_sala(sala_id):
+    """
+    Termina el plazo de gracia de una sala restaurada, porque volvieron todos o porque venció.
+    Los puntajes de quienes no volvieron se suman al ranking y la partida sigue donde estaba:
+    si estaba en juego se repite la pregunta interrumpida. Si no volvió nadie, se elimina.
+    """
+    sala = obtener_sala(sala_id)
+    if not sala: return
+    tabla = None
+    with sala.lock:
+        if not sala.activa or apagando or sala.reservas is None: return
+        ausentes = sala.reservas
+        sala.reservas = None
+        sala.modificada = True
+        with lock_salas:
+            for nombre in ausentes:
+                if plazas_reservadas.get(nombre, (None, None))[1] == sala_id:
+                    del plazas_reservadas[nombre]
+        estado = sala.estado
+        vacia = not sala.jugadores
+        llena = len(sala.jugadores) == sala.modo and not sala.masiva
+        # La instantánea pudo tomarse entre el cierre de la última ronda y el fin de la partida
+        continuar = enviar_pregunta if sala.siguiente < len(sala.preguntas) else terminar_partida
+        if vacia:
+            eliminar_sala(sala_id, sala)
+        elif estado is modelo.EstadoSala.JUGANDO and not sala.masiva:
+            tabla = tabla_jugadores(sala)
+    if ausentes:
+        sumar_al_ranking(ausentes)
+    if vacia:
+        print(f"Nadie volvió a la sala {sala_id}, eliminada.")
+        return
+    print(f"Sala {sala_id} reanudada ({len(ausentes)} jugadores no volvieron).")
+    if estado is modelo.EstadoSala.JUGANDO:
+        # Los clientes binarios reciben de nuevo la tabla de jugadores, que pudo cambiar
+        if tabla:
+            difundir(*tabla)
+        planificador.programar(0, continuar, sala_id)
+    elif llena:
+        lobby.retirar(sala_id)
+        iniciar_juego(sala_id)
+
+def despedir_clientes():
+    """
+    Al apagar: guarda la última instantánea de las salas, antes de que las desconexiones las
+    vacíen, y avisa a todos los clientes de que el servidor se reinicia y cuánto tiempo tienen
+    para volver a su partida. Las conexiones se cierran tras enviar lo pendiente; devuelve
+    las que se avisaron.
+    """
+    global apagando
+    # Antes de la instantánea: los plazos que venzan mientras se despide a los clientes ya no
+    # hacen avanzar las salas (se comprueba con el bloqueo de cada sala), así que una partida
+    # guardada no puede terminar ahora y sumarse al ranking otra vez tras el reinicio
+    apagando = True
+    if instantaneas_salas and planificador:
+        tomar_instantanea(final=True)
+    datos = protocolo.codificar({"status": "reiniciando", "gracia": GRACIA_REINICIO if instantaneas_salas else 0})
+    actuales = list(conexiones)
+    for conn in actuales:
+        conn.enviar_bytes(datos)
+        conn.cerrar()
+    print(f"Apagando: {len(actuales)} clientes avisados.")
+    return actuales
 
 def iniciar_servidor():
     """
@@ -271,14 +1290,326 @@ def iniciar_servidor():
     Carga los rankings existentes y escucha nuevas conexiones de clientes.
     """
     cargar_rankings()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen(5)
-        print(f"Servidor escuchando en {HOST}:{PORT}")
+    cargar_preguntas()
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Un reinicio puede volver a escuchar en el puerto aunque queden conexiones en TIME_WAIT
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((HOST, PORT))
+    s.listen(BACKLOG)
+    try:
+        servir_hilos(s)
+    finally:
+        guardar_rankings()
+
+def servir_hilos(s):
+    """
+    Bucle de aceptación del motor de hilos sobre un socket que ya escucha.
+    Al interrumpirlo (Ctrl+C o SIGTERM) se despide de los clientes antes de salir.
+    """
+    global planificador
+    planificador = planificacion.Planificador()
+    planificador.programar(INTERVALO_LATIDO, revisar_latidos)
+    iniciar_eventos()
+    iniciar_instantaneas()
+    try:
+        with s:
+            print(f"Servidor escuchando en {HOST}:{PORT}")
+            while True:
+                conn, addr = s.accept()
+                # Crea un hilo nuevo para manejar cada cliente de forma concurrente
+                threading.Thread(target=manejar_cliente, args=(conn, addr), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        limite = time.monotonic() + ESPERA_APAGADO
+        for conn in despedir_clientes():
+            conn.hilo.join(max(0, limite - time.monotonic()))
+        cerrar_eventos()
+
+# --- Motor asyncio ---
+# Todas las conexiones corren como corrutinas sobre un único bucle de eventos,
+# en lugar de un hilo del sistema operativo por cliente.
+
+class ConexionAsync:
+    """
+    Conexión de un cliente en el motor asyncio, con la misma interfaz que 'ConexionHilo'.
+    Una corrutina escritora por conexión vacía la cola acotada: lo encolado durante una vuelta
+    del bucle sale en una sola escritura, y mientras el socket no acepta más datos ('drain')
+    los mensajes esperan en la cola, donde se aplica la política para consumidores lentos.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.cola = salida.ColaSalida(LIMITE_COLA_SALIDA, POLITICA_LENTOS)
+        self.hay_datos = asyncio.Event()
+        self.cerrada = False
+        self.codificacion = protocolo.JSON
+        self.nombre = None
+        self.latido = False
+        self.ultima_actividad = time.monotonic()
+        self.rtt = None
+        self.token = None
+        # El búfer propio del transporte se mantiene pequeño para que la cola sea la que acumule
+        writer.transport.set_write_buffer_limits(high=64 * 1024)
+        self.tarea = asyncio.get_running_loop().create_task(self._escribir())
+
+    def enviar(self, mensaje, clave=None):
+        self.enviar_bytes(protocolo.codificar(mensaje), clave)
+
+    def enviar_bytes(self, datos, clave=None):
+        if self.cerrada: return
+        if not self.cola.agregar(datos, clave):
+            self.cortar("demasiado lento")
+            return
+        self.hay_datos.set()
+
+    def cortar(self, motivo):
+        """Corta la conexión sin enviar lo pendiente (cliente lento o sin señales de vida)."""
+        print(f"Cliente {motivo}, desconectando.")
+        self.cerrada = True
+        self.cola.tomar_todo()
+        self.writer.transport.abort()
+
+    def cerrar(self):
+        """Termina de enviar lo pendiente y cierra el socket."""
+        self.cerrada = True
+        self.hay_datos.set()
+
+    async def soltar(self):
+        """Equivalente asíncrono de 'ConexionHilo.soltar'."""
+        fd = os.dup(self.writer.get_extra_info('socket').fileno())
+        self.cerrar()
+        await self.tarea
+        return fd
+
+    async def _escribir(self):
+        try:
+            while True:
+                # Se comprueba antes de esperar: un cierre pedido junto con el último envío
+                # no vuelve a activar el evento
+                if not self.cola:
+                    if self.cerrada: break
+                    await self.hay_datos.wait()
+                    self.hay_datos.clear()
+                    continue
+                bloque = self.cola.tomar_todo()
+                self.writer.write(bloque)
+                metricas.sumar('bytes_salida', len(bloque))
+                await self.writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            self.cerrada = True
+        finally:
+            self.writer.close()
+
+async def manejar_cliente_async(reader, writer, traspaso=None):
+    """
+    Corrutina equivalente a 'manejar_cliente' para el motor asyncio.
+    """
+    addr = writer.get_extra_info('peername')
+    activar_keepalive(writer.get_extra_info('socket'))
+    conn = ConexionAsync(writer)
+    conexiones.add(conn)
+    decodificador = protocolo.Decodificador()
+    print(f"Conectado a {addr}")
+    user_data, peticiones = retomar_sesion(traspaso, conn, addr, decodificador)
+    pendiente = None
+    try:
+        while True:
+            user_data, pendiente = atender_lote(peticiones, conn, addr, user_data)
+            if pendiente:
+                break
+            data = await reader.read(4096)
+            if not data:
+                break
+            conn.ultima_actividad = time.monotonic()
+            metricas.sumar('bytes_entrada', len(data))
+            peticiones = decodificador.alimentar(data)
+
+    except (protocolo.ErrorProtocolo, ConnectionResetError, BrokenPipeError) as e:
+        print(f"Error o desconexión del cliente {addr}: {e}")
+    finally:
+        if user_data:
+            limpiar_sesion(user_data)
+        conexiones.discard(conn)
+        if pendiente:
+            # Lo que el transporte ya leyó del socket y no se ha decodificado viaja con el traspaso
+            writer.transport.pause_reading()
+            buffer = decodificador.buffer + bytes(reader._buffer)
+            traspasar(await conn.soltar(), user_data, pendiente, buffer)
+        else:
+            conn.cerrar()
+
+async def retomar_async(sock, traspaso):
+    """Pone en marcha en este bucle una conexión traspasada desde otro trabajador."""
+    reader, writer = await asyncio.open_connection(sock=sock)
+    await manejar_cliente_async(reader, writer, traspaso)
+
+async def servidor_async(escucha=None):
+    global planificador
+    loop = asyncio.get_running_loop()
+    # Los plazos de las salas usan los temporizadores del propio bucle de eventos
+    planificador = planificacion.PlanificadorAsync(loop)
+    planificador.programar(INTERVALO_LATIDO, revisar_latidos)
+    iniciar_eventos()
+    iniciar_instantaneas()
+    # SIGTERM cancela esta corrutina igual que Ctrl+C, con las escritoras de las conexiones aún vivas
+    # (no disponible en Windows ni fuera del hilo principal)
+    try:
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, RuntimeError, ValueError):
+        pass
+    if escucha:
+        server = await asyncio.start_server(manejar_cliente_async, sock=escucha)
+        escuchar_coordinador_async(loop)
+    else:
+        server = await asyncio.start_server(manejar_cliente_async, HOST, PORT, backlog=BACKLOG)
+    print(f"Servidor (asyncio) escuchando en {HOST}:{PORT}")
+    async with server:
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        tareas = [conn.tarea for conn in despedir_clientes()]
+        if tareas:
+            await asyncio.wait(tareas, timeout=ESPERA_APAGADO)
+        cerrar_eventos()
+
+def iniciar_servidor_async():
+    """
+    Inicia el servidor con el motor asyncio.
+    Acepta exactamente los mismos comandos JSON que el motor de hilos.
+    """
+    cargar_rankings()
+    cargar_preguntas()
+    try:
+        asyncio.run(servidor_async())
+    finally:
+        guardar_rankings()
+
+# --- Modo multiproceso ---
+
+def escuchar_coordinador_hilos():
+    """Hilo de un trabajador (motor de hilos) que atiende los mensajes del coordinador."""
+    def retomar(sock, traspaso):
+        try:
+            addr = sock.getpeername()
+        except OSError:
+            sock.close()
+            return
+        threading.Thread(target=manejar_cliente, args=(sock, addr, traspaso), daemon=True).start()
+    while True:
+        try:
+            mensaje, fd = canal_coordinador.recibir()
+        except ValueError as e:
+            print(f"Mensaje inválido del coordinador: {e}")
+            continue
+        if mensaje is None:
+            break
+        atender_coordinador(mensaje, fd, retomar)
+    print(f"Coordinador cerrado, terminando el trabajador {TRABAJADOR}.")
+    os._exit(0)
+
+def escuchar_coordinador_async(loop):
+    """Atiende los mensajes del coordinador desde el bucle de eventos de un trabajador asyncio."""
+    def retomar(sock, traspaso):
+        loop.create_task(retomar_async(sock, traspaso))
+    def leer():
         while True:
-            conn, addr = s.accept()
-            # Crea un hilo nuevo para manejar cada cliente de forma concurrente
-            threading.Thread(target=manejar_cliente, args=(conn, addr), daemon=True).start()
+            try:
+                mensaje, fd = canal_coordinador.recibir(bloquear=False)
+            except BlockingIOError:
+                return
+            except ValueError as e:
+                print(f"Mensaje inválido del coordinador: {e}")
+                continue
+            if mensaje is None:
+                print(f"Coordinador cerrado, terminando el trabajador {TRABAJADOR}.")
+                os._exit(0)
+            atender_coordinador(mensaje, fd, retomar)
+    loop.add_reader(canal_coordinador.fileno(), leer)
+
+def iniciar_trabajador(indice, num_trabajadores, canal, otros_canales, usar_asyncio):
+    """
+    Punto de entrada de cada proceso trabajador. Hereda del coordinador el ranking y el banco
+    de preguntas ya cargados; abre su propio socket de escucha sobre el puerto compartido.
+    """
+    global TRABAJADOR, NUM_TRABAJADORES, canal_coordinador
+    TRABAJADOR, NUM_TRABAJADORES, canal_coordinador = indice, num_trabajadores, canal
+    # Los extremos heredados que no son de este trabajador se cierran para detectar el cierre del coordinador
+    for otro in otros_canales:
+        otro.close()
+    escucha = coordinador.abrir_escucha(HOST, PORT, BACKLOG)
+    try:
+        if usar_asyncio:
+            asyncio.run(servidor_async(escucha))
+        else:
+            threading.Thread(target=escuchar_coordinador_hilos, daemon=True).start()
+            servir_hilos(escucha)
+    except KeyboardInterrupt:
+        pass
+
+def iniciar_multiproceso(num_trabajadores, usar_asyncio):
+    """
+    Arranca 'num_trabajadores' procesos que comparten el puerto y hace de coordinador:
+    acumula y persiste el ranking de todas las partidas y reenvía los traspasos de conexiones.
+    """
+    global ranking_global
+    ranking_global = clasificacion.Clasificacion(registro_ranking.cargar())
+    print("Rankings cargados.")
+    cargar_preguntas()
+    pares = coordinador.crear_canales(num_trabajadores)
+    contexto = multiprocessing.get_context('fork')
+    procesos = []
+    for indice, (_, canal) in enumerate(pares):
+        otros = [extremo for par in pares for extremo in par if extremo is not canal]
+        procesos.append(contexto.Process(target=iniciar_trabajador, args=(indice, num_trabajadores, canal, otros, usar_asyncio), daemon=True))
+    for proceso in procesos:
+        proceso.start()
+    for _, canal in pares:
+        canal.close()
+    # El hilo de persistencia se arranca después de crear los procesos (no debe heredarse)
+    registro_ranking.iniciar(instantanea_ranking)
+    print(f"Coordinador en marcha con {num_trabajadores} trabajadores en {HOST}:{PORT}")
+    try:
+        coordinador.Coordinador([extremo for extremo, _ in pares], acumular_ranking).servir()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Cada trabajador guarda su instantánea y avisa a sus clientes antes de salir
+        for proceso in procesos:
+            proceso.terminate()
+        for proceso in procesos:
+            proceso.join(ESPERA_APAGADO + 1)
+        guardar_rankings()
 
 if __name__ == "__main__":
-    iniciar_servidor()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Servidor de Trivia")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--puerto', type=int, default=PORT)
+    parser.add_argument('--asyncio', action='store_true', help="usa el motor asyncio (un solo bucle de eventos) en lugar de un hilo por cliente")
+    parser.add_argument('--politica-lentos', choices=salida.POLITICAS, default=POLITICA_LENTOS, help="qué hacer cuando la cola de salida de un cliente se llena")
+    parser.add_argument('--limite-cola', type=int, default=LIMITE_COLA_SALIDA, help="bytes pendientes por cliente antes de aplicar la política")
+    parser.add_argument('--preguntas', default=RUTA_PREGUNTAS, help="archivo JSONL con el banco de preguntas")
+    parser.add_argument('--trabajadores', type=int, default=0, help="procesos que comparten el puerto (0: un solo proceso)")
+    parser.add_argument('--latido', type=float, default=INTERVALO_LATIDO, help="segundos entre 'ping' a los clientes que los aceptan")
+    parser.add_argument('--inactividad', type=float, default=TIEMPO_INACTIVIDAD, help="segundos sin recibir nada antes de dar por muerto a un cliente con latido")
+    parser.add_argument('--instantanea', default=RUTA_INSTANTANEA, help="archivo de instantáneas de las salas para reanudar partidas tras un reinicio ('' las desactiva)")
+    parser.add_argument('--gracia', type=float, default=GRACIA_REINICIO, help="segundos que tienen los jugadores para volver a su partida tras un reinicio")
+    parser.add_argument('--eventos', default=RUTA_EVENTOS, help="archivo del registro de eventos de las partidas ('' lo desactiva)")
+    parser.add_argument('--stats-remoto', action='store_true', help="permite el comando 'stats' desde otras máquinas")
+    args = parser.parse_args()
+    HOST, PORT = args.host, args.puerto
+    RUTA_PREGUNTAS = args.preguntas
+    POLITICA_LENTOS = args.politica_lentos
+    LIMITE_COLA_SALIDA = args.limite_cola
+    STATS_SOLO_LOCAL = not args.stats_remoto
+    INTERVALO_LATIDO, TIEMPO_INACTIVIDAD = args.latido, args.inactividad
+    RUTA_INSTANTANEA, GRACIA_REINICIO = args.instantanea, args.gracia
+    RUTA_EVENTOS = args.eventos
+    # SIGTERM (reinicio ordenado) se trata como Ctrl+C: se guarda y se avisa a los clientes
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if args.trabajadores > 0:
+        iniciar_multiproceso(args.trabajadores, args.asyncio)
+    elif args.asyncio:
+        iniciar_servidor_async()
+    else:
+        iniciar_servidor()
\ No newline at end of file
@@ -1,9 +1,10 @@
 import socket
-import json
 import time
 import os
 import threading
 import sys
+import queue
+import protocolo
 
 # Constantes de conexión para el cliente.
 HOST = '127.0.0.1'
@@ -14,6 +15,116 @@ PORT = 65432
 # Si está inactivo (clear), se detienen.
 juego_en_curso = threading.Event()
 
+# Decodificador incremental de los mensajes del servidor. Un 'recv' puede traer varios
+# mensajes o solo una parte de uno. Un hilo lector decodifica todo lo que llega, contesta en el
+# acto los 'ping' del servidor (aunque el jugador esté en un menú) y deja el resto en 'mensajes'.
+decodificador = protocolo.Decodificador()
+mensajes = queue.Queue()
+lock_envio = threading.Lock()  # El hilo lector y el principal escriben en el mismo socket
+
+# Reconexión tras un reinicio del servidor: con el token que dio el servidor al registrarse,
+# el jugador puede volver a su partida si se reconecta dentro del plazo de gracia (el que anuncia
+# el servidor al apagarse, o GRACIA_RECONEXION si la conexión se cortó sin aviso).
+GRACIA_RECONEXION = 30
+nombre_sesion = None
+token_sesion = None
+
+def conectar():
+    """
+    Abre una conexión con el servidor y arranca su hilo lector, con el decodificador
+    y la cola de mensajes vacíos.
+    """
+    global decodificador, mensajes
+    s = socket.create_connection((HOST, PORT))
+    decodificador = protocolo.Decodificador()
+    mensajes = queue.Queue()
+    threading.Thread(target=leer_servidor, args=(s,), daemon=True).start()
+    return s
+
+def enviar_peticiones(s, *peticiones):
+    """
+    Envía una o varias peticiones al servidor en una sola escritura (pipelining).
+    """
+    datos = protocolo.codificar_varios(peticiones)
+    with lock_envio:
+        s.sendall(datos)
+
+def leer_servidor(s):
+    """
+    Hilo lector: contesta los latidos del servidor y encola los demás mensajes.
+    Al cerrarse la conexión encola None.
+    """
+    try:
+        while True:
+            data = s.recv(4096)
+            if not data:
+                break
+            for mensaje in decodificador.alimentar(data):
+                if mensaje.get('status') == 'ping':
+                    enviar_peticiones(s, {"comando": "pong", "t": mensaje['t']})
+                else:
+                    mensajes.put(mensaje)
+    except (OSError, protocolo.ErrorProtocolo):
+        pass
+    mensajes.put(None)
+
+def recibir_mensaje(s):
+    """
+    Devuelve el siguiente mensaje completo del servidor, o None si se cerró la conexión.
+    """
+    mensaje = mensajes.get()
+    if mensaje is None:
+        mensajes.put(None)  # Quien pregunte después también debe enterarse del cierre
+    return mensaje
+
+def pedir(s, peticion):
+    """
+    Envía una petición y espera su respuesta. Lanza ConnectionResetError si el servidor se desconecta.
+    """
+    enviar_peticiones(s, peticion)
+    respuesta = recibir_mensaje(s)
+    if respuesta is None:
+        raise ConnectionResetError("El servidor cerró la conexión.")
+    return respuesta
+
+def registrar(s, nombre_usuario):
+    """
+    Registra al usuario y guarda su token de sesión. Ofrece la codificación binaria (el
+    decodificador entiende los dos formatos) y anuncia que contesta los 'ping' del servidor.
+    """
+    global nombre_sesion, token_sesion
+    peticion = {"comando": "registrar_usuario", "nombre_usuario": nombre_usuario, "codificaciones": [protocolo.BINARIA], "latido": True}
+    respuesta = pedir(s, peticion)
+    if respuesta['status'] == "ok":
+        nombre_sesion, token_sesion = nombre_usuario, respuesta.get('token')
+    return respuesta
+
+def reconectar(sala_id, gracia):
+    """
+    Tras perder la conexión en plena partida, vuelve a conectarse durante 'gracia' segundos y
+    pide volver a la sala con el token de la sesión anterior.
+    Devuelve (socket nuevo o None, si se reanudó la partida).
+    """
+    token_anterior = token_sesion
+    limite = time.monotonic() + gracia
+    print("\nConexión perdida; intentando volver a la partida...")
+    while time.monotonic() < limite:
+        try:
+            s = conectar()
+        except OSError:
+            time.sleep(1)
+            continue
+        try:
+            if registrar(s, nombre_sesion)['status'] == "ok":
+                respuesta = pedir(s, {"comando": "reanudar_partida", "sala_id": sala_id, "token": token_anterior})
+                print(f"\n{respuesta['mensaje']}")
+                return s, respuesta['status'] == "ok"
+        except (OSError, protocolo.ErrorProtocolo):
+            pass
+        s.close()
+        time.sleep(1)
+    return None, False
+
 def clear_screen():
     """
     Función de utilidad para limpiar la pantalla de la consola.
@@ -21,7 +132,7 @@ def clear_screen():
     """
     os.system('cls' if os.name == 'nt' else 'clear')
 
-def manejar_input(s, sala_id):
+def manejar_input(actual, sala_id, espectador=False):
     """
     Hilo dedicado a leer la entrada del usuario para las respuestas del juego.
     
@@ -29,100 +140,223 @@ def manejar_input(s, sala_id):
     leer del teclado y, al mismo tiempo, recibir mensajes del servidor
     sin bloquearse. Utiliza `sys.stdin.readline()` porque permite
     una gestión más limpia de la entrada en un hilo que `input()`.
+    'actual[0]' es el socket en uso, que cambia si hay que reconectar durante la partida.
     """
     while juego_en_curso.is_set():
         try:
             # Lee una línea de la entrada estándar y elimina espacios en blanco.
             respuesta_usuario = sys.stdin.readline().strip()
+            s = actual[0]
+            # Un espectador solo puede dejar de mirar; el bucle de juego sigue leyendo hasta la confirmación del servidor
+            if espectador:
+                if juego_en_curso.is_set() and respuesta_usuario == '/salir':
+                    juego_en_curso.clear()
+                    enviar_peticiones(s, {"comando": "dejar_de_observar"})
+                continue
+            # El anfitrión de una sala masiva la empieza sin esperar a la cuenta atrás
+            if juego_en_curso.is_set() and respuesta_usuario == '/iniciar':
+                enviar_peticiones(s, {"comando": "iniciar_partida", "sala_id": sala_id})
             # Si el juego sigue activo y se ha ingresado una respuesta, la envía.
-            if juego_en_curso.is_set() and respuesta_usuario:
+            elif juego_en_curso.is_set() and respuesta_usuario:
                 peticion = {
                     "comando": "enviar_respuesta",
                     "sala_id": sala_id,
                     "respuesta": respuesta_usuario,
                     "timestamp": time.time()  # Envía el momento exacto para calcular la puntuación por velocidad
                 }
-                s.sendall(json.dumps(peticion).encode('utf-8'))
-        except (IOError, ValueError):
-            # Si se produce un error de E/S, el juego ha terminado.
+                enviar_peticiones(s, peticion)
+        except OSError:
+            # Sin conexión (el servidor se reinicia): la respuesta se pierde, pero la partida puede reanudarse
+            continue
+        except ValueError:
+            # La entrada estándar se cerró: el juego ha terminado.
             break
     
-def jugar_sala(s, sala_id):
+def jugar_sala(s, sala_id, espectador=False):
     """
     Gestiona el ciclo de vida de una partida de juego.
     
     Esta función se encarga de recibir los mensajes del servidor, como
     nuevas preguntas, resultados de respuestas y el fin del juego.
+    Un espectador recibe los mismos mensajes pero no responde; al dejar de mirar se descarta
+    todo lo que llegue hasta la confirmación del servidor, para que no la lea el menú.
+    Si el servidor se reinicia, el jugador se reconecta y sigue en la partida.
+    Devuelve el socket con el que seguir, que es otro si hubo que reconectar.
     """
     # Activa la bandera global para indicar que el juego está en curso.
     juego_en_curso.set()
+    actual = [s]
+    gracia = GRACIA_RECONEXION
     
     # Inicia el hilo secundario para manejar la entrada del usuario.
-    input_thread = threading.Thread(target=manejar_input, args=(s, sala_id), daemon=True)
+    input_thread = threading.Thread(target=manejar_input, args=(actual, sala_id, espectador), daemon=True)
     input_thread.start()
 
-    while juego_en_curso.is_set():
+    while juego_en_curso.is_set() or espectador:
         try:
-            # Recibe datos del servidor.
-            data = s.recv(2048).decode('utf-8')
-            if not data:
-                print("\nConexión perdida con el servidor.")
-                break
+            # Recibe el siguiente mensaje completo del servidor.
+            mensaje = recibir_mensaje(s)
+            if mensaje is None:
+                if espectador or not token_sesion or not gracia:
+                    print("\nConexión perdida con el servidor.")
+                    break
+                s.close()
+                nuevo, reanudada = reconectar(sala_id, gracia)
+                if nuevo is None:
+                    print("\nNo se pudo volver a conectar con el servidor.")
+                    break
+                actual[0] = s = nuevo
+                if not reanudada:
+                    input("Presiona Enter para volver al menú principal...")
+                    break
+                continue
+
+            status = mensaje.get('status')
+
+            if espectador and not juego_en_curso.is_set():
+                # Se pidió dejar de mirar: los eventos que ya venían de la sala se descartan
+                if status == "ok":
+                    print(f"\n{mensaje['mensaje']}")
+                    return s
+                continue
 
-            # El servidor puede enviar varios mensajes en un solo paquete,
-            # por lo que se dividen y procesan individualmente.
-            mensajes = data.strip().split('\n')
-            for msg_str in mensajes:
-                if not msg_str: continue
-                mensaje = json.loads(msg_str)
-                status = mensaje.get('status')
-
-                if status == "pregunta":
-                    # Muestra una nueva pregunta del servidor.
-                    clear_screen()
-                    pregunta_info = mensaje['pregunta']
-                    print(f"--- Ronda {mensaje['ronda_actual']}/{mensaje['rondas_totales']} ---")
-                    print(f"\nPregunta: {pregunta_info['pregunta']}")
-                    print("\n".join([f"{i+1}. {op}" for i, op in enumerate(pregunta_info['opciones'])]))
+            if status == "reiniciando":
+                # El servidor se apaga para reiniciarse; la conexión se cerrará enseguida
+                print("\n\nEl servidor se está reiniciando...")
+                gracia = mensaje.get('gracia', 0)
+
+            elif status == "pregunta":
+                # Muestra una nueva pregunta del servidor.
+                clear_screen()
+                pregunta_info = mensaje['pregunta']
+                print(f"--- Ronda {mensaje['ronda_actual']}/{mensaje['rondas_totales']} ---")
+                print(f"\nPregunta: {pregunta_info['pregunta']}")
+                print("\n".join([f"{i+1}. {op}" for i, op in enumerate(pregunta_info['opciones'])]))
+                if espectador:
+                    print("\n(Observando; escribe /salir para volver al menú)")
+                else:
                     print("\nTu respuesta (número): ", end='', flush=True)
 
-                elif status == "respuesta_correcta":
-                    # Muestra la confirmación de una respuesta correcta y el marcador.
-                    print(f"\n\n¡Correcto! {mensaje['jugador']} gana {mensaje['puntos']} puntos.")
+            elif status == "respuesta_correcta":
+                # Muestra la confirmación de una respuesta correcta y el marcador.
+                print(f"\n\n¡Correcto! {mensaje['jugador']} gana {mensaje['puntos']} puntos.")
+                if 'marcador' in mensaje:
                     print(f"Marcador: {mensaje['marcador']}")
                     time.sleep(2) # Pausa para que el usuario pueda leer el mensaje
+                else:
+                    # Sala masiva: solo llega la confirmación propia; el top llega aparte
+                    print(f"Llevas {mensaje['total']} puntos.")
 
-                elif status == "tiempo_agotado":
-                    # Mensaje de tiempo agotado para la pregunta actual.
-                    print("\n\n¡Se acabó el tiempo para esta pregunta!")
-                    time.sleep(2)
-
-                elif status == "fin_juego":
-                    # Muestra el marcador final y el ganador al terminar la partida.
-                    clear_screen()
-                    print("\n--- ¡Fin del juego! ---")
-                    print("Marcador final:", mensaje['marcador_final'])
-                    print(f"El ganador es {mensaje['ganador']} con {mensaje['ganador_puntos']} puntos.")
-                    input("\nPresiona Enter para volver al menú principal...")
-                    juego_en_curso.clear() # Desactiva la bandera, deteniendo el hilo de entrada y el bucle.
-                    return # Sale de la función para volver al menú.
-
-                elif status == "error":
-                    # Muestra un mensaje de error del servidor.
-                    print(f"\nError del servidor: {mensaje['mensaje']}")
-                    input("Presiona Enter para continuar...")
-                    juego_en_curso.clear()
-                    return
+            elif status == "marcador":
+                # Top de una sala masiva, que el servidor envía como mucho una vez por segundo
+                print(f"\nTop de {mensaje['jugadores']} jugadores: " + ", ".join(f"{j} {p}" for j, p in mensaje['top']))
 
-        except (socket.error, json.JSONDecodeError, ConnectionAbortedError) as e:
+            elif status == "resultado_ronda":
+                # Cuántos jugadores eligieron cada opción en una sala masiva
+                print(f"\nRespuesta correcta: {mensaje['respuesta']}. Respuestas por opción: "
+                      + ", ".join(f"{i+1}: {n}" for i, n in enumerate(mensaje['conteo'])))
+
+            elif status == "ok":
+                print(f"\n{mensaje['mensaje']}")
+
+            elif status == "tiempo_agotado":
+                # Mensaje de tiempo agotado para la pregunta actual.
+                print("\n\n¡Se acabó el tiempo para esta pregunta!")
+                time.sleep(2)
+
+            elif status == "fin_juego":
+                # Muestra el marcador final y el ganador al terminar la partida.
+                clear_screen()
+                print("\n--- ¡Fin del juego! ---")
+                print("Marcador final:", mensaje['marcador_final'])
+                print(f"El ganador es {mensaje['ganador']} con {mensaje['ganador_puntos']} puntos.")
+                input("\nPresiona Enter para volver al menú principal...")
+                juego_en_curso.clear() # Desactiva la bandera, deteniendo el hilo de entrada y el bucle.
+                return s # Sale de la función para volver al menú.
+
+            elif status == "sala_cerrada":
+                # La sala se eliminó sin terminar la partida (se quedó sin jugadores)
+                print(f"\n\n{mensaje['mensaje']}")
+                input("Presiona Enter para volver al menú principal...")
+                juego_en_curso.clear()
+                return s
+
+            elif status == "error":
+                # Muestra un mensaje de error del servidor.
+                print(f"\nError del servidor: {mensaje['mensaje']}")
+                input("Presiona Enter para continuar...")
+                juego_en_curso.clear()
+                return s
+
+        except (socket.error, protocolo.ErrorProtocolo, ConnectionAbortedError) as e:
             print(f"\nError de conexión durante el juego: {e}")
             juego_en_curso.clear()
             break
+    juego_en_curso.clear()
+    return s
+
+def ver_rankings(s):
+    """
+    Muestra el ranking global por páginas junto con la posición del propio jugador.
+    El servidor solo envía la página pedida, así que el ranking puede ser todo lo grande que haga falta.
+    """
+    pagina = 1
+    while True:
+        respuesta = pedir(s, {"comando": "ver_rankings", "pagina": pagina})
+        clear_screen()
+        print(f"\n--- Rankings Globales (página {pagina}) ---")
+        inicio = (pagina - 1) * respuesta.get('por_pagina', 0)
+        if respuesta.get('rankings'):
+            for i, (jugador, puntaje) in enumerate(respuesta['rankings']):
+                print(f"{inicio+i+1}. {jugador}: {puntaje} puntos")
+        else:
+            print("No hay rankings disponibles.")
+        if respuesta.get('posicion'):
+            print(f"\nTu posición: {respuesta['posicion']} de {respuesta['total']} ({respuesta['puntaje']} puntos)")
+
+        hay_siguiente = inicio + len(respuesta.get('rankings', [])) < respuesta.get('total', 0)
+        opciones = []
+        if hay_siguiente: opciones.append("'s' siguiente")
+        if pagina > 1: opciones.append("'a' anterior")
+        eleccion = input(f"\n{', '.join(opciones + ['Enter para continuar'])}: ").strip().lower()
+        if eleccion == 's' and hay_siguiente:
+            pagina += 1
+        elif eleccion == 'a' and pagina > 1:
+            pagina -= 1
+        else:
+            return
+
+def pedir_configuracion(categorias, permitir_masiva=False):
+    """
+    Pregunta el modo, el número de preguntas y, si hay varias, la categoría de la partida.
+    Devuelve la petición con esos campos (sin 'comando') o None si los valores no son válidos.
+    Con 'permitir_masiva' también se puede elegir una sala masiva ('M') con cuenta atrás.
+    """
+    modos = ['1', '2', 'M'] if permitir_masiva else ['1', '2']
+    modo = input("Elige el modo (1 o 2 jugadores" + (", M para sala masiva" if permitir_masiva else "") + "): ").strip().upper()
+    if modo == 'M':
+        cuenta_atras = input("¿Segundos hasta empezar (escribe /iniciar para empezar antes)? ").strip()
+        if not cuenta_atras.isdigit():
+            return None
+    num_preguntas = input("¿Cuántas preguntas (5, 10, 20)? ")
+    categoria = ''
+    if len(categorias) > 1:
+        categoria = input(f"Categoría ({', '.join(categorias)}; Enter para todas): ").strip()
+    if modo not in modos or num_preguntas not in ['5', '10', '20']:
+        return None
+    if modo == 'M':
+        peticion = {"masiva": True, "cuenta_atras": int(cuenta_atras), "num_preguntas": num_preguntas}
+    else:
+        peticion = {"modo": modo, "num_preguntas": num_preguntas}
+    if categoria:
+        peticion['categoria'] = categoria
+    return peticion
 
-def menu_principal(s, nombre_usuario):
+def menu_principal(s, nombre_usuario, categorias=()):
     """
     Presenta el menú principal al usuario y maneja las opciones seleccionadas.
-    Permite crear una sala, unirse a una, ver rankings o salir del juego.
+    Permite crear una sala, unirse a una, buscar partida, ver rankings, observar una sala o salir del juego.
+    'categorias' son las categorías de preguntas que anunció el servidor al registrarse.
     """
     while True:
         # No muestra el menú si el juego está activo, solo espera su fin.
@@ -134,21 +368,24 @@ def menu_principal(s, nombre_usuario):
         print(f"--- Trivia Asimétrica - Jugador: {nombre_usuario} ---")
         print("1. Crear Sala")
         print("2. Unirse a Sala")
-        print("3. Ver Rankings")
-        print("4. Salir")
+        print("3. Buscar Partida")
+        print("4. Ver Rankings")
+        print("5. Observar Sala")
+        print("6. Salir")
         opcion = input("Elige una opción: ")
 
         try:
-            if opcion == '1':
-                modo = input("Elige el modo (1 o 2 jugadores): ")
-                num_preguntas = input("¿Cuántas preguntas (5, 10, 20)? ")
-                if modo in ['1', '2'] and num_preguntas in ['5', '10', '20']:
-                    peticion = {"comando": "crear_sala", "modo": modo, "num_preguntas": num_preguntas}
-                    s.sendall(json.dumps(peticion).encode('utf-8'))
-                    respuesta = json.loads(s.recv(1024).decode('utf-8'))
+            if opcion in ('1', '3'):
+                # Crear una sala propia o dejar que el servidor empareje con otra que esté esperando
+                peticion = pedir_configuracion(categorias, permitir_masiva=opcion == '1')
+                if peticion:
+                    peticion['comando'] = "crear_sala" if opcion == '1' else "buscar_partida"
+                    respuesta = pedir(s, peticion)
                     print(respuesta['mensaje'])
                     if respuesta['status'] == 'ok':
-                        jugar_sala(s, respuesta['sala_id'])
+                        s = jugar_sala(s, respuesta['sala_id'])
+                    else:
+                        input("Presiona Enter para continuar...")
                 else:
                     print("Valores no válidos.")
                     input("Presiona Enter...")
@@ -156,53 +393,50 @@ def menu_principal(s, nombre_usuario):
             elif opcion == '2':
                 sala_id = input("Ingresa el ID de la sala: ")
                 peticion = {"comando": "unirse_sala", "sala_id": sala_id}
-                s.sendall(json.dumps(peticion).encode('utf-8'))
-                respuesta = json.loads(s.recv(1024).decode('utf-8'))
+                respuesta = pedir(s, peticion)
                 print(respuesta['mensaje'])
                 if respuesta['status'] == 'ok':
-                    jugar_sala(s, respuesta['sala_id'])
+                    s = jugar_sala(s, respuesta['sala_id'])
                 else:
                     input("Presiona Enter para continuar...")
 
-            elif opcion == '3':
-                peticion = {"comando": "ver_rankings"}
-                s.sendall(json.dumps(peticion).encode('utf-8'))
-                respuesta = json.loads(s.recv(1024).decode('utf-8'))
-                clear_screen()
-                print("\n--- Rankings Globales ---")
-                if respuesta.get('rankings'):
-                    for i, (jugador, puntaje) in enumerate(respuesta['rankings']):
-                        print(f"{i+1}. {jugador}: {puntaje} puntos")
+            elif opcion == '4':
+                ver_rankings(s)
+
+            elif opcion == '5':
+                sala_id = input("Ingresa el ID de la sala que quieres observar: ")
+                respuesta = pedir(s, {"comando": "observar_sala", "sala_id": sala_id})
+                print(respuesta['mensaje'])
+                if respuesta['status'] == 'ok':
+                    print(f"Jugadores: {', '.join(respuesta['jugadores'])} ({respuesta['espectadores']} espectadores)")
+                    s = jugar_sala(s, respuesta['sala_id'], espectador=True)
                 else:
-                    print("No hay rankings disponibles.")
-                input("\nPresiona Enter para continuar...")
+                    input("Presiona Enter para continuar...")
 
-            elif opcion == '4':
+            elif opcion == '6':
                 print("Saliendo...")
                 break
-        except (socket.error, json.JSONDecodeError):
+        except (socket.error, protocolo.ErrorProtocolo):
             print("Error de comunicación con el servidor. Volviendo al menú.")
             return
 
 if __name__ == "__main__":
     """Punto de entrada principal del script."""
-    # Crea un socket y se conecta al servidor.
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        try:
-            s.connect((HOST, PORT))
-            # Pide el nombre de usuario y lo registra en el servidor.
-            nombre_usuario = input("Ingresa tu nombre de usuario: ")
-            peticion = {"comando": "registrar_usuario", "nombre_usuario": nombre_usuario}
-            s.sendall(json.dumps(peticion).encode('utf-8'))
-            respuesta = json.loads(s.recv(1024).decode('utf-8'))
-            print(respuesta['mensaje'])
-            if respuesta['status'] == "ok":
-                # Si el registro es exitoso, muestra el menú principal.
-                menu_principal(s, nombre_usuario)
-        except (ConnectionRefusedError, ConnectionResetError):
-            print("No se pudo conectar al servidor. Asegúrate de que está en ejecución.")
-        except KeyboardInterrupt:
-            print("\nCerrando cliente.")
-        finally:
-            # Cierra el socket al terminar, asegurando la limpieza de recursos.
+    s = None
+    try:
+        # Se conecta al servidor, pide el nombre de usuario y lo registra.
+        s = conectar()
+        nombre_usuario = input("Ingresa tu nombre de usuario: ")
+        respuesta = registrar(s, nombre_usuario)
+        print(respuesta['mensaje'])
+        if respuesta['status'] == "ok":
+            # Si el registro es exitoso, muestra el menú principal.
+            menu_principal(s, nombre_usuario, respuesta.get('categorias', []))
+    except (ConnectionRefusedError, ConnectionResetError):
+        print("No se pudo conectar al servidor. Asegúrate de que está en ejecución.")
+    except KeyboardInterrupt:
+        print("\nCerrando cliente.")
+    finally:
+        # Cierra el socket al terminar, asegurando la limpieza de recursos.
+        if s:
             s.close()
\ No newline at end of file
@@ -0,0 +1,130 @@
+import functools
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+
+# Banco de preguntas en disco.
+# Las preguntas viven en un archivo JSONL (una pregunta por línea, con 'categoria' y 'dificultad').
+# Junto a él se construye un índice binario ('.idx') con un registro de tamaño fijo por pregunta
+# (desplazamiento y longitud de su línea), ordenado por categoría y dificultad, de modo que cada
+# combinación ocupa un tramo contiguo de registros. Ambos archivos se abren con mmap: el servidor
+# no carga el banco en memoria, solo lee las líneas de las preguntas que salen en una partida.
+# Cada pregunta leída se guarda en una caché LRU junto con sus bytes JSON, que todas las salas
+# comparten al enviarla.
+
+REGISTRO = struct.Struct('<QIHH')  # desplazamiento, longitud, categoría, dificultad
+CABECERA = struct.Struct('<I')     # longitud de la cabecera JSON del índice
+TAMANO_CACHE = 4096                # Preguntas decodificadas que se mantienen en memoria
+
+def construir_indice(ruta_datos, ruta_indice):
+    """
+    Recorre el archivo de preguntas y escribe su índice ordenado por (categoría, dificultad).
+    """
+    entradas = []
+    with open(ruta_datos, 'rb') as f:
+        desplazamiento = 0
+        for linea in f:
+            contenido = linea.strip()
+            if contenido:
+                pregunta = json.loads(contenido)
+                entradas.append((pregunta.get('categoria', 'general'), pregunta.get('dificultad', 'media'),
+                                 desplazamiento, len(contenido)))
+            desplazamiento += len(linea)
+    entradas.sort()
+
+    categorias = sorted({e[0] for e in entradas})
+    dificultades = sorted({e[1] for e in entradas})
+    id_categoria = {c: i for i, c in enumerate(categorias)}
+    id_dificultad = {d: i for i, d in enumerate(dificultades)}
+
+    # Tramo [inicio, fin) de registros de cada categoría y de cada (categoría, dificultad)
+    tramos = {}
+    for i, (categoria, dificultad, _, _) in enumerate(entradas):
+        for clave in (categoria, f"{categoria}/{dificultad}"):
+            tramos.setdefault(clave, [i, i])[1] = i + 1
+
+    estado = os.stat(ruta_datos)
+    cabecera = json.dumps({
+        'tamano_datos': estado.st_size, 'mtime_datos': estado.st_mtime,
+        'total': len(entradas), 'categorias': categorias, 'dificultades': dificultades, 'tramos': tramos
+    }).encode('utf-8')
+    temporal = ruta_indice + '.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(CABECERA.pack(len(cabecera)))
+        f.write(cabecera)
+        for categoria, dificultad, desplazamiento, longitud in entradas:
+            f.write(REGISTRO.pack(desplazamiento, longitud, id_categoria[categoria], id_dificultad[dificultad]))
+    os.replace(temporal, ruta_indice)
+    print(f"Índice de preguntas construido: {len(entradas)} preguntas en {len(categorias)} categorías.")
+
+class BancoPreguntas:
+    def __init__(self, ruta_datos, ruta_indice=None):
+        self.ruta_datos = ruta_datos
+        self.ruta_indice = ruta_indice or os.path.splitext(ruta_datos)[0] + '.idx'
+        if not self._indice_vigente():
+            construir_indice(self.ruta_datos, self.ruta_indice)
+
+        with open(self.ruta_datos, 'rb') as f:
+            self.datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.ruta_indice, 'rb') as f:
+            self.indice = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        longitud, = CABECERA.unpack_from(self.indice, 0)
+        self.cabecera = json.loads(self.indice[CABECERA.size:CABECERA.size + longitud])
+        self.base_registros = CABECERA.size + longitud
+        self.total = self.cabecera['total']
+        # Identifica esta versión del archivo: si cambia, los números de registro ya no son las mismas preguntas
+        self.huella = [self.cabecera['tamano_datos'], self.cabecera['mtime_datos']]
+        self._cargar = functools.lru_cache(maxsize=TAMANO_CACHE)(self._leer)
+
+    def _indice_vigente(self):
+        if not os.path.exists(self.ruta_indice):
+            return False
+        estado = os.stat(self.ruta_datos)
+        with open(self.ruta_indice, 'rb') as f:
+            longitud, = CABECERA.unpack(f.read(CABECERA.size))
+            cabecera = json.loads(f.read(longitud))
+        return cabecera['tamano_datos'] == estado.st_size and cabecera['mtime_datos'] == estado.st_mtime
+
+    def categorias(self):
+        return list(self.cabecera['categorias'])
+
+    def _tramo(self, categoria=None, dificultad=None):
+        if categoria is None:
+            if dificultad is not None:
+                raise ValueError("Para filtrar por dificultad hay que indicar la categoría.")
+            return 0, self.total
+        clave = categoria if dificultad is None else f"{categoria}/{dificultad}"
+        return tuple(self.cabecera['tramos'].get(clave, (0, 0)))
+
+    def disponibles(self, categoria=None, dificultad=None):
+        inicio, fin = self._tramo(categoria, dificultad)
+        return fin - inicio
+
+    def muestra(self, k, categoria=None, dificultad=None):
+        """
+        Elige 'k' preguntas distintas al azar y devuelve sus números de registro.
+        'random.sample' sobre un 'range' no crea la lista de candidatas.
+        """
+        inicio, fin = self._tramo(categoria, dificultad)
+        return random.sample(range(inicio, fin), k)
+
+    def _leer(self, numero):
+        desplazamiento, longitud, _, _ = REGISTRO.unpack_from(self.indice, self.base_registros + numero * REGISTRO.size)
+        contenido = self.datos[desplazamiento:desplazamiento + longitud]
+        return json.loads(contenido), contenido
+
+    def pregunta(self, numero):
+        """Diccionario de la pregunta (para comprobar respuestas)."""
+        return self._cargar(numero)[0]
+
+    def payload(self, numero):
+        """Bytes JSON de la pregunta, listos para incrustar en el mensaje que se envía."""
+        return self._cargar(numero)[1]
+
+if __name__ == "__main__":
+    # Permite reconstruir el índice a mano: python banco_preguntas.py preguntas.jsonl
+    ruta = sys.argv[1] if len(sys.argv) > 1 else 'preguntas.jsonl'
+    construir_indice(ruta, os.path.splitext(ruta)[0] + '.idx')
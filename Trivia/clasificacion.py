@@ -0,0 +1,99 @@
+from bisect import bisect_left, insort
+
+# Tabla de clasificación ordenada.
+# Las entradas (-puntaje, jugador) se guardan en una lista de bloques ordenados de tamaño acotado,
+# la misma idea que usan las listas ordenadas de 'sortedcontainers': insertar o borrar solo toca
+# un bloque pequeño y las búsquedas son binarias, primero sobre los máximos de cada bloque y luego
+# dentro del bloque. Así se mantiene el orden al actualizar puntajes sin volver a ordenar todo.
+
+TAMANO_BLOQUE = 512
+
+class Clasificacion:
+    def __init__(self, puntajes=None):
+        self.puntajes = dict(puntajes or {})
+        entradas = sorted((-puntaje, jugador) for jugador, puntaje in self.puntajes.items())
+        self.bloques = [entradas[i:i + TAMANO_BLOQUE] for i in range(0, len(entradas), TAMANO_BLOQUE)]
+        self.maximos = [bloque[-1] for bloque in self.bloques]
+        self.acumulados = None  # Posición inicial de cada bloque; se recalcula solo cuando hace falta
+        self.version = 0        # Cambia con cada actualización; sirve para invalidar cachés
+
+    def __len__(self):
+        return len(self.puntajes)
+
+    def sumar(self, jugador, delta):
+        """Suma 'delta' al puntaje del jugador (lo crea si no existía) y lo recoloca."""
+        anterior = self.puntajes.get(jugador)
+        if anterior is not None:
+            if delta == 0: return
+            self._quitar((-anterior, jugador))
+        nuevo = (anterior or 0) + delta
+        self.puntajes[jugador] = nuevo
+        self._insertar((-nuevo, jugador))
+        self.version += 1
+
+    def puntaje(self, jugador):
+        return self.puntajes.get(jugador)
+
+    def posicion(self, jugador):
+        """Posición del jugador empezando en 1, o None si no está en la clasificación."""
+        puntaje = self.puntajes.get(jugador)
+        if puntaje is None: return None
+        entrada = (-puntaje, jugador)
+        i = bisect_left(self.maximos, entrada)
+        return self._inicio_bloque(i) + bisect_left(self.bloques[i], entrada) + 1
+
+    def rango(self, inicio, cantidad):
+        """Devuelve hasta 'cantidad' pares (jugador, puntaje) a partir de la posición 'inicio' (desde 0)."""
+        if inicio >= len(self.puntajes) or cantidad <= 0: return []
+        i = self._bloque_de_posicion(inicio)
+        j = inicio - self._inicio_bloque(i)
+        resultado = []
+        while i < len(self.bloques) and len(resultado) < cantidad:
+            for puntaje, jugador in self.bloques[i][j:j + cantidad - len(resultado)]:
+                resultado.append((jugador, -puntaje))
+            i, j = i + 1, 0
+        return resultado
+
+    def top(self, k):
+        return self.rango(0, k)
+
+    def _insertar(self, entrada):
+        if not self.bloques:
+            self.bloques.append([entrada])
+            self.maximos.append(entrada)
+        else:
+            i = min(bisect_left(self.maximos, entrada), len(self.bloques) - 1)
+            bloque = self.bloques[i]
+            insort(bloque, entrada)
+            self.maximos[i] = bloque[-1]
+            if len(bloque) > 2 * TAMANO_BLOQUE:
+                # Parte el bloque en dos para que las inserciones sigan siendo baratas
+                self.bloques[i:i + 1] = [bloque[:TAMANO_BLOQUE], bloque[TAMANO_BLOQUE:]]
+                self.maximos[i:i + 1] = [bloque[TAMANO_BLOQUE - 1], bloque[-1]]
+        self.acumulados = None
+
+    def _quitar(self, entrada):
+        i = bisect_left(self.maximos, entrada)
+        bloque = self.bloques[i]
+        del bloque[bisect_left(bloque, entrada)]
+        if bloque:
+            self.maximos[i] = bloque[-1]
+        else:
+            del self.bloques[i]
+            del self.maximos[i]
+        self.acumulados = None
+
+    def _calcular_acumulados(self):
+        if self.acumulados is None:
+            total = 0
+            self.acumulados = []
+            for bloque in self.bloques:
+                self.acumulados.append(total)
+                total += len(bloque)
+        return self.acumulados
+
+    def _inicio_bloque(self, i):
+        return self._calcular_acumulados()[i]
+
+    def _bloque_de_posicion(self, posicion):
+        return bisect_left(self._calcular_acumulados(), posicion + 1) - 1
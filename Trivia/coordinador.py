@@ -0,0 +1,145 @@
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+
+# Modo multiproceso del servidor.
+# Varios procesos trabajadores aceptan conexiones en el mismo puerto (SO_REUSEPORT: el núcleo
+# reparte las conexiones entrantes entre ellos) y cada sala vive en el trabajador que la creó.
+# El proceso principal hace de coordinador: está unido a cada trabajador por un socket Unix
+# de paquetes, por el que llegan las partidas terminadas (para acumularlas en el ranking y
+# persistirlas en un solo sitio) y los traspasos de conexiones. Un traspaso lleva adjunto el
+# descriptor del socket del cliente, así que el jugador pasa de un trabajador a otro sin
+# reconectarse. Cada trabajador mantiene una réplica del ranking que el coordinador actualiza
+# difundiendo las diferencias de cada partida.
+
+TAMANO_MAXIMO = 256 * 1024  # Bytes máximos de un mensaje entre procesos
+DESCRIPTOR = struct.Struct('i')
+
+class Canal:
+    """
+    Extremo de un socket Unix de paquetes entre el coordinador y un trabajador.
+    Cada paquete es un diccionario JSON y puede llevar adjunto un descriptor de archivo.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def enviar(self, mensaje, fd=None):
+        """Envía un mensaje; lanza ValueError si no cabe en un paquete (TAMANO_MAXIMO) sin enviar nada."""
+        datos = json.dumps(mensaje).encode('utf-8')
+        if len(datos) > TAMANO_MAXIMO:
+            raise ValueError(f"mensaje de {len(datos)} bytes, el máximo es {TAMANO_MAXIMO}")
+        if fd is None:
+            self.sock.send(datos)
+        else:
+            socket.send_fds(self.sock, [datos], [fd])
+
+    def recibir(self, bloquear=True):
+        """
+        Devuelve (mensaje, descriptor o None), o (None, None) si el otro extremo cerró.
+        Sin bloquear lanza BlockingIOError cuando no hay nada pendiente. Lanza ValueError si el
+        paquete es ilegible o no cabía en TAMANO_MAXIMO (llegó truncado).
+        """
+        # Se usa 'recvmsg' directamente: 'socket.recv_fds' ignora sus banderas en algunas versiones
+        datos, auxiliares, banderas, _ = self.sock.recvmsg(TAMANO_MAXIMO, socket.CMSG_LEN(DESCRIPTOR.size),
+                                                           0 if bloquear else socket.MSG_DONTWAIT)
+        fd = None
+        for nivel, tipo, valor in auxiliares:
+            if nivel == socket.SOL_SOCKET and tipo == socket.SCM_RIGHTS:
+                fd = DESCRIPTOR.unpack_from(valor)[0]
+        if not datos:
+            return None, None
+        try:
+            if banderas & socket.MSG_TRUNC:
+                raise ValueError(f"paquete truncado a {len(datos)} bytes")
+            return json.loads(datos), fd
+        except ValueError:
+            if fd is not None:
+                os.close(fd)  # El descriptor de un mensaje ilegible no llega a nadie
+            raise
+
+def crear_canales(n):
+    """Pares (extremo del coordinador, extremo del trabajador) para 'n' trabajadores."""
+    pares = []
+    for _ in range(n):
+        padre, hijo = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        pares.append((Canal(padre), Canal(hijo)))
+    return pares
+
+def abrir_escucha(host, puerto, backlog):
+    """Socket de escucha compartible: cada trabajador abre el suyo sobre el mismo puerto."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((host, puerto))
+    s.listen(backlog)
+    return s
+
+class Coordinador:
+    """
+    Atiende los canales de todos los trabajadores en el proceso principal.
+    'acumular' recibe los puntajes de cada partida terminada y los aplica al ranking maestro.
+    Los envíos a cada trabajador pasan por su propia cola y su propio hilo, así un trabajador
+    ocupado nunca bloquea la lectura de los demás canales.
+    """
+    def __init__(self, canales, acumular):
+        self.canales = canales
+        self.acumular = acumular
+        self.colas = [queue.SimpleQueue() for _ in canales]
+
+    def servir(self):
+        hilos = []
+        for indice, canal in enumerate(self.canales):
+            hilos.append(threading.Thread(target=self._atender, args=(indice, canal), daemon=True))
+            threading.Thread(target=self._enviar, args=(canal, self.colas[indice]), daemon=True).start()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+    def _atender(self, indice, canal):
+        while True:
+            try:
+                mensaje, fd = canal.recibir()
+            except OSError:
+                break
+            except ValueError as e:
+                # Un paquete ilegible se descarta; el canal sigue sirviendo a ese trabajador
+                print(f"Mensaje inválido del trabajador {indice}: {e!r}")
+                continue
+            if mensaje is None:
+                break
+            try:
+                if mensaje['tipo'] == 'partida':
+                    self.acumular(mensaje['puntajes'])
+                    for cola in self.colas:
+                        cola.put(({'tipo': 'ranking', 'puntajes': mensaje['puntajes']}, None))
+                elif mensaje['tipo'] == 'traspaso' and fd is not None:
+                    # El descriptor se reenvía al trabajador dueño de la sala; esta copia se cierra al enviarlo
+                    self.colas[mensaje['destino']].put((mensaje, fd))
+                    fd = None
+            except (KeyError, IndexError, TypeError) as e:
+                print(f"Mensaje inválido del trabajador {indice}: {e!r}")
+            finally:
+                if fd is not None:
+                    os.close(fd)  # Descriptor que no se reenvía a nadie
+        print(f"Trabajador {indice} desconectado del coordinador.")
+
+    def _enviar(self, canal, cola):
+        while True:
+            mensaje, fd = cola.get()
+            try:
+                canal.enviar(mensaje, fd)
+            except OSError as e:
+                print(f"No se pudo enviar al trabajador: {e}")
+            finally:
+                if fd is not None:
+                    os.close(fd)
@@ -0,0 +1,100 @@
+import collections
+import glob
+import json
+import os
+import threading
+import time
+import metricas
+
+# Registro de eventos de las partidas para análisis y repetición (sala creada, pregunta enviada,
+# respuesta recibida, ronda cerrada, fin de partida).
+# Registrar un evento solo añade una tupla a un búfer circular en memoria: ni se serializa ni se
+# toca el disco en el camino de las respuestas. Un hilo en segundo plano vacía el búfer cada
+# INTERVALO_ESCRITURA segundos, serializa el lote y lo añade de una vez al archivo actual (una
+# línea JSON por evento). Si el disco no da abasto y el búfer se llena, se pierden los eventos
+# más antiguos y se cuentan en 'eventos_descartados'; el juego nunca espera al registro.
+# Al pasar de TAMANO_MAXIMO bytes el archivo actual rota a '<ruta>.<n>' y se conservan los
+# últimos ARCHIVOS_CONSERVADOS. 'EstadisticasTrivia.py' lee los archivos y resume los datos.
+
+CAPACIDAD = 65536           # Eventos que caben en el búfer en memoria
+INTERVALO_ESCRITURA = 0.5   # Segundos entre vaciados del búfer
+TAMANO_MAXIMO = 16 * 1024 * 1024
+ARCHIVOS_CONSERVADOS = 20
+
+def archivos(ruta):
+    """Archivos del registro de 'ruta', del más antiguo al actual."""
+    rotados = []
+    for nombre in glob.glob(glob.escape(ruta) + '.*'):
+        sufijo = nombre[len(ruta) + 1:]
+        if sufijo.isdigit():
+            rotados.append((int(sufijo), nombre))
+    return [nombre for _, nombre in sorted(rotados)] + ([ruta] if os.path.exists(ruta) else [])
+
+class RegistroEventos:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.bufer = collections.deque(maxlen=CAPACIDAD)
+        self.cond = threading.Condition()
+        self.cerrando = False
+        self.hilo = None
+
+    def iniciar(self):
+        """Arranca el hilo escritor (después de crear los procesos trabajadores, si los hay)."""
+        self.hilo = threading.Thread(target=self._escribir, daemon=True)
+        self.hilo.start()
+
+    def registrar(self, tipo, **campos):
+        """
+        Anota un evento con el instante del servidor. Los campos deben ser valores que ya no
+        cambien (se serializan más tarde, en el hilo escritor).
+        """
+        if len(self.bufer) == CAPACIDAD:
+            metricas.sumar('eventos_descartados')
+        self.bufer.append((time.time(), tipo, campos))
+
+    def cerrar(self):
+        """Escribe lo pendiente y detiene el hilo escritor. Se usa al apagar el servidor."""
+        with self.cond:
+            self.cerrando = True
+            self.cond.notify()
+        if self.hilo:
+            self.hilo.join()
+
+    def _escribir(self):
+        while True:
+            with self.cond:
+                if not self.cerrando:
+                    self.cond.wait(INTERVALO_ESCRITURA)
+                cerrando = self.cerrando
+            lote = []
+            while self.bufer:
+                lote.append(self.bufer.popleft())
+            if lote:
+                try:
+                    self._anexar(lote)
+                except OSError as e:
+                    print(f"No se pudo escribir el registro de eventos: {e}")
+            if cerrando:
+                break
+
+    def _anexar(self, lote):
+        lineas = []
+        for instante, tipo, campos in lote:
+            campos['t'] = round(instante, 3)
+            campos['tipo'] = tipo
+            lineas.append(json.dumps(campos, separators=(',', ':'), ensure_ascii=False))
+        datos = ('\n'.join(lineas) + '\n').encode('utf-8')
+        with metricas.Medir('eventos_anexar'):
+            with open(self.ruta, 'ab') as f:
+                f.write(datos)
+                tamano = f.tell()
+            if tamano >= TAMANO_MAXIMO:
+                self._rotar()
+        metricas.sumar('eventos_registrados', len(lote))
+
+    def _rotar(self):
+        anteriores = archivos(self.ruta)[:-1]
+        numero = int(anteriores[-1].rsplit('.', 1)[1]) + 1 if anteriores else 1
+        os.replace(self.ruta, f"{self.ruta}.{numero}")
+        for viejo in anteriores[:max(0, len(anteriores) + 1 - ARCHIVOS_CONSERVADOS)]:
+            os.remove(viejo)
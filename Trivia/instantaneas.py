@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+import zlib
+import metricas
+
+# Instantáneas del estado de las salas, para reanudar las partidas tras un reinicio.
+# Cada sala se serializa (una línea JSON) solo cuando cambió desde la instantánea anterior; las
+# líneas se guardan en memoria y un hilo en segundo plano escribe el conjunto comprimido con zlib
+# en un archivo temporal que luego reemplaza al anterior, así que nunca queda uno a medias.
+# Al arrancar, el servidor carga la última instantánea y los jugadores tienen un plazo de gracia
+# para reconectarse y seguir en su sala.
+# Al apagar se hace una última escritura ('cerrar') y a partir de ahí no se escribe nada más: las
+# desconexiones del apagado vacían las salas y no deben llegar al archivo.
+
+VERSION = 1
+
+class Instantaneas:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.registros = {}  # sala_id -> línea JSON ya codificada
+        self.cambios = False # Hay algo que escribir desde la última escritura
+        self.cerrada = False
+        self.cond = threading.Condition()
+        self.lock_escritura = threading.Lock()  # Una sola escritura a la vez (hilo escritor o apagado)
+        self.hilo = None
+
+    def cargar(self):
+        """
+        Devuelve (instante en que se tomó, lista de registros de sala) o None si no hay
+        instantánea válida. Los registros cargados siguen en memoria hasta que sus salas cambien.
+        """
+        try:
+            with open(self.ruta, 'rb') as f:
+                lineas = zlib.decompress(f.read()).split(b'\n')
+            cabecera = json.loads(lineas[0])
+            if cabecera.get('version') != VERSION:
+                print("Instantánea de salas de otra versión, se ignora.")
+                return None
+            registros = [json.loads(linea) for linea in lineas[1:] if linea]
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, ValueError) as e:
+            print(f"No se pudo cargar la instantánea de salas: {e}")
+            return None
+        return cabecera['instante'], registros
+
+    def iniciar(self):
+        """Arranca el hilo escritor (después de crear los procesos trabajadores, si los hay)."""
+        self.hilo = threading.Thread(target=self._escribir, daemon=True)
+        self.hilo.start()
+
+    def actualizar(self, sala_id, registro):
+        """Guarda el registro serializado de una sala; se escribirá en la próxima escritura."""
+        with self.cond:
+            if self.cerrada: return
+            self.registros[sala_id] = json.dumps(registro, separators=(',', ':')).encode('utf-8')
+            self.cambios = True
+
+    def descartar(self, sala_id):
+        """Olvida una sala eliminada y pide una escritura en cuanto se pueda."""
+        with self.cond:
+            if self.cerrada: return
+            if self.registros.pop(sala_id, None) is not None:
+                self.cambios = True
+                self.cond.notify()
+
+    def pedir_escritura(self):
+        with self.cond:
+            if self.cambios:
+                self.cond.notify()
+
+    def cerrar(self):
+        """Última escritura, en el hilo que llama (al apagar el servidor)."""
+        with self.cond:
+            self.cerrada = True
+            lineas = list(self.registros.values())
+            self.cond.notify()
+        self._volcar(lineas, final=True)
+
+    def _escribir(self):
+        while True:
+            with self.cond:
+                while not self.cambios and not self.cerrada:
+                    self.cond.wait()
+                if self.cerrada:
+                    return
+                self.cambios = False
+                lineas = list(self.registros.values())
+            self._volcar(lineas)
+
+    def _volcar(self, lineas, final=False):
+        cabecera = json.dumps({'version': VERSION, 'instante': time.time(), 'salas': len(lineas)}).encode('utf-8')
+        temporal = self.ruta + '.tmp'
+        with self.lock_escritura, metricas.Medir('instantanea_escribir'):
+            # Una escritura del hilo que llegue después de la final sería más antigua que ella
+            if self.cerrada and not final:
+                return
+            datos = zlib.compress(b'\n'.join([cabecera] + lineas), 1)
+            with open(temporal, 'wb') as f:
+                f.write(datos)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, self.ruta)
+        metricas.sumar('instantanea_bytes', len(datos))
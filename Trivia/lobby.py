@@ -0,0 +1,63 @@
+import collections
+import itertools
+import threading
+
+# Sala de espera para el emparejamiento automático ('buscar_partida').
+# Las salas abiertas que aún no están completas esperan en una cola por cada combinación de
+# modo, número de preguntas, categoría y dificultad. Cada cola es un OrderedDict, así que
+# tomar la sala más antigua, publicar una nueva o retirar una concreta son operaciones O(1)
+# y nunca se recorre el diccionario global de salas.
+
+contador_salas = itertools.count(1)
+
+def nuevo_id_sala():
+    """Identificador único de sala dentro del proceso ('sala_1', 'sala_2', ...)."""
+    return f"sala_{next(contador_salas)}"
+
+def continuar_despues_de(sala_id):
+    """
+    Tras restaurar una sala de una instantánea, los identificadores nuevos siguen después del
+    suyo ('sala_<n>' o 'sala_<n>.<trabajador>') para no repetirlo.
+    """
+    global contador_salas
+    numero = int(sala_id.split('_', 1)[1].split('.', 1)[0])
+    siguiente = next(contador_salas)
+    contador_salas = itertools.count(max(siguiente, numero + 1))
+
+class Lobby:
+    def __init__(self):
+        self.colas = collections.defaultdict(collections.OrderedDict)
+        self.clave_de_sala = {}
+        self.lock = threading.Lock()  # Se toma por instantes; ningún otro bloqueo se adquiere dentro
+
+    def publicar(self, clave, sala_id):
+        """Pone una sala en espera de jugadores al final de la cola de su clave."""
+        with self.lock:
+            self.colas[clave][sala_id] = None
+            self.clave_de_sala[sala_id] = clave
+
+    def retirar(self, sala_id):
+        """Saca la sala de su cola (porque se llenó, empezó o se eliminó). No falla si no estaba."""
+        with self.lock:
+            clave = self.clave_de_sala.pop(sala_id, None)
+            if clave is None: return
+            cola = self.colas[clave]
+            cola.pop(sala_id, None)
+            if not cola:
+                del self.colas[clave]
+
+    def clave(self, sala_id):
+        """Clave con la que espera la sala, o None si no está en ninguna cola."""
+        with self.lock:
+            return self.clave_de_sala.get(sala_id)
+
+    def primera(self, clave):
+        """La sala que lleva más tiempo esperando con esa clave, o None."""
+        with self.lock:
+            cola = self.colas.get(clave)
+            return next(iter(cola)) if cola else None
+
+    def en_espera(self):
+        """Número de salas esperando jugadores, por clave."""
+        with self.lock:
+            return {clave: len(cola) for clave, cola in self.colas.items()}
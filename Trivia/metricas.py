@@ -0,0 +1,177 @@
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+
+# Instrumentación del servidor, pensada para dejarla siempre activa.
+# Los histogramas tienen cubetas fijas en escala logarítmica (de 1 µs a ~1 min), así que observar
+# un valor es una búsqueda binaria y un incremento. Los contadores son enteros con su bloqueo.
+# Todo se registra por nombre en este módulo y 'instantanea()' devuelve un diccionario
+# serializable con el estado actual.
+
+LIMITES = [1e-6 * 2 ** i for i in range(27)]  # Límite superior de cada cubeta, en segundos
+
+class Histograma:
+    def __init__(self):
+        self.cubetas = [0] * (len(LIMITES) + 1)
+        self.cuenta = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+        self.lock = threading.Lock()
+
+    def observar(self, valor):
+        i = bisect.bisect_left(LIMITES, valor)
+        with self.lock:
+            self.cubetas[i] += 1
+            self.cuenta += 1
+            self.suma += valor
+            if valor > self.maximo:
+                self.maximo = valor
+
+    def _percentil(self, q):
+        # Aproximado: devuelve el límite superior de la cubeta que contiene el percentil
+        objetivo = q * self.cuenta
+        acumulado = 0
+        for i, n in enumerate(self.cubetas):
+            acumulado += n
+            if acumulado >= objetivo:
+                return min(LIMITES[i], self.maximo) if i < len(LIMITES) else self.maximo
+        return self.maximo
+
+    def resumen(self):
+        with self.lock:
+            if not self.cuenta:
+                return {'n': 0}
+            return {
+                'n': self.cuenta,
+                'media_ms': round(self.suma / self.cuenta * 1000, 3),
+                'p50_ms': round(self._percentil(0.50) * 1000, 3),
+                'p95_ms': round(self._percentil(0.95) * 1000, 3),
+                'p99_ms': round(self._percentil(0.99) * 1000, 3),
+                'max_ms': round(self.maximo * 1000, 3),
+            }
+
+histogramas = collections.defaultdict(Histograma)
+contadores = collections.Counter()
+lock_contadores = threading.Lock()
+inicio = time.time()
+
+def observar(nombre, segundos):
+    histogramas[nombre].observar(segundos)
+
+def sumar(nombre, cantidad=1):
+    with lock_contadores:
+        contadores[nombre] += cantidad
+
+class BloqueoMedido:
+    """
+    Envoltorio de un bloqueo que mide el tiempo de espera para tomarlo y el tiempo que se retiene.
+    Varios bloqueos con el mismo nombre (por ejemplo el de cada sala) comparten histogramas.
+    """
+    def __init__(self, nombre, lock=None):
+        self.lock = lock or threading.Lock()
+        self.espera = histogramas[f'{nombre}_espera']
+        self.retencion = histogramas[f'{nombre}_retencion']
+        self.tomado_en = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        antes = time.perf_counter()
+        tomado = self.lock.acquire(blocking, timeout)
+        if tomado:
+            self.tomado_en = time.perf_counter()
+            self.espera.observar(self.tomado_en - antes)
+        return tomado
+
+    def release(self):
+        self.retencion.observar(time.perf_counter() - self.tomado_en)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class Medir:
+    """Administrador de contexto que observa en 'nombre' la duración del bloque."""
+    def __init__(self, nombre):
+        self.histograma = histogramas[nombre]
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio)
+
+class PerfiladorMuestreo:
+    """
+    Perfilador por muestreo que se enciende y apaga en caliente.
+    Un hilo toma cada 'intervalo' la pila de todos los demás hilos y cuenta la función
+    que se está ejecutando; apagado no cuesta nada.
+    """
+    def __init__(self):
+        self.muestras = collections.Counter()
+        self.total = 0
+        self.activo = False
+        self.hilo = None
+        self.lock = threading.Lock()     # Protege las muestras: 'resumen' las lee mientras el hilo las suma
+        self.control = threading.Lock()  # Un solo encendido o apagado a la vez
+
+    def iniciar(self, intervalo=0.005):
+        with self.control:
+            if self.activo: return
+            with self.lock:
+                self.muestras.clear()
+                self.total = 0
+            self.activo = True
+            self.hilo = threading.Thread(target=self._muestrear, args=(intervalo,), daemon=True)
+            self.hilo.start()
+
+    def detener(self):
+        """Apaga el perfilador y espera a su hilo, para que un 'iniciar' posterior no deje dos en marcha."""
+        with self.control:
+            self.activo = False
+            if self.hilo:
+                self.hilo.join()
+                self.hilo = None
+
+    def _muestrear(self, intervalo):
+        propio = threading.get_ident()
+        while self.activo:
+            funciones = []
+            for ident, marco in sys._current_frames().items():
+                if ident == propio: continue
+                codigo = marco.f_code
+                funciones.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}:{marco.f_lineno}")
+            with self.lock:
+                self.muestras.update(funciones)
+                self.total += len(funciones)
+            time.sleep(intervalo)
+
+    def resumen(self, n=25):
+        with self.lock:
+            total = self.total
+            top = self.muestras.most_common(n)
+        return {
+            'activo': self.activo,
+            'muestras': total,
+            'top': [[funcion, cuenta] for funcion, cuenta in top],
+        }
+
+perfilador = PerfiladorMuestreo()
+
+def instantanea(**extra):
+    """Estado de todas las métricas como diccionario serializable; 'extra' añade valores calculados al vuelo."""
+    with lock_contadores:
+        valores = dict(contadores)
+    return {
+        'activo_desde_s': round(time.time() - inicio, 1),
+        'contadores': valores,
+        'histogramas': {nombre: h.resumen() for nombre, h in sorted(list(histogramas.items()))},
+        'perfilador': perfilador.resumen(),
+        **extra,
+    }
@@ -0,0 +1,174 @@
+import enum
+import heapq
+
+# Registros compactos del estado de las salas.
+# Cada sala, jugador y ronda es un objeto con '__slots__' en lugar de diccionarios anidados:
+# sin diccionario por instancia, cada registro ocupa una fracción de la memoria. Cada jugador
+# tiene un índice entero fijo dentro de su sala (el mismo que usan los marcos binarios), así que
+# las respuestas recibidas en una ronda son los bits de un entero y no un conjunto de nombres.
+# Cada sala tiene un único registro de ronda que se reutiliza de una pregunta a la siguiente.
+# Las salas masivas (cientos de jugadores) usan los mismos registros; solo cambian las reglas
+# de puntuación y de difusión, que aplica el servidor.
+# 'registro' y 'desde_registro' convierten una sala a un diccionario serializable y al revés,
+# para las instantáneas que permiten reanudar las partidas tras reiniciar el servidor.
+
+class EstadoSala(enum.Enum):
+    ESPERANDO = 'esperando'
+    JUGANDO = 'jugando'
+
+class Jugador:
+    """
+    Jugador dentro de una sala: su conexión, su índice fijo y su puntaje en la partida.
+    'inicial' es el puntaje que tenía al abrirse la ronda en curso.
+    """
+    __slots__ = ('conn', 'indice', 'puntaje', 'inicial')
+
+    def __init__(self, conn, indice):
+        self.conn = conn
+        self.indice = indice
+        self.puntaje = 0
+        self.inicial = 0
+
+    @property
+    def bit(self):
+        return 1 << self.indice
+
+class Ronda:
+    """
+    Pregunta abierta de una sala. 'respondidos' es un mapa de bits con los índices de los
+    jugadores que ya respondieron; 'conteo' cuenta las respuestas a cada opción; 'plazo' es la
+    tarea del planificador que la cierra.
+    """
+    __slots__ = ('numero', 'respuesta', 'timestamp_envio', 'respondidos', 'conteo', 'acertada', 'cerrada', 'plazo')
+
+    def __init__(self):
+        self.numero = -1
+        self.cerrada = True
+        self.plazo = None
+
+    def abrir(self, numero, respuesta, num_opciones, timestamp_envio, plazo):
+        self.numero = numero
+        self.respuesta = respuesta.lower()
+        self.timestamp_envio = timestamp_envio
+        self.respondidos = 0
+        self.conteo = [0] * num_opciones
+        self.acertada = False
+        self.cerrada = False
+        self.plazo = plazo
+
+    def contar(self, respuesta):
+        """Suma la respuesta a su opción si es un número de opción válido."""
+        if respuesta.isdigit() and 0 < int(respuesta) <= len(self.conteo):
+            self.conteo[int(respuesta) - 1] += 1
+
+class Sala:
+    """
+    Sala de juego. 'jugadores' va del nombre al registro de cada jugador presente; 'indices'
+    guarda el índice de todos los que pasaron por la sala, porque un índice no se reutiliza
+    aunque su jugador salga. 'presentes' es el mapa de bits de los jugadores que siguen dentro.
+    En una sala masiva 'modo' es la capacidad y la partida la empieza su anfitrión o la cuenta
+    atrás; 'marcador_pendiente' indica que ya hay una difusión del marcador programada.
+    'transmision' solo existe cuando la sala tiene o tuvo espectadores.
+    'modificada' indica que cambió desde la última instantánea; 'reservas' guarda, tras un
+    reinicio, el puntaje de los jugadores que todavía no han vuelto (nombre -> puntaje).
+    """
+    __slots__ = ('modo', 'estado', 'num_preguntas', 'categoria', 'dificultad', 'jugadores', 'indices',
+                 'presentes', 'preguntas', 'siguiente', 'ronda', 'lock', 'activa',
+                 'masiva', 'anfitrion', 'marcador_pendiente', 'transmision', 'modificada', 'reservas')
+
+    def __init__(self, modo, num_preguntas, categoria, dificultad, lock, masiva=False, anfitrion=None):
+        self.modo = modo
+        self.estado = EstadoSala.ESPERANDO
+        self.num_preguntas = num_preguntas
+        self.categoria = categoria
+        self.dificultad = dificultad
+        self.jugadores = {}
+        self.indices = {}
+        self.presentes = 0
+        self.preguntas = ()  # Números de registro en el banco, elegidos al empezar la partida
+        self.siguiente = 0   # Posición en 'preguntas' de la próxima ronda
+        self.ronda = Ronda()
+        self.lock = lock
+        self.activa = True
+        self.masiva = masiva
+        self.anfitrion = anfitrion
+        self.marcador_pendiente = False
+        self.transmision = None
+        self.modificada = True
+        self.reservas = None
+
+    def agregar(self, nombre, conn):
+        """Añade al jugador con su índice de siempre (o uno nuevo) y devuelve su registro."""
+        indice = self.indices.setdefault(nombre, len(self.indices))
+        jugador = self.jugadores[nombre] = Jugador(conn, indice)
+        self.presentes |= jugador.bit
+        self.modificada = True
+        return jugador
+
+    def quitar(self, nombre):
+        jugador = self.jugadores.pop(nombre, None)
+        if jugador:
+            self.presentes &= ~jugador.bit
+            self.modificada = True
+        return jugador
+
+    def ocupadas(self):
+        """Plazas ocupadas: jugadores presentes más los reservados que aún pueden volver."""
+        return len(self.jugadores) + (len(self.reservas) if self.reservas else 0)
+
+    def conexiones(self):
+        return [jugador.conn for jugador in self.jugadores.values()]
+
+    def puntajes(self):
+        return {nombre: jugador.puntaje for nombre, jugador in self.jugadores.items()}
+
+    def abrir_ronda(self, respuesta, num_opciones, timestamp_envio, plazo):
+        """Abre la ronda 'siguiente' y anota el puntaje con que la empieza cada jugador."""
+        for jugador in self.jugadores.values():
+            jugador.inicial = jugador.puntaje
+        self.ronda.abrir(self.siguiente, respuesta, num_opciones, timestamp_envio, plazo)
+
+    def top(self, n):
+        """Los 'n' mejores puntajes como pares [nombre, puntaje], sin ordenar a todos los jugadores."""
+        mejores = heapq.nlargest(n, self.jugadores.items(), key=lambda par: par[1].puntaje)
+        return [[nombre, jugador.puntaje] for nombre, jugador in mejores]
+
+    def registro(self):
+        """
+        Estado de la sala como diccionario serializable. La ronda abierta no se guarda: al
+        reanudar la partida se vuelve a hacer la misma pregunta, así que cada jugador se guarda
+        con el puntaje que tenía al abrirla (lo ganado en ella se volverá a ganar).
+        """
+        puntajes = dict(self.reservas or {})
+        abierta = not self.ronda.cerrada
+        puntajes.update({nombre: jugador.inicial if abierta else jugador.puntaje
+                         for nombre, jugador in self.jugadores.items()})
+        return {
+            'modo': self.modo,
+            'estado': self.estado.value,
+            'num_preguntas': self.num_preguntas,
+            'categoria': self.categoria,
+            'dificultad': self.dificultad,
+            'masiva': self.masiva,
+            'anfitrion': self.anfitrion,
+            'preguntas': list(self.preguntas),
+            'siguiente': self.siguiente,
+            'indices': self.indices,
+            'puntajes': puntajes,
+        }
+
+    @classmethod
+    def desde_registro(cls, registro, lock):
+        """Sala restaurada de una instantánea: sin jugadores presentes, todos con su plaza reservada."""
+        sala = cls(registro['modo'], registro['num_preguntas'], registro['categoria'], registro['dificultad'],
+                   lock, masiva=registro['masiva'], anfitrion=registro['anfitrion'])
+        sala.estado = EstadoSala(registro['estado'])
+        sala.preguntas = tuple(registro['preguntas'])
+        sala.siguiente = registro['siguiente']
+        sala.indices = dict(registro['indices'])
+        sala.reservas = dict(registro['puntajes'])
+        return sala
+
+    def ronda_completa(self):
+        """Todos los jugadores presentes respondieron la ronda abierta (los que se fueron no cuentan)."""
+        return not self.ronda.cerrada and self.ronda.respondidos & self.presentes == self.presentes
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+import metricas
+
+# Persistencia incremental del ranking global (escritura diferida).
+# Al terminar cada partida solo se encolan las diferencias de puntaje; un hilo en segundo plano
+# las agrega por lotes a un registro de solo-anexado ('ranking_global.log') y cada cierto número
+# de entradas compacta todo en la instantánea ('ranking_global.json').
+# Cada entrada del registro lleva un número de secuencia y la instantánea guarda el último que
+# incluye, así que al arrancar se reproduce solo lo que falta aunque el servidor se haya
+# caído a mitad de una compactación.
+
+INTERVALO_ESCRITURA = 0.5   # Segundos que se esperan para juntar varias partidas en una sola escritura
+COMPACTAR_CADA = 1000       # Entradas del registro tras las cuales se reescribe la instantánea
+
+class RegistroRanking:
+    def __init__(self, ruta_instantanea='ranking_global.json', ruta_registro='ranking_global.log'):
+        self.ruta_instantanea = ruta_instantanea
+        self.ruta_registro = ruta_registro
+        self.secuencia = 0          # Última secuencia asignada
+        self.pendientes = []        # Entradas aún no escritas en disco
+        self.entradas_registro = 0  # Entradas escritas desde la última compactación
+        self.cond = threading.Condition()
+        self.cerrando = False
+        self.hilo = None
+        self.obtener_instantanea = None
+
+    def cargar(self):
+        """
+        Devuelve el ranking reconstruido a partir de la instantánea más el registro.
+        Acepta también el formato antiguo de la instantánea ({jugador: puntaje}).
+        """
+        ranking = {}
+        secuencia_base = 0
+        if os.path.exists(self.ruta_instantanea):
+            try:
+                with open(self.ruta_instantanea, 'r') as f:
+                    datos = json.load(f)
+                if isinstance(datos.get('ranking'), dict):
+                    ranking = datos['ranking']
+                    secuencia_base = datos.get('secuencia', 0)
+                else:
+                    ranking = datos
+            except json.JSONDecodeError:
+                print("Error al cargar rankings, el archivo puede estar corrupto.")
+
+        self.secuencia = secuencia_base
+        if os.path.exists(self.ruta_registro):
+            with open(self.ruta_registro, 'r') as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                    except json.JSONDecodeError:
+                        break  # Última línea a medio escribir: se descarta
+                    self.entradas_registro += 1
+                    if entrada['n'] <= secuencia_base:
+                        continue  # Ya incluida en la instantánea
+                    for jugador, delta in entrada['d'].items():
+                        ranking[jugador] = ranking.get(jugador, 0) + delta
+                    self.secuencia = entrada['n']
+        return ranking
+
+    def iniciar(self, obtener_instantanea):
+        """
+        Arranca el hilo escritor. 'obtener_instantanea' debe devolver, de forma atómica respecto
+        a 'registrar', una copia del ranking y la secuencia de la última diferencia aplicada.
+        """
+        self.obtener_instantanea = obtener_instantanea
+        self.hilo = threading.Thread(target=self._escribir, daemon=True)
+        self.hilo.start()
+
+    def registrar(self, deltas):
+        """
+        Encola las diferencias de puntaje de una partida; no hace E/S.
+        Se llama con el bloqueo del ranking tomado para que el orden de las secuencias
+        coincida con el orden en que se aplicaron en memoria.
+        """
+        with self.cond:
+            self.secuencia += 1
+            self.pendientes.append({'n': self.secuencia, 'd': deltas})
+            self.cond.notify()
+
+    def cerrar(self):
+        """Escribe lo pendiente, compacta y detiene el hilo escritor."""
+        with self.cond:
+            self.cerrando = True
+            self.cond.notify()
+        if self.hilo:
+            self.hilo.join()
+
+    def _escribir(self):
+        while True:
+            with self.cond:
+                while not self.pendientes and not self.cerrando:
+                    self.cond.wait()
+                # Da un margen para que varias partidas terminadas casi a la vez vayan en un solo lote
+                limite = time.monotonic() + INTERVALO_ESCRITURA
+                while not self.cerrando and time.monotonic() < limite:
+                    self.cond.wait(limite - time.monotonic())
+                lote, self.pendientes = self.pendientes, []
+                cerrando = self.cerrando
+            if lote:
+                self._anexar(lote)
+            if cerrando or self.entradas_registro >= COMPACTAR_CADA:
+                self.compactar()
+            if cerrando:
+                return
+
+    def _anexar(self, lote):
+        with metricas.Medir('persistencia_anexar'), open(self.ruta_registro, 'a') as f:
+            f.write(''.join(json.dumps(entrada) + '\n' for entrada in lote))
+            f.flush()
+            os.fsync(f.fileno())
+        self.entradas_registro += len(lote)
+
+    def compactar(self):
+        """
+        Reescribe la instantánea con el estado actual y vacía el registro.
+        Solo la llama el hilo escritor, que es el único que toca los archivos.
+        """
+        ranking, secuencia = self.obtener_instantanea()
+        temporal = self.ruta_instantanea + '.tmp'
+        with metricas.Medir('persistencia_compactar'), open(temporal, 'w') as f:
+            json.dump({'secuencia': secuencia, 'ranking': ranking}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta_instantanea)
+        # Todo lo escrito en el registro tiene secuencia <= 'secuencia', así que puede vaciarse
+        open(self.ruta_registro, 'w').close()
+        self.entradas_registro = 0
+        print("Rankings guardados.")
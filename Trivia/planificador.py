@@ -0,0 +1,77 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Planificador central de temporizadores.
+# Todas las salas registran aquí sus plazos (fin de ronda, pausa entre preguntas) en lugar de
+# tener un hilo durmiendo por sala. Un único hilo espera hasta el plazo más próximo del montículo.
+
+class Tarea:
+    """
+    Llamada programada. Igual que los temporizadores de asyncio, se anula con 'cancel()'.
+    """
+    __slots__ = ('instante', 'funcion', 'args', 'cancelada')
+
+    def __init__(self, instante, funcion, args):
+        self.instante = instante
+        self.funcion = funcion
+        self.args = args
+        self.cancelada = False
+
+    def cancel(self):
+        self.cancelada = True
+
+class Planificador:
+    """
+    Montículo de tareas ordenadas por instante, atendido por un único hilo.
+    Las tareas canceladas se descartan de forma perezosa cuando llegan al frente.
+    """
+    def __init__(self):
+        self.cola = []  # Montículo de (instante, secuencia, tarea)
+        self.secuencia = itertools.count()
+        self.cond = threading.Condition()
+        threading.Thread(target=self._ejecutar, daemon=True).start()
+
+    def programar(self, retraso, funcion, *args):
+        """
+        Ejecuta 'funcion(*args)' dentro de 'retraso' segundos y devuelve la tarea.
+        """
+        tarea = Tarea(time.monotonic() + retraso, funcion, args)
+        with self.cond:
+            heapq.heappush(self.cola, (tarea.instante, next(self.secuencia), tarea))
+            # Solo hace falta despertar al hilo si el nuevo plazo es el más próximo
+            if self.cola[0][2] is tarea:
+                self.cond.notify()
+        return tarea
+
+    def _siguiente(self):
+        with self.cond:
+            while True:
+                while self.cola and self.cola[0][2].cancelada:
+                    heapq.heappop(self.cola)
+                if not self.cola:
+                    self.cond.wait()
+                    continue
+                espera = self.cola[0][0] - time.monotonic()
+                if espera <= 0:
+                    return heapq.heappop(self.cola)[2]
+                self.cond.wait(espera)
+
+    def _ejecutar(self):
+        while True:
+            tarea = self._siguiente()
+            try:
+                tarea.funcion(*tarea.args)
+            except Exception as e:
+                print(f"Error en tarea programada {tarea.funcion.__name__}: {e}")
+
+class PlanificadorAsync:
+    """
+    Misma interfaz que 'Planificador', apoyada en los temporizadores del bucle de asyncio.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+
+    def programar(self, retraso, funcion, *args):
+        return self.loop.call_later(retraso, funcion, *args)
@@ -0,0 +1,237 @@
+import json
+import struct
+
+# Protocolo de mensajes del juego de trivia.
+# Cada mensaje es un objeto JSON en UTF-8 terminado en '\n' (json.dumps nunca emite saltos
+# de línea crudos, así que el delimitador no puede aparecer dentro de un mensaje).
+# El decodificador es incremental: acepta los bytes tal como llegan de TCP, guarda los
+# fragmentos incompletos y devuelve todos los mensajes completos de una vez.
+#
+# Codificación binaria (opcional, se negocia en 'registrar_usuario'):
+# los mensajes frecuentes de la partida que el servidor difunde (pregunta, acierto, tiempo
+# agotado, fin de juego) viajan como marcos empaquetados con struct. Cada marco empieza por el
+# byte MARCA_BINARIA, que nunca puede iniciar un texto UTF-8, así que en un mismo flujo conviven
+# con las líneas JSON del resto de mensajes. Los jugadores de una sala se internan: el marco
+# JUGADORES asocia cada nombre a un índice y los demás marcos solo llevan índices. Los aciertos
+# se envían como diferencias (índice, puntos, nuevo total) en vez del marcador completo; el
+# decodificador reconstruye el marcador y entrega los mismos diccionarios que en JSON.
+
+SEPARADOR = b'\n'
+MAX_MENSAJE = 1024 * 1024  # Tamaño máximo de un mensaje sin terminar antes de dar error
+
+JSON = 'json'
+BINARIA = 'binaria'
+
+MARCA_BINARIA = 0xB1
+CABECERA_BINARIA = struct.Struct('<BI')  # tipo, longitud del cuerpo (tras el byte de marca)
+PREGUNTA, ACIERTO, TIEMPO_AGOTADO, FIN_JUEGO, JUGADORES = range(1, 6)
+SIN_JUGADOR = 0xFFFF
+
+_PREGUNTA = struct.Struct('<HHd')    # ronda actual, rondas totales, marca de tiempo; sigue el JSON de la pregunta
+_ACIERTO = struct.Struct('<Hii')     # índice del jugador, puntos, nuevo total
+_ENTRADA = struct.Struct('<HiB')     # índice, puntaje, longitud del nombre (solo en JUGADORES)
+_PUNTAJE = struct.Struct('<Hi')      # índice, puntaje
+_CUENTA = struct.Struct('<H')
+
+class ErrorProtocolo(ValueError):
+    """Se lanza cuando el flujo recibido no puede interpretarse como mensajes válidos."""
+
+def codificar(mensaje):
+    """
+    Convierte un diccionario en un marco listo para enviar por el socket.
+    """
+    return json.dumps(mensaje).encode('utf-8') + SEPARADOR
+
+def codificar_varios(mensajes):
+    """
+    Une varios mensajes en un solo bloque de bytes para enviarlos con una única escritura.
+    """
+    return b''.join(codificar(m) for m in mensajes)
+
+def codificar_con_fragmento(mensaje, clave, fragmento):
+    """
+    Codifica 'mensaje' añadiendo bajo 'clave' un valor que ya viene serializado en JSON.
+    Permite reutilizar partes grandes ya codificadas (por ejemplo una página del ranking)
+    sin volver a pasarlas por json.dumps en cada envío.
+    """
+    cabecera = json.dumps(mensaje).encode('utf-8')[:-1]
+    if mensaje:
+        cabecera += b', '
+    return cabecera + json.dumps(clave).encode('utf-8') + b': ' + fragmento + b'}' + SEPARADOR
+
+def _marco(tipo, cuerpo):
+    return bytes([MARCA_BINARIA]) + CABECERA_BINARIA.pack(tipo, len(cuerpo)) + cuerpo
+
+def codificar_pregunta(ronda_actual, rondas_totales, timestamp, pregunta):
+    """Marco binario de una pregunta; 'pregunta' es su JSON ya serializado (compartido por todos)."""
+    return _marco(PREGUNTA, _PREGUNTA.pack(ronda_actual, rondas_totales, timestamp) + pregunta)
+
+def codificar_acierto(indice, puntos, total):
+    """Diferencia del marcador: el jugador 'indice' gana 'puntos' y queda con 'total'."""
+    return _marco(ACIERTO, _ACIERTO.pack(indice, puntos, total))
+
+MARCO_TIEMPO_AGOTADO = _marco(TIEMPO_AGOTADO, b'')
+
+def codificar_fin(ganador, puntajes):
+    """Fin de la partida: índice del ganador (SIN_JUGADOR si no hay) y pares (índice, puntaje)."""
+    cuerpo = _CUENTA.pack(ganador) + _CUENTA.pack(len(puntajes))
+    cuerpo += b''.join(_PUNTAJE.pack(indice, puntaje) for indice, puntaje in puntajes)
+    return _marco(FIN_JUEGO, cuerpo)
+
+def codificar_jugadores(entradas):
+    """Tabla de jugadores de la sala: ternas (índice, nombre, puntaje). Sustituye al marcador."""
+    partes = [_CUENTA.pack(len(entradas))]
+    for indice, nombre, puntaje in entradas:
+        # Se recorta a 255 bytes sin partir un carácter multibyte, que el cliente no podría decodificar
+        nombre = nombre.encode('utf-8')[:255].decode('utf-8', 'ignore').encode('utf-8')
+        partes.append(_ENTRADA.pack(indice, puntaje, len(nombre)) + nombre)
+    return _marco(JUGADORES, b''.join(partes))
+
+class Marcos:
+    """
+    Un mismo mensaje en cada codificación. Cada variante se genera la primera vez que alguna
+    conexión la pide y se reutiliza para todas las demás; si una codificación no tiene
+    generador, sus conexiones no reciben el mensaje. 'claves' permite que una codificación use
+    otra clave de sustitución en la cola de salida (ver salida.py).
+    """
+    def __init__(self, json=None, binaria=None, claves=None):
+        self.generadores = {JSON: json, BINARIA: binaria}
+        self.generados = {}
+        self.claves = claves or {}
+
+    def para(self, codificacion):
+        if codificacion not in self.generados:
+            generador = self.generadores.get(codificacion)
+            self.generados[codificacion] = generador() if generador else None
+        return self.generados[codificacion]
+
+class Decodificador:
+    """
+    Decodificador incremental de mensajes delimitados por '\n'.
+
+    También acepta el formato antiguo (objetos JSON sin delimitador, uno o varios pegados)
+    para que los clientes que todavía no envían '\n' sigan funcionando, y los marcos binarios,
+    que convierte en los mismos diccionarios que su equivalente JSON.
+    """
+    _json = json.JSONDecoder()
+    _marca = bytes([MARCA_BINARIA])
+
+    def __init__(self):
+        self.buffer = b''
+        self.nombres = {}   # Índice → nombre de los jugadores de la sala (marcos JUGADORES)
+        self.marcador = {}  # Marcador reconstruido a partir de las diferencias
+
+    def alimentar(self, datos):
+        """
+        Añade los bytes recibidos y devuelve la lista de mensajes completos.
+        """
+        self.buffer += datos
+        mensajes = []
+        if self._marca in self.buffer:
+            self._separar_mixto(mensajes)
+        elif SEPARADOR in self.buffer:
+            *lineas, self.buffer = self.buffer.split(SEPARADOR)
+            for linea in lineas:
+                if linea.strip():
+                    mensajes.append(self._cargar(linea))
+        if self.buffer.strip() and self.buffer[0] != MARCA_BINARIA:
+            mensajes.extend(self._extraer_sin_delimitador())
+        if len(self.buffer) > MAX_MENSAJE:
+            raise ErrorProtocolo("Mensaje demasiado grande o sin terminar.")
+        return mensajes
+
+    def _separar_mixto(self, mensajes):
+        # Recorre el búfer marco a marco: un cuerpo binario puede contener bytes '\n'
+        buffer = self.buffer
+        pos = 0
+        while pos < len(buffer):
+            if buffer[pos] == MARCA_BINARIA:
+                inicio = pos + 1 + CABECERA_BINARIA.size
+                if inicio > len(buffer):
+                    break
+                tipo, longitud = CABECERA_BINARIA.unpack_from(buffer, pos + 1)
+                if longitud > MAX_MENSAJE:
+                    raise ErrorProtocolo("Marco binario demasiado grande.")
+                if inicio + longitud > len(buffer):
+                    break
+                mensaje = self._binario(tipo, buffer[inicio:inicio + longitud])
+                if mensaje is not None:
+                    mensajes.append(mensaje)
+                pos = inicio + longitud
+            else:
+                fin = buffer.find(SEPARADOR, pos)
+                if fin < 0:
+                    break
+                if buffer[pos:fin].strip():
+                    mensajes.append(self._cargar(buffer[pos:fin]))
+                pos = fin + 1
+        self.buffer = buffer[pos:]
+
+    def _binario(self, tipo, cuerpo):
+        try:
+            if tipo == PREGUNTA:
+                ronda_actual, rondas_totales, timestamp = _PREGUNTA.unpack_from(cuerpo)
+                return {"status": "pregunta", "ronda_actual": ronda_actual, "rondas_totales": rondas_totales,
+                        "timestamp": timestamp, "pregunta": self._cargar(cuerpo[_PREGUNTA.size:])}
+            if tipo == ACIERTO:
+                indice, puntos, total = _ACIERTO.unpack(cuerpo)
+                jugador = self.nombres.get(indice, str(indice))
+                self.marcador[jugador] = total
+                return {"status": "respuesta_correcta", "jugador": jugador, "puntos": puntos, "marcador": dict(self.marcador)}
+            if tipo == TIEMPO_AGOTADO:
+                return {"status": "tiempo_agotado"}
+            if tipo == FIN_JUEGO:
+                ganador, cuenta = struct.unpack_from('<HH', cuerpo)
+                marcador = {}
+                for i in range(cuenta):
+                    indice, puntaje = _PUNTAJE.unpack_from(cuerpo, 4 + i * _PUNTAJE.size)
+                    marcador[self.nombres.get(indice, str(indice))] = puntaje
+                nombre_ganador = self.nombres.get(ganador, "Nadie") if ganador != SIN_JUGADOR else "Nadie"
+                return {"status": "fin_juego", "marcador_final": marcador, "ganador": nombre_ganador,
+                        "ganador_puntos": marcador.get(nombre_ganador, 0)}
+            if tipo == JUGADORES:
+                cuenta, = _CUENTA.unpack_from(cuerpo)
+                pos = _CUENTA.size
+                self.marcador = {}
+                for _ in range(cuenta):
+                    indice, puntaje, longitud = _ENTRADA.unpack_from(cuerpo, pos)
+                    pos += _ENTRADA.size
+                    nombre = cuerpo[pos:pos + longitud].decode('utf-8')
+                    pos += longitud
+                    self.nombres[indice] = nombre
+                    self.marcador[nombre] = puntaje
+                return None
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ErrorProtocolo(f"Marco binario mal formado: {e}") from e
+        raise ErrorProtocolo(f"Tipo de marco binario desconocido: {tipo}")
+
+    def _cargar(self, linea):
+        try:
+            return json.loads(linea.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ErrorProtocolo(f"Mensaje mal formado: {e}") from e
+
+    def _extraer_sin_delimitador(self):
+        """
+        Extrae los objetos JSON completos que quedan en el búfer sin '\n' final.
+        Si lo que queda es solo el inicio de un mensaje, se conserva hasta que llegue el resto.
+        """
+        try:
+            texto = self.buffer.decode('utf-8')
+        except UnicodeDecodeError:
+            return []  # Un carácter multibyte partido: espera más datos
+        mensajes = []
+        pos = 0
+        while True:
+            while pos < len(texto) and texto[pos].isspace():
+                pos += 1
+            if pos == len(texto):
+                break
+            try:
+                mensaje, pos = self._json.raw_decode(texto, pos)
+            except json.JSONDecodeError:
+                break
+            mensajes.append(mensaje)
+        if mensajes:
+            self.buffer = texto[pos:].encode('utf-8')
+        return mensajes
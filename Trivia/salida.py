@@ -0,0 +1,63 @@
+# Cola de salida acotada por conexión, con política para consumidores lentos.
+# Los mensajes ya vienen codificados (una difusión codifica una vez y encola los mismos bytes
+# en todas las conexiones). Los que llevan 'clave' son sustituibles: si la cola está llena
+# se pueden descartar o reemplazar por el más reciente con la misma clave (por ejemplo el marcador).
+# Los mensajes sin clave (preguntas, fin de juego) son imprescindibles y nunca se descartan;
+# si aun así la cola sigue creciendo, el cliente está caído o es demasiado lento y se desconecta.
+
+DESCARTAR = 'descartar'       # Con la cola llena se pierden los mensajes sustituibles nuevos
+COALESCER = 'coalescer'       # Con la cola llena cada mensaje sustituible reemplaza al pendiente de su clave
+DESCONECTAR = 'desconectar'   # Con la cola llena se corta la conexión
+POLITICAS = (DESCARTAR, COALESCER, DESCONECTAR)
+
+FACTOR_LIMITE_DURO = 4  # Múltiplo del límite a partir del cual se desconecta con cualquier política
+
+class ColaSalida:
+    """
+    Cola de marcos salientes de una conexión. No es segura entre hilos por sí sola:
+    la protege la conexión que la usa.
+    """
+    def __init__(self, limite_bytes, politica):
+        self.limite = limite_bytes
+        self.politica = politica
+        self.marcos = []  # Pares [clave, datos]
+        self.bytes = 0
+        self.descartados = 0
+
+    def __len__(self):
+        return len(self.marcos)
+
+    def agregar(self, datos, clave=None):
+        """
+        Encola un marco aplicando la política. Devuelve False si la conexión debe cerrarse.
+        """
+        if self.bytes + len(datos) > self.limite:
+            if self.politica == DESCONECTAR:
+                return False
+            if clave is not None:
+                if self.politica == COALESCER and self._reemplazar(clave, datos):
+                    return True
+                if self.politica == DESCARTAR:
+                    self.descartados += 1
+                    return True
+            if self.bytes + len(datos) > self.limite * FACTOR_LIMITE_DURO:
+                return False
+        self.marcos.append([clave, datos])
+        self.bytes += len(datos)
+        return True
+
+    def _reemplazar(self, clave, datos):
+        for marco in reversed(self.marcos):
+            if marco[0] == clave:
+                self.bytes += len(datos) - len(marco[1])
+                marco[1] = datos
+                self.descartados += 1
+                return True
+        return False
+
+    def tomar_todo(self):
+        """Vacía la cola y devuelve todos los marcos unidos en un solo bloque."""
+        bloque = b''.join(datos for _, datos in self.marcos)
+        self.marcos.clear()
+        self.bytes = 0
+        return bloque
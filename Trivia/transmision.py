@@ -0,0 +1,117 @@
+import collections
+import itertools
+import threading
+
+# Transmisión de una sala a sus espectadores.
+# Cada evento de la partida (pregunta, acierto, marcador, fin) se codifica una sola vez y se
+# guarda en un búfer circular compartido; cada espectador solo tiene un cursor con la secuencia
+# del siguiente evento que le toca. El reparto se hace aparte, después de difundir a los
+# jugadores, así que el número de espectadores no retrasa a quienes juegan.
+# El reparto avanza por lotes de espectadores y cede el turno entre uno y otro, para que miles
+# de espectadores no acaparen el bucle de eventos ni el planificador.
+# Un espectador lento (con la cola de salida por encima del límite) no recibe nada mientras
+# tanto; cuando se pone al día recibe solo el último marcador y salta al final del búfer.
+
+CAPACIDAD = 64  # Eventos que se conservan por sala para los espectadores que van por detrás
+
+# Lo que queda por hacer tras un lote de 'Transmision.repartir'
+SEGUIR = 'seguir'          # Hay más espectadores o eventos nuevos: continuar en cuanto se pueda
+REINTENTAR = 'reintentar'  # Solo quedan espectadores atrasados: volver a intentarlo más tarde
+
+class Espectador:
+    __slots__ = ('conn', 'secuencia', 'atrasado')
+
+    def __init__(self, conn, secuencia):
+        self.conn = conn
+        self.secuencia = secuencia
+        self.atrasado = True  # Al entrar recibe el último marcador como cualquier espectador que se pone al día
+
+class Transmision:
+    """
+    Búfer compartido de eventos de una sala y los cursores de sus espectadores.
+    Tiene su propio bloqueo: publicar o repartir nunca toma el de la sala.
+    """
+    def __init__(self):
+        self.eventos = collections.deque(maxlen=CAPACIDAD)  # (secuencia, datos, clave)
+        self.siguiente = 0       # Secuencia del próximo evento
+        self.marcador = None     # Bytes del último marcador, lo único que recibe quien se pone al día
+        self.espectadores = {}   # Nombre -> Espectador
+        self.programada = False  # Ya hay un reparto en curso o pendiente en el planificador
+        self.pendientes = collections.deque()  # Espectadores que faltan en la pasada actual
+        self.version = 0         # Cambia con cada evento o espectador nuevo
+        self.version_pasada = 0  # Valor de 'version' al empezar la pasada actual
+        self.atrasados = False   # Algún espectador de la pasada actual iba atrasado
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.espectadores)
+
+    def agregar(self, nombre, conn):
+        with self.lock:
+            self.espectadores[nombre] = Espectador(conn, self.siguiente)
+            self.version += 1
+            return self._programar()
+
+    def quitar(self, nombre):
+        with self.lock:
+            self.espectadores.pop(nombre, None)
+
+    def publicar(self, datos, marcador=False):
+        """
+        Añade un evento ya codificado. Devuelve True si hay que programar un reparto
+        (no había ninguno pendiente).
+        """
+        with self.lock:
+            clave = 'marcador' if marcador else None
+            self.eventos.append((self.siguiente, datos, clave))
+            self.siguiente += 1
+            self.version += 1
+            if marcador:
+                self.marcador = datos
+            return self._programar()
+
+    def _programar(self):
+        if self.programada or not self.espectadores:
+            return False
+        self.programada = True
+        return True
+
+    def repartir(self, limite, lote):
+        """
+        Atiende a los siguientes 'lote' espectadores: calcula lo que le corresponde a cada uno y
+        avanza su cursor. Devuelve la lista de envíos (conexión, datos, clave), que se hacen fuera
+        del bloqueo, y lo que queda por hacer: SEGUIR, REINTENTAR o None si el reparto terminó.
+        """
+        envios = []
+        with self.lock:
+            if not self.pendientes:
+                self.pendientes.extend(self.espectadores.items())
+                self.version_pasada = self.version
+                self.atrasados = False
+            primera = self.eventos[0][0] if self.eventos else self.siguiente
+            for _ in range(min(lote, len(self.pendientes))):
+                nombre, espectador = self.pendientes.popleft()
+                if self.espectadores.get(nombre) is not espectador:
+                    continue  # Dejó de mirar durante la pasada
+                conn = espectador.conn
+                if conn.cerrada:
+                    del self.espectadores[nombre]
+                    continue
+                if conn.cola.bytes > limite:
+                    espectador.atrasado = self.atrasados = True
+                    continue
+                if espectador.atrasado or espectador.secuencia < primera:
+                    # Puesta al día con pérdidas: solo el último marcador
+                    if self.marcador is not None:
+                        envios.append((conn, self.marcador, 'marcador'))
+                    espectador.atrasado = False
+                else:
+                    for _, datos, clave in itertools.islice(self.eventos, espectador.secuencia - primera, None):
+                        envios.append((conn, datos, clave))
+                espectador.secuencia = self.siguiente
+            if self.pendientes or self.version != self.version_pasada:
+                return envios, SEGUIR
+            if self.atrasados:
+                return envios, REINTENTAR
+            self.programada = False
+        return envios, None